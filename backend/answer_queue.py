@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+from database import run_db, DEFAULT_EXAM_ID
+import grading
+import progress
+
+# A batch is committed when it is this old or this large, whichever comes first
+MAX_LATENCY_MS = float(os.environ.get("EXAM_ANSWER_MAX_LATENCY_MS", "50"))
+MAX_BATCH = int(os.environ.get("EXAM_ANSWER_MAX_BATCH", "500"))
+# Beyond this many uncommitted answers new ones are refused (HTTP 503)
+MAX_PENDING = int(os.environ.get("EXAM_ANSWER_MAX_PENDING", "20000"))
+# When set, /exam/answer responds only after its batch has been committed
+WAIT_FOR_COMMIT = os.environ.get("EXAM_ANSWER_WAIT_FOR_COMMIT", "1") != "0"
+# A batch failing this many times in a row is given up on (its answers are logged)
+MAX_ATTEMPTS = int(os.environ.get("EXAM_ANSWER_MAX_ATTEMPTS", "3"))
+
+logger = logging.getLogger("exam.answers")
+
+class QueueFull(Exception):
+    """Raised when too many answers are waiting to be committed"""
+
+def _write_batch(conn, rows):
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO answers (student_id, question_id, selected_answer, timestamp, exam_id)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (student_id, question_id) DO UPDATE SET
+            selected_answer = excluded.selected_answer,
+            timestamp = excluded.timestamp
+    ''', rows)
+    keys = [(row[4], row[0]) for row in rows]
+    grading.update_scores(cursor, keys)
+    progress.record_answers(cursor, keys)
+    conn.commit()
+
+def _write_rows(conn, rows):
+    """Write rows one transaction each; returns the rows refused with their error"""
+    refused = []
+    for row in rows:
+        try:
+            _write_batch(conn, [row])
+        except sqlite3.IntegrityError as e:
+            conn.rollback()
+            refused.append((row, e))
+    return refused
+
+def _fail(waiter, error):
+    if not waiter.done():
+        waiter.set_exception(error)
+        # Retrieve the exception so it is not reported as unhandled
+        waiter.exception()
+
+def _follow(waiter, newer):
+    """Settle waiter with the outcome of newer (an answer that superseded it)"""
+    def settle(done):
+        if waiter.done():
+            return
+        if done.exception() is not None:
+            _fail(waiter, done.exception())
+        else:
+            waiter.set_result(done.result())
+    newer.add_done_callback(settle)
+
+class AnswerQueue:
+    """Write-coalescing, group-committed answer ingestion
+
+    Answers are keyed by (student_id, question_id), so repeated clicks on the
+    same question collapse into one row. A background task commits the
+    pending set as one transaction per batch; callers can await that commit.
+
+    If the batch violates a constraint it is retried row by row, so only the
+    offending answers fail (and are logged). Other errors put the batch back
+    for the next flush, up to MAX_ATTEMPTS times before it is given up on.
+    """
+
+    def __init__(self, max_latency_ms=MAX_LATENCY_MS, max_batch=MAX_BATCH, max_pending=MAX_PENDING, max_attempts=MAX_ATTEMPTS):
+        self.max_latency = max_latency_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending = {}
+        self._waiters = {}
+        self._attempts = {}
+        self._has_work = None
+        self._full = None
+        self._task = None
+        self._flush_lock = None
+        self.enqueued = 0
+        self.coalesced = 0
+        self.committed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed_batches = 0
+        self.refused = 0
+        self.dropped = 0
+        self.largest_batch = 0
+        self.high_water = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._has_work = asyncio.Event()
+            self._full = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Commit everything still pending and stop the flusher"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pending:
+            await self.flush()
+
+    def enqueue(self, student_id, question_id, selected_answer, timestamp, exam_id=DEFAULT_EXAM_ID):
+        """Queue an answer; returns a future resolved when it is committed"""
+        self.start()
+        key = (student_id, question_id)
+        if key in self._pending:
+            self.coalesced += 1
+        elif len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise QueueFull("Too many answers waiting to be saved, please retry")
+
+        waiter = self._waiters.get(key)
+        if waiter is None:
+            waiter = self._waiters[key] = asyncio.get_running_loop().create_future()
+        self._pending[key] = (selected_answer, timestamp, exam_id)
+        self.enqueued += 1
+        self.high_water = max(self.high_water, len(self._pending))
+
+        self._has_work.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return waiter
+
+    def pending_for(self, student_id, exam_id=None):
+        """Answers for a student (in one exam) that are queued but not yet committed"""
+        return {
+            question_id: selected
+            for (sid, question_id), (selected, _, answer_exam) in list(self._pending.items())
+            if sid == student_id and exam_id in (None, answer_exam)
+        }
+
+    def has_pending(self, student_id, question_ids):
+        """Whether any of these answers of a student is queued but not yet committed"""
+        return any((student_id, question_id) in self._pending for question_id in question_ids)
+
+    async def flush(self):
+        """Commit the pending set now"""
+        if self._flush_lock is None:
+            self.start()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, waiters, attempts = self._pending, self._waiters, self._attempts
+            self._pending, self._waiters, self._attempts = {}, {}, {}
+            self._full.clear()
+
+            rows = [
+                (student_id, question_id, selected, timestamp, exam_id)
+                for (student_id, question_id), (selected, timestamp, exam_id) in batch.items()
+            ]
+            started = time.perf_counter()
+            refused = []
+            try:
+                await run_db(_write_batch, rows)
+            except sqlite3.IntegrityError:
+                # Retrying will not help the bad rows; keep the good ones
+                refused = await run_db(_write_rows, rows)
+            except Exception as e:
+                self.failed_batches += 1
+                self._retry(batch, waiters, attempts, e)
+                raise
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            self.batches += 1
+
+            for row, error in refused:
+                logger.error("Answer refused by the database (%s): %r", error, row)
+                _fail(waiters.pop((row[0], row[1])), error)
+            self.refused += len(refused)
+            written = len(rows) - len(refused)
+            self.committed += written
+            self.largest_batch = max(self.largest_batch, written)
+            for waiter in waiters.values():
+                if not waiter.done():
+                    waiter.set_result(written)
+
+    def _retry(self, batch, waiters, attempts, error):
+        """Put a failed batch back for the next flush, dropping answers out of attempts"""
+        loop = asyncio.get_running_loop()
+        for key, value in batch.items():
+            tries = attempts.get(key, 0) + 1
+            newer = self._waiters.get(key)
+            if newer is not None:
+                # A newer answer arrived meanwhile and replaces this one
+                _follow(waiters[key], newer)
+            elif tries >= self.max_attempts:
+                self.dropped += 1
+                logger.error("Answer dropped after %d failed attempts (%s): %r", tries, error, (key, value))
+                _fail(waiters[key], error)
+            else:
+                self._pending[key] = value
+                self._attempts[key] = tries
+                # The caller already sees the error; later waiters share the retry
+                _fail(waiters[key], error)
+                self._waiters[key] = loop.create_future()
+
+    async def _run(self):
+        while True:
+            await self._has_work.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.max_latency)
+            except asyncio.TimeoutError:
+                pass
+            if not self._pending:
+                self._has_work.clear()
+                continue
+            try:
+                await self.flush()
+            except Exception:
+                # Waiters received the error; keep serving later batches
+                pass
+            if not self._pending:
+                self._has_work.clear()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "high_water": self.high_water,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "committed": self.committed,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "refused": self.refused,
+            "dropped": self.dropped,
+            "largest_batch": self.largest_batch,
+            "rejected": self.rejected,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_latency_ms": self.max_latency * 1000,
+            "max_batch": self.max_batch,
+            "max_pending": self.max_pending,
+            "max_attempts": self.max_attempts,
+            "wait_for_commit": WAIT_FOR_COMMIT
+        }
+
+answer_queue = AnswerQueue()
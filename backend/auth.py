@@ -0,0 +1,178 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from database import get_db
+
+# Shared signing key; by default it is generated once and kept in the database
+TOKEN_SECRET = os.environ.get("EXAM_TOKEN_SECRET")
+STUDENT_TOKEN_MINUTES = int(os.environ.get("EXAM_STUDENT_TOKEN_MINUTES", "240"))
+ADMIN_TOKEN_MINUTES = int(os.environ.get("EXAM_ADMIN_TOKEN_MINUTES", "720"))
+# Testing only: 0 accepts requests without a token, and such requests are
+# trusted to name their own student. Never set it on a real exam.
+AUTH_REQUIRED = os.environ.get("EXAM_REQUIRE_AUTH", "1") != "0"
+
+TOKEN_VERSION = "v1"
+
+logger = logging.getLogger("exam.auth")
+
+class InvalidToken(Exception):
+    pass
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _load_secret(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT secret FROM token_secret WHERE id = 1")
+    return cursor.fetchone()['secret']
+
+class TokenSigner:
+    """HMAC-signed, expiring session tokens checked without touching the database
+
+    A token is "v1.<payload>.<signature>" where the payload carries the
+    subject, role, issue time, expiry and a random id. Revocations are
+    kept in memory: single tokens until they expire, and per-subject
+    cut-offs that invalidate everything issued before them.
+    """
+
+    def __init__(self, secret=TOKEN_SECRET):
+        self._secret = secret.encode() if secret else None
+        self._revoked = {}
+        self._cutoffs = {}
+        self._lock = threading.Lock()
+        self.issued = 0
+        self.rejected = 0
+
+    def load(self):
+        """Read the signing key (once, before serving requests)"""
+        if not AUTH_REQUIRED:
+            logger.warning(
+                "EXAM_REQUIRE_AUTH=0: requests without a session token are accepted and any "
+                "client can act as any student. This is for local testing only."
+            )
+        with self._lock:
+            if self._secret is None:
+                with get_db(readonly=True) as conn:
+                    self._secret = _load_secret(conn).encode()
+
+    def _sign(self, payload):
+        if self._secret is None:
+            self.load()
+        return _b64encode(hmac.new(self._secret, f"{TOKEN_VERSION}.{payload}".encode(), hashlib.sha256).digest())
+
+    def issue(self, subject, role, minutes):
+        """Return (token, expires_at_epoch_seconds)"""
+        now = time.time()
+        claims = {
+            "sub": subject,
+            "role": role,
+            # Full precision: a subject cut-off taken just before must not reject it
+            "iat": now,
+            "exp": int(now + minutes * 60),
+            "jti": secrets.token_urlsafe(9)
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        self.issued += 1
+        return f"{TOKEN_VERSION}.{payload}.{self._sign(payload)}", claims["exp"]
+
+    def verify(self, token):
+        """Return the claims of a valid token or raise InvalidToken"""
+        try:
+            version, payload, signature = token.split(".")
+        except ValueError:
+            raise InvalidToken("Malformed token")
+        # As bytes: compare_digest refuses non-ASCII str, which must be a 401, not a 500
+        expected = self._sign(payload).encode()
+        if version != TOKEN_VERSION or not hmac.compare_digest(signature.encode(), expected):
+            raise InvalidToken("Bad token signature")
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise InvalidToken("Malformed token")
+
+        if claims["exp"] < time.time():
+            raise InvalidToken("Token expired")
+        if claims["jti"] in self._revoked:
+            raise InvalidToken("Token revoked")
+        cutoff = self._cutoffs.get((claims["role"], claims["sub"]))
+        if cutoff is not None and claims["iat"] < cutoff:
+            raise InvalidToken("Token revoked")
+        return claims
+
+    def revoke(self, claims):
+        """Reject this one token from now on"""
+        now = time.time()
+        with self._lock:
+            self._revoked[claims["jti"]] = claims["exp"]
+            # Forget revocations of tokens that have expired anyway
+            for jti in [jti for jti, exp in self._revoked.items() if exp < now]:
+                del self._revoked[jti]
+
+    def revoke_subject(self, role, subject):
+        """Reject every token issued to this subject so far"""
+        with self._lock:
+            self._cutoffs[(role, subject)] = time.time()
+
+    def stats(self):
+        return {
+            "required": AUTH_REQUIRED,
+            "issued": self.issued,
+            "rejected": self.rejected,
+            "revoked_tokens": len(self._revoked),
+            "revoked_subjects": len(self._cutoffs)
+        }
+
+tokens = TokenSigner()
+
+def _token_from(request):
+    """Bearer header, or ?token= for EventSource and <img> requests that cannot set headers"""
+    header = request.headers.get("authorization", "")
+    if header[:7].lower() == "bearer ":
+        return header[7:].strip()
+    return request.query_params.get("token")
+
+def _claims(request, role):
+    token = _token_from(request)
+    if not token:
+        if AUTH_REQUIRED:
+            raise HTTPException(status_code=401, detail="Not logged in", headers={"WWW-Authenticate": "Bearer"})
+        return None
+    try:
+        claims = tokens.verify(token)
+    except InvalidToken as e:
+        tokens.rejected += 1
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+    if claims["role"] != role:
+        raise HTTPException(status_code=403, detail="Not allowed")
+    return claims
+
+def current_student(request: Request) -> Optional[dict]:
+    """Dependency: claims of the logged-in student (None only when auth is optional)"""
+    return _claims(request, "student")
+
+def current_admin(request: Request) -> Optional[dict]:
+    """Dependency: claims of the logged-in admin (None only when auth is optional)"""
+    return _claims(request, "admin")
+
+def check_student(claims, student_id):
+    """Stop a student from acting for somebody else
+
+    A token, when present, always decides who the student is; the
+    student_id in the request is only trusted without one, which
+    AUTH_REQUIRED rules out outside of tests.
+    """
+    if claims is not None and claims["sub"] != student_id:
+        raise HTTPException(status_code=403, detail="Token does not belong to this student")
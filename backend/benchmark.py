@@ -0,0 +1,428 @@
+"""Simulate an exam-day cohort against the API and report per-route latency
+
+Usage (from the backend directory):
+    python benchmark.py [--students 200] [--duration 60]
+                        [--uvicorn [--workers 2] | --url http://127.0.0.1:8000]
+                        [--save baseline.json] [--compare baseline.json]
+
+Every simulated student logs in at the same moment, loads the question
+paper and previous answers, polls the exam status, clicks answers, uploads
+proctoring frames and finally submits. With --sync-interval the clicks are
+journaled and sent in batches to /exam/answers/sync, as the web client does. Each request is timed; the report
+lists throughput, p50/p95/p99 per route and "database is locked" errors.
+
+By default the app is driven in-process through httpx's ASGI transport;
+--uvicorn starts a local server instead. Both run on a scratch database and
+screenshot directory, so exam.db is never touched. --url targets a server
+that is already running: it gets a new "Benchmark" exam and bench-* students.
+
+Password hashing dominates the login storm and the student import; set
+EXAM_KDF_N (e.g. 1024) for quicker runs that leave logins out of the picture.
+
+--save writes the results as a baseline; --compare checks a run against one
+and exits with status 1 if any route got slower or failed more often.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+try:
+    import httpx
+except ImportError:  # only needed for benchmarking
+    httpx = None
+
+STUDENT_PREFIX = "bench-"
+LETTERS = "ABCDE"
+# Differences below this are noise, whatever the relative change
+NOISE_FLOOR_MS = 5.0
+# Shed logins (429) are retried this many times; each refusal still counts as an error
+LOGIN_ATTEMPTS = 10
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+class Recorder:
+    """Latency samples and outcomes per route label"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.lock_errors = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    async def call(self, client, label, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.samples[label].append((time.perf_counter() - started) * 1000)
+            self.statuses[label][type(e).__name__] += 1
+            return None
+        self.samples[label].append((time.perf_counter() - started) * 1000)
+        self.statuses[label][response.status_code] += 1
+        if response.status_code >= 500 and "locked" in response.text:
+            self.lock_errors += 1
+        return response
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        routes = {}
+        for label, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            statuses = self.statuses[label]
+            errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400)
+            routes[label] = {
+                "count": len(samples),
+                "errors": errors,
+                "statuses": {str(status): count for status, count in statuses.items()},
+                "rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(samples, 0.50), 2),
+                "p95_ms": round(percentile(samples, 0.95), 2),
+                "p99_ms": round(percentile(samples, 0.99), 2),
+                "max_ms": round(samples[-1], 2)
+            }
+        total = sum(route["count"] for route in routes.values())
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "requests": total,
+            "rps": round(total / elapsed, 2),
+            "errors": sum(route["errors"] for route in routes.values()),
+            "lock_errors": self.lock_errors,
+            "routes": routes
+        }
+
+def make_frames(count, seed):
+    """A few distinct noise frames, so deduplication keeps them"""
+    from PIL import Image
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, size=(240, 320, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=70)
+        frames.append(buffer.getvalue())
+    return frames
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+async def setup_exam(client, args):
+    """Admin side: questions, students and a running exam; returns (exam_id, admin headers)"""
+    response = await client.post("/admin/login", json={"password": args.admin_password})
+    response.raise_for_status()
+    admin = bearer(response.json()["token"])
+
+    response = await client.post("/admin/exams", headers=admin, json={
+        "title": f"Benchmark {time.strftime('%Y-%m-%d %H:%M:%S')}",
+        "duration_minutes": 60
+    })
+    response.raise_for_status()
+    exam_id = response.json()["exam_id"]
+
+    questions = [
+        {
+            "question": f"Benchmark question {i + 1}",
+            "options": {letter: f"Option {letter} of {i + 1}" for letter in LETTERS},
+            "correct": LETTERS[i % len(LETTERS)]
+        }
+        for i in range(args.questions)
+    ]
+    response = await client.post(f"/admin/exams/{exam_id}/upload-questions", headers=admin, json={"questions": questions})
+    response.raise_for_status()
+
+    roster = "".join(
+        json.dumps({"student_id": f"{STUDENT_PREFIX}{i:05d}", "name": f"Bench {i}", "password": f"pw-{i}"}) + "\n"
+        for i in range(args.students)
+    )
+    response = await client.post(
+        "/admin/import-students?format=jsonl&on_conflict=update",
+        headers=admin, content=roster.encode(), timeout=None
+    )
+    response.raise_for_status()
+
+    minutes = max(1, math.ceil(args.duration / 60) + 5)
+    response = await client.post(f"/admin/exams/{exam_id}/start-exam?duration_minutes={minutes}", headers=admin)
+    response.raise_for_status()
+    return exam_id, admin
+
+async def student(client, recorder, args, exam_id, index, frames, start, stop_at):
+    rng = random.Random(args.seed * 100003 + index)
+    student_id = f"{STUDENT_PREFIX}{index:05d}"
+    base = f"/exam/exams/{exam_id}"
+    await start.wait()
+
+    for _ in range(LOGIN_ATTEMPTS):
+        response = await recorder.call(client, "POST /exam/student-login", "POST", "/exam/student-login",
+                                       json={"student_id": student_id, "password": f"pw-{index}"})
+        if response is None or response.status_code not in (429, 503):
+            break
+        # Shed by the server: try again after the pause it asked for, as a student would
+        await asyncio.sleep(float(response.headers.get("retry-after", "1")) * rng.uniform(1, 2))
+    if response is None or response.status_code != 200:
+        return
+    headers = bearer(response.json()["token"])
+
+    response = await recorder.call(client, "GET /exam/exams/{id}/questions", "GET", f"{base}/questions", headers=headers)
+    if response is None or response.status_code != 200:
+        return
+    question_ids = [q["id"] for q in response.json()["questions"]]
+    await recorder.call(client, "GET /exam/exams/{id}/my-answers/{sid}", "GET", f"{base}/my-answers/{student_id}", headers=headers)
+
+    now = time.monotonic()
+    # Spread each student's schedule so the cohort does not act in lockstep
+    next_status = now + rng.uniform(0, args.status_interval)
+    next_answer = now + rng.uniform(0, args.answer_interval)
+    next_frame = now + rng.uniform(0, args.screenshot_interval) if args.screenshot_interval > 0 else math.inf
+    next_sync = now + rng.uniform(0, args.sync_interval) if args.sync_interval > 0 else math.inf
+    journal = []
+    seq = 0
+
+    async def sync():
+        response = await recorder.call(client, "POST /exam/exams/{id}/answers/sync", "POST", f"{base}/answers/sync", headers=headers, json={
+            "student_id": student_id,
+            "changes": list(journal)
+        })
+        if response is not None and response.status_code == 200:
+            last_seq = response.json()["last_seq"]
+            journal[:] = [change for change in journal if change["seq"] > last_seq]
+
+    while True:
+        wake = min(next_status, next_answer, next_frame, next_sync)
+        if wake >= stop_at:
+            break
+        await asyncio.sleep(max(0.0, wake - time.monotonic()))
+
+        if wake == next_status:
+            await recorder.call(client, "GET /exam/exams/{id}/status", "GET", f"{base}/status", headers=headers)
+            next_status += args.status_interval
+        elif wake == next_answer and args.sync_interval > 0:
+            seq += 1
+            journal.append({"seq": seq, "question_id": rng.choice(question_ids), "selected_answer": rng.choice(LETTERS)})
+            next_answer += rng.expovariate(1 / args.answer_interval)
+        elif wake == next_answer:
+            await recorder.call(client, "POST /exam/exams/{id}/answer", "POST", f"{base}/answer", headers=headers, json={
+                "student_id": student_id,
+                "question_id": rng.choice(question_ids),
+                "selected_answer": rng.choice(LETTERS)
+            })
+            next_answer += rng.expovariate(1 / args.answer_interval)
+        elif wake == next_sync:
+            if journal:
+                await sync()
+            next_sync += args.sync_interval
+        else:
+            await recorder.call(
+                client, "POST /proctor/screenshot/{sid}", "POST",
+                f"/proctor/screenshot/{student_id}?exam_id={exam_id}",
+                headers={**headers, "Content-Type": "image/jpeg"}, content=rng.choice(frames)
+            )
+            next_frame += args.screenshot_interval
+
+    if journal:
+        await sync()
+    await recorder.call(client, "POST /exam/exams/{id}/submit", "POST", f"{base}/submit?student_id={student_id}", headers=headers)
+
+async def run_cohort(client, args):
+    print(f"Setting up {args.students} students and {args.questions} questions...")
+    exam_id, admin = await setup_exam(client, args)
+    frames = make_frames(8, args.seed) if args.screenshot_interval > 0 else []
+
+    recorder = Recorder()
+    start = asyncio.Event()
+    stop_at = time.monotonic() + args.duration
+    tasks = [
+        asyncio.ensure_future(student(client, recorder, args, exam_id, i, frames, start, stop_at))
+        for i in range(args.students)
+    ]
+    print(f"Running for {args.duration:g}s...")
+    recorder.started = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    recorder.finished = time.perf_counter()
+
+    await client.post(f"/admin/exams/{exam_id}/stop-exam", headers=admin)
+    return recorder.report()
+
+async def run_in_process(args):
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    await main.app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=args.timeout) as client:
+            return await run_cohort(client, args)
+    finally:
+        await main.app.router.shutdown()
+
+async def run_against(url, args):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        return await run_cohort(client, args)
+
+def start_uvicorn(args, env):
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return server, url
+        except httpx.HTTPError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn did not come up")
+
+def print_report(report):
+    print()
+    print(f"{'route':<40} {'count':>7} {'errors':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for label, route in report["routes"].items():
+        print(f"{label:<40} {route['count']:>7} {route['errors']:>6} {route['rps']:>8.2f} "
+              f"{route['p50_ms']:>8.1f} {route['p95_ms']:>8.1f} {route['p99_ms']:>8.1f} {route['max_ms']:>8.1f}")
+    print(f"\n{report['requests']} requests in {report['elapsed_seconds']}s "
+          f"({report['rps']} req/s), {report['errors']} errors, {report['lock_errors']} database lock errors")
+    print("latencies in ms")
+
+def compare(report, baseline, tolerance):
+    """Regressions of this run against a saved one, as readable lines"""
+    problems = []
+    for label, before in baseline["routes"].items():
+        after = report["routes"].get(label)
+        if after is None:
+            problems.append(f"{label}: not exercised in this run")
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if after[key] > before[key] * (1 + tolerance) and after[key] - before[key] > NOISE_FLOOR_MS:
+                problems.append(f"{label}: {key} {before[key]} -> {after[key]}")
+        before_rate = before["errors"] / max(1, before["count"])
+        after_rate = after["errors"] / max(1, after["count"])
+        if after_rate > before_rate + 0.01:
+            problems.append(f"{label}: error rate {before_rate:.1%} -> {after_rate:.1%}")
+    if report["lock_errors"] > baseline.get("lock_errors", 0):
+        problems.append(f"database lock errors {baseline.get('lock_errors', 0)} -> {report['lock_errors']}")
+    return problems
+
+def machine():
+    """Where a run was recorded; latencies only compare on the same kind of machine"""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        # Settings that change the numbers (EXAM_KDF_N above all)
+        "env": {
+            name: value for name, value in sorted(os.environ.items())
+            if name.startswith("EXAM_") and name not in ("EXAM_DB_PATH", "EXAM_SCREENSHOTS_DIR")
+        },
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=200, help="simulated cohort size")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of exam activity after the login storm")
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--status-interval", type=float, default=3, help="seconds between /status polls per student")
+    parser.add_argument("--answer-interval", type=float, default=10, help="mean seconds between answer clicks per student")
+    parser.add_argument("--sync-interval", type=float, default=0, help="seconds between batched answer syncs per student (0: one /answer per click)")
+    parser.add_argument("--screenshot-interval", type=float, default=30, help="seconds between frames per student (0: none)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="benchmark a server that is already running")
+    target.add_argument("--uvicorn", action="store_true", help="start a local uvicorn on scratch data")
+    parser.add_argument("--port", type=int, default=8765, help="port for --uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --uvicorn")
+    parser.add_argument("--connections", type=int, default=256, help="client connection limit over HTTP")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="fail if slower than this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative latency increase for --compare")
+    args = parser.parse_args()
+
+    if httpx is None:
+        raise SystemExit("benchmark.py needs httpx (pip install httpx)")
+
+    scratch = None
+    server = None
+    if not args.url:
+        scratch = tempfile.mkdtemp(prefix="exam-bench-")
+        os.environ["EXAM_DB_PATH"] = os.path.join(scratch, "exam.db")
+        os.environ["EXAM_SCREENSHOTS_DIR"] = os.path.join(scratch, "screenshots")
+    try:
+        if args.url:
+            report = asyncio.run(run_against(args.url.rstrip("/"), args))
+        elif args.uvicorn:
+            server, url = start_uvicorn(args, dict(os.environ))
+            report = asyncio.run(run_against(url, args))
+        else:
+            report = asyncio.run(run_in_process(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report["config"] = {
+        "target": args.url or ("uvicorn" if args.uvicorn else "in-process"),
+        "workers": args.workers if args.uvicorn else None,
+        "students": args.students,
+        "duration": args.duration,
+        "questions": args.questions,
+        "status_interval": args.status_interval,
+        "answer_interval": args.answer_interval,
+        "screenshot_interval": args.screenshot_interval,
+        "sync_interval": args.sync_interval,
+        "seed": args.seed
+    }
+    report["machine"] = machine()
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print(f"\nNote: {args.compare} was recorded with different settings: {baseline.get('config')}")
+        recorded_on = baseline.get("machine", {})
+        if {key: recorded_on.get(key) for key in ("platform", "cpus", "env")} != {key: report["machine"][key] for key in ("platform", "cpus", "env")}:
+            print(f"\nNote: {args.compare} was recorded on another machine or environment: {recorded_on}")
+        problems = compare(report, baseline, args.tolerance)
+        if problems:
+            print(f"\nRegressions against {args.compare}:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# scrypt cost: N=2**14, r=8 needs 16 MiB and roughly 50 ms per hash
+KDF_N = int(os.environ.get("EXAM_KDF_N", str(2 ** 14)))
+KDF_R = int(os.environ.get("EXAM_KDF_R", "8"))
+KDF_P = int(os.environ.get("EXAM_KDF_P", "1"))
+# hashlib.scrypt releases the GIL, so threads hash in parallel
+KDF_WORKERS = int(os.environ.get("EXAM_KDF_WORKERS", str(min(4, os.cpu_count() or 2))))
+# Logins waiting for or running the KDF beyond this are answered with 429
+MAX_PENDING_LOGINS = int(os.environ.get("EXAM_MAX_PENDING_LOGINS", "64"))
+# Successful verifications are remembered this long (0 disables the cache)
+VERIFY_CACHE_SECONDS = float(os.environ.get("EXAM_VERIFY_CACHE_SECONDS", "60"))
+VERIFY_CACHE_SIZE = 10000
+
+SCHEME = "scrypt"
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+def hash_password(password, n=KDF_N, r=KDF_R, p=KDF_P):
+    """Encode a password as "scrypt$n$r$p$salt$hash" (blocking)"""
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(digest)}"
+
+def is_hashed(stored):
+    return stored.startswith(SCHEME + "$")
+
+def needs_rehash(stored):
+    """Plaintext rows and hashes made with older cost settings"""
+    if not is_hashed(stored):
+        return True
+    _, n, r, p, _, _ = stored.split("$")
+    return (int(n), int(r), int(p)) != (KDF_N, KDF_R, KDF_P)
+
+def verify_password(password, stored):
+    """Constant-time check of a password against a stored hash or legacy plaintext (blocking)"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        digest = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+def _verify_and_upgrade(password, stored):
+    """Verify, and on success return a fresh hash if the stored one is outdated"""
+    if not verify_password(password, stored):
+        return False, None
+    return True, hash_password(password) if needs_rehash(stored) else None
+
+class LoginBusy(Exception):
+    """Too many logins are already waiting for the password hasher"""
+
+class CredentialService:
+    """Password hashing off the event loop with load shedding and a short verify cache
+
+    The cache maps an account to a keyed fingerprint of (stored hash,
+    password), so it only answers for the exact credentials that last
+    succeeded and stops matching as soon as the stored password changes.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pending = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._key = secrets.token_bytes(32)
+        # Unknown accounts are checked against this so they cost the same as real ones
+        self._dummy = None
+        self.verified = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.rehashed = 0
+        self.shed = 0
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+
+    async def hash(self, password):
+        """Hash a new password in the KDF pool"""
+        return await self._run(hash_password, password)
+
+    async def hash_many(self, passwords):
+        return await asyncio.gather(*(self.hash(password) for password in passwords))
+
+    def _fingerprint(self, stored, password):
+        return hmac.new(self._key, f"{stored}\0{password}".encode(), hashlib.sha256).digest()
+
+    def _cached(self, account, stored, password):
+        with self._lock:
+            entry = self._cache.get(account)
+            if entry is None:
+                return False
+            fingerprint, expires = entry
+            if expires < time.monotonic():
+                del self._cache[account]
+                return False
+        return hmac.compare_digest(fingerprint, self._fingerprint(stored, password))
+
+    def _remember(self, account, stored, password):
+        if VERIFY_CACHE_SECONDS <= 0:
+            return
+        entry = (self._fingerprint(stored, password), time.monotonic() + VERIFY_CACHE_SECONDS)
+        with self._lock:
+            self._cache[account] = entry
+            self._cache.move_to_end(account)
+            while len(self._cache) > VERIFY_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    async def verify(self, account, password, stored):
+        """Check a login attempt
+
+        Returns (ok, new_hash); new_hash is set when the stored value was
+        plaintext or used older KDF settings and should be written back.
+        Pass stored=None for an unknown account. Raises LoginBusy instead
+        of queueing when MAX_PENDING_LOGINS attempts are already in flight.
+        """
+        if stored is not None and self._cached(account, stored, password):
+            self.cache_hits += 1
+            return True, None
+
+        if self._pending >= MAX_PENDING_LOGINS:
+            self.shed += 1
+            raise LoginBusy()
+        self._pending += 1
+        try:
+            if stored is None:
+                if self._dummy is None:
+                    self._dummy = await self.hash(secrets.token_hex(16))
+                await self._run(verify_password, password, self._dummy)
+                ok, new_hash = False, None
+            else:
+                ok, new_hash = await self._run(_verify_and_upgrade, password, stored)
+        finally:
+            self._pending -= 1
+
+        if not ok:
+            self.failed += 1
+            return False, None
+        self.verified += 1
+        if new_hash is not None:
+            self.rehashed += 1
+        self._remember(account, new_hash or stored, password)
+        return True, new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "kdf": f"{SCHEME} n={KDF_N} r={KDF_R} p={KDF_P}",
+            "workers": KDF_WORKERS,
+            "pending": self._pending,
+            "max_pending": MAX_PENDING_LOGINS,
+            "verified": self.verified,
+            "failed": self.failed,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache),
+            "rehashed": self.rehashed,
+            "shed": self.shed
+        }
+
+passwords = CredentialService()
@@ -1,14 +1,36 @@
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+import asyncio
+import contextvars
+import functools
 import os
+import queue
+import threading
+import time
 
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), "exam.db")
+import metrics
+
+DATABASE_PATH = os.environ.get("EXAM_DB_PATH", os.path.join(os.path.dirname(__file__), "exam.db"))
+# Exam used by the routes that do not name one (the pre-multi-exam API)
+DEFAULT_EXAM_ID = 1
+
+# Connection pool tuning
+READ_POOL_SIZE = int(os.environ.get("EXAM_DB_READ_POOL_SIZE", "8"))
+WRITE_POOL_SIZE = 1  # SQLite allows a single writer; serialize in-process instead of on file locks
+POOL_TIMEOUT = float(os.environ.get("EXAM_DB_POOL_TIMEOUT", "10"))
+BUSY_TIMEOUT_MS = int(os.environ.get("EXAM_DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
 
 def init_db():
     """Initialize database with required tables"""
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
     
+    # WAL lets readers proceed while a write is in progress (persisted in the file)
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
     # Admin credentials table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS admin_credentials (
@@ -87,14 +109,458 @@ def init_db():
     ''')
     
     conn.commit()
+    
+    # Bring existing databases up to the current schema
+    migrate(conn)
     conn.close()
 
-@contextmanager
-def get_db():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+def _add_exam_status_version(cursor):
+    """Version counter used to invalidate cached exam state across workers"""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(exam_status)")]
+    if "version" not in columns:
+        cursor.execute("ALTER TABLE exam_status ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+def _index_answers_and_screenshots(cursor):
+    """One answer per student and question; screenshot lookups by student and time"""
+    # Keep only the latest answer where duplicates slipped in
+    cursor.execute('''
+        DELETE FROM answers
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM answers GROUP BY student_id, question_id
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_answers_student_question
+        ON answers (student_id, question_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_screenshots_student_timestamp
+        ON screenshots (student_id, timestamp)
+    ''')
+
+def _index_answer_timestamps(cursor):
+    """Incremental submission exports filter on answer time"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_answers_timestamp ON answers (timestamp)")
+
+def _create_scores(cursor):
+    """Running per-student scores maintained by the answer writer"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scores (
+            student_id TEXT PRIMARY KEY,
+            answered INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scores_correct ON scores (correct DESC, updated_at)")
+    # Frozen copy of the grading query of this schema version; later
+    # migrations change the scores table, so do not call grading here
+    cursor.execute('''
+        INSERT OR REPLACE INTO scores (student_id, answered, correct, updated_at)
+        SELECT a.student_id,
+               COUNT(*),
+               SUM(CASE WHEN UPPER(TRIM(a.selected_answer)) = UPPER(TRIM(q.correct_answer)) THEN 1 ELSE 0 END),
+               MAX(a.timestamp)
+        FROM answers a
+        JOIN questions q ON q.id = a.question_id
+        GROUP BY a.student_id
+    ''')
+
+def _add_screenshot_metadata(cursor):
+    """Stored format, size and thumbnail of each frame after transcoding"""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(screenshots)")]
+    for name, definition in [
+        ("format", "TEXT"),
+        ("size_bytes", "INTEGER"),
+        ("width", "INTEGER"),
+        ("height", "INTEGER"),
+        ("thumbnail", "TEXT"),
+    ]:
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE screenshots ADD COLUMN {name} {definition}")
+
+def _add_screenshot_dedup(cursor):
+    """Perceptual hash of kept frames and how many near-duplicates followed each"""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(screenshots)")]
+    if "phash" not in columns:
+        cursor.execute("ALTER TABLE screenshots ADD COLUMN phash TEXT")
+    if "duplicates" not in columns:
+        cursor.execute("ALTER TABLE screenshots ADD COLUMN duplicates INTEGER NOT NULL DEFAULT 0")
+
+def _create_token_secret(cursor):
+    """Key for signing session tokens, shared by every worker on this database"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS token_secret (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            secret TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO token_secret (id, secret) VALUES (1, lower(hex(randomblob(32))))")
+
+def _create_exams(cursor):
+    """Exams as first-class rows; the singleton exam_status becomes exam 1"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exams (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            is_active INTEGER NOT NULL DEFAULT 0,
+            start_time TEXT,
+            duration_minutes INTEGER NOT NULL DEFAULT 60,
+            version INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO exams (id, title, is_active, start_time, duration_minutes, version, created_at)
+        SELECT 1, 'Default exam', COALESCE(is_active, 0), start_time, COALESCE(duration_minutes, 60), version,
+               strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')
+        FROM exam_status WHERE id = 1
+    ''')
+
+    # Existing questions, answers and frames belong to the default exam
+    for table in ("questions", "answers", "screenshots"):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if "exam_id" not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN exam_id INTEGER NOT NULL DEFAULT {DEFAULT_EXAM_ID}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_questions_exam ON questions (exam_id, id)")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_answers_exam_student
+        ON answers (exam_id, student_id, question_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_screenshots_exam_student
+        ON screenshots (exam_id, student_id, timestamp)
+    ''')
+
+    # Scores are kept per exam and student
+    cursor.execute("DROP INDEX IF EXISTS idx_scores_correct")
+    cursor.execute("ALTER TABLE scores RENAME TO scores_old")
+    cursor.execute('''
+        CREATE TABLE scores (
+            exam_id INTEGER NOT NULL,
+            student_id TEXT NOT NULL,
+            answered INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (exam_id, student_id)
+        )
+    ''')
+    cursor.execute("DROP TABLE scores_old")
+    cursor.execute("CREATE INDEX idx_scores_exam_correct ON scores (exam_id, correct DESC, updated_at)")
+    # Frozen copy of the grading query of this schema version (see _create_scores)
+    cursor.execute('''
+        INSERT INTO scores (exam_id, student_id, answered, correct, updated_at)
+        SELECT a.exam_id,
+               a.student_id,
+               COUNT(*),
+               SUM(CASE WHEN UPPER(TRIM(a.selected_answer)) = UPPER(TRIM(q.correct_answer)) THEN 1 ELSE 0 END),
+               MAX(a.timestamp)
+        FROM answers a
+        JOIN questions q ON q.id = a.question_id
+        GROUP BY a.exam_id, a.student_id
+    ''')
+
+def _create_attempts(cursor):
+    """Each student's sitting of a running exam: own start, extra time and submission"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attempts (
+            exam_id INTEGER NOT NULL,
+            student_id TEXT NOT NULL,
+            started_at TEXT,
+            extra_minutes INTEGER NOT NULL DEFAULT 0,
+            submitted_at TEXT,
+            submitted_by TEXT,
+            PRIMARY KEY (exam_id, student_id)
+        )
+    ''')
+
+def _create_answer_sync(cursor):
+    """Last change sequence applied per student by /exam/answers/sync"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS answer_sync (
+            exam_id INTEGER NOT NULL,
+            student_id TEXT NOT NULL,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            synced_at TEXT,
+            PRIMARY KEY (exam_id, student_id)
+        )
+    ''')
+
+def _create_progress(cursor):
+    """Per-student live progress for the admin dashboard, versioned for delta reads"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS progress (
+            exam_id INTEGER NOT NULL,
+            student_id TEXT NOT NULL,
+            answered INTEGER NOT NULL DEFAULT 0,
+            last_answer_at TEXT,
+            last_screenshot_at TEXT,
+            last_seen_at TEXT,
+            online INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (exam_id, student_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_progress_exam_version ON progress (exam_id, version)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_progress_online_seen ON progress (online, last_seen_at)")
+    cursor.execute('''
+        INSERT INTO progress (exam_id, student_id, answered, last_answer_at, version)
+        SELECT exam_id, student_id, answered, updated_at, 1
+        FROM scores
+        WHERE true
+        ON CONFLICT (exam_id, student_id) DO NOTHING
+    ''')
+    cursor.execute('''
+        INSERT INTO progress (exam_id, student_id, last_screenshot_at, version)
+        SELECT exam_id, student_id, MAX(timestamp), 1
+        FROM screenshots
+        WHERE true
+        GROUP BY exam_id, student_id
+        ON CONFLICT (exam_id, student_id) DO UPDATE SET
+            last_screenshot_at = excluded.last_screenshot_at
+    ''')
+
+def _add_attempts_version(cursor):
+    """Counter bumped with every attempt change, so workers know when their copy is stale
+
+    Separate from exams.version, which would recompile the question paper
+    and push a status event on every submission.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(exams)")]
+    if "attempts_version" not in columns:
+        cursor.execute("ALTER TABLE exams ADD COLUMN attempts_version INTEGER NOT NULL DEFAULT 0")
+
+# Schema migrations, applied in order and tracked in PRAGMA user_version.
+# Append new entries; never edit or reorder released ones.
+MIGRATIONS = [
+    (1, _add_exam_status_version),
+    (2, _index_answers_and_screenshots),
+    (3, _index_answer_timestamps),
+    (4, _create_scores),
+    (5, _add_screenshot_metadata),
+    (6, _add_screenshot_dedup),
+    (7, _create_token_secret),
+    (8, _create_exams),
+    (9, _create_attempts),
+    (10, _create_answer_sync),
+    (11, _create_progress),
+    (12, _add_attempts_version),
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Apply pending migrations, each in its own transaction"""
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
     try:
-        yield conn
+        for version, migration in MIGRATIONS:
+            if version <= schema_version(conn):
+                continue
+            # IMMEDIATE takes the write lock, so concurrent workers migrate once
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version > schema_version(conn):
+                    migration(conn.cursor())
+                    conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
     finally:
-        conn.close()
+        conn.isolation_level = isolation_level
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections sharing one database file"""
+
+    def __init__(self, path, max_size, readonly=False, name="pool"):
+        self.path = path
+        self.max_size = max_size
+        self.readonly = readonly
+        self.name = name
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._created = 0
+        self._in_use = 0
+        self._acquires = 0
+        self._reuses = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = 1")
+        # Counts statements against the request being served, if any
+        conn.set_trace_callback(metrics.count_statement)
+        return conn
+
+    def acquire(self, timeout=POOL_TIMEOUT):
+        """Check out a connection, creating one if the pool is not yet full"""
+        with self._lock:
+            self._acquires += 1
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                if self._created < self.max_size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if conn is not None:
+                self._in_use += 1
+                return conn
+
+        if create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            started = time.perf_counter()
+            try:
+                conn = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeout(f"No {self.name} connection available after {timeout}s")
+            finally:
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time += time.perf_counter() - started
+
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection, discarding any transaction left open"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+                self._in_use -= 1
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, reusing the one this thread already holds"""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            with self._lock:
+                self._reuses += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self.acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquires": self._acquires,
+                "reuses": self._reuses,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._wait_time * 1000 / self._waits, 3) if self._waits else 0.0
+            }
+
+
+_write_pool = ConnectionPool(DATABASE_PATH, WRITE_POOL_SIZE, name="write")
+_read_pool = ConnectionPool(DATABASE_PATH, READ_POOL_SIZE, readonly=True, name="read")
+
+def get_db(readonly=False):
+    """Context manager for pooled database connections
+
+    Read-only callers share a pool of query-only connections; everything else
+    goes through the single writer connection.
+    """
+    pool = _read_pool if readonly else _write_pool
+    return pool.connection()
+
+# Dedicated threads so blocking sqlite3 / file calls never run on the event loop.
+# Writers get one thread (there is one write connection), readers one per pooled connection.
+_write_executor = ThreadPoolExecutor(max_workers=WRITE_POOL_SIZE, thread_name_prefix="db-write")
+_read_executor = ThreadPoolExecutor(max_workers=READ_POOL_SIZE, thread_name_prefix="db-read")
+_io_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("EXAM_IO_WORKERS", "4")), thread_name_prefix="io")
+
+async def run_db(fn, *args, readonly=False):
+    """Run fn(conn, *args) on a pooled connection without blocking the event loop"""
+    def work():
+        started = time.perf_counter()
+        try:
+            with get_db(readonly=readonly) as conn:
+                return fn(conn, *args)
+        finally:
+            metrics.add_db_time(time.perf_counter() - started)
+
+    executor = _read_executor if readonly else _write_executor
+    # Carry the request's context over, so its queries are attributed to it
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, work)
+
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking file-system call in the I/O thread pool"""
+    call = functools.partial(fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, call)
+
+def close_pools():
+    """Close idle pooled connections (used on shutdown)"""
+    _write_pool.close()
+    _read_pool.close()
+
+def pool_stats():
+    """Snapshot of connection pool counters"""
+    return {
+        "database": DATABASE_PATH,
+        "write": _write_pool.stats(),
+        "read": _read_pool.stats()
+    }
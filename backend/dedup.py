@@ -0,0 +1,107 @@
+import os
+import threading
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # NumPy/Pillow missing: every frame is kept
+    np = None
+    Image = None
+
+from database import run_db
+from transcode import transcoder
+
+# Frames whose dHash differs from the student's last kept frame by at most
+# this many bits (out of 64) are treated as duplicates; -1 disables dedup.
+DEDUP_THRESHOLD = int(os.environ.get("EXAM_DEDUP_THRESHOLD", "5"))
+HASH_SIZE = 8
+
+def dhash_file(filepath, hash_size=HASH_SIZE):
+    """64-bit difference hash of a frame (runs in a worker process)"""
+    with Image.open(filepath) as image:
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def _last_kept_frame(conn, exam_id, student_id):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, phash
+        FROM screenshots
+        WHERE student_id = ? AND exam_id = ? AND phash IS NOT NULL
+        ORDER BY timestamp DESC
+        LIMIT 1
+    ''', (student_id, exam_id))
+    row = cursor.fetchone()
+    return (row['id'], int(row['phash'], 16)) if row else None
+
+def _count_duplicate(conn, screenshot_id):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE screenshots SET duplicates = duplicates + 1 WHERE id = ?", (screenshot_id,))
+    conn.commit()
+
+class FrameDeduplicator:
+    """Drops webcam frames that look the same as the student's previous kept frame
+
+    Compared within one exam: a frame from an earlier exam never makes the
+    first frame of the next one a duplicate.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self._last = {}
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return np is not None and Image is not None and self.threshold >= 0
+
+    async def check(self, exam_id, student_id, filepath):
+        """Return (phash_hex, duplicate_of_screenshot_id) for a stored frame"""
+        if not self.enabled:
+            return None, None
+        try:
+            phash = await transcoder.run(dhash_file, filepath)
+        except Exception:
+            # Undecodable frame: keep it, just without a hash
+            self.failed += 1
+            return None, None
+        self.checked += 1
+
+        key = (exam_id, student_id)
+        last = self._last.get(key)
+        if last is None:
+            last = await run_db(_last_kept_frame, exam_id, student_id, readonly=True)
+            if last is not None:
+                with self._lock:
+                    self._last.setdefault(key, last)
+        if last is not None and hamming(phash, last[1]) <= self.threshold:
+            self.duplicates += 1
+            await run_db(_count_duplicate, last[0])
+            return format(phash, "016x"), last[0]
+        return format(phash, "016x"), None
+
+    def remember(self, exam_id, student_id, screenshot_id, phash_hex):
+        """Record the newly kept frame as the comparison base for this student in this exam"""
+        if phash_hex is None:
+            return
+        with self._lock:
+            self._last[(exam_id, student_id)] = (screenshot_id, int(phash_hex, 16))
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "failed": self.failed
+        }
+
+deduplicator = FrameDeduplicator()
@@ -0,0 +1,223 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import zlib
+
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+
+try:
+    import orjson
+except ImportError:  # falls back to the stdlib encoder
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # MessagePack is then never offered
+    msgpack = None
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.environ.get("EXAM_COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("EXAM_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("EXAM_BROTLI_QUALITY", "4"))
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "application/x-ndjson", "text/csv", "text/plain")
+
+_accepts_msgpack = contextvars.ContextVar("accepts_msgpack", default=False)
+
+logger = logging.getLogger("exam.encoding")
+
+def stats():
+    """Which encoders this worker has (all are in requirements.txt, but the code runs without them)"""
+    return {
+        "json": "orjson" if orjson is not None else "json",
+        "msgpack": msgpack is not None,
+        "compression": ["br", "gzip"] if brotli is not None else ["gzip"],
+        "compress_min_size": COMPRESS_MIN_SIZE
+    }
+
+def log_encoders():
+    active = stats()
+    logger.info(
+        "Response encoders: JSON via %s, MessagePack %s, compression %s",
+        active["json"], "on" if active["msgpack"] else "off", "/".join(active["compression"])
+    )
+
+def _default(obj):
+    # Anything the fast encoders do not know (pydantic models, sets...)
+    return jsonable_encoder(obj)
+
+def dumps_json(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+def dumps_msgpack(data):
+    return msgpack.packb(data, default=_default, use_bin_type=True)
+
+def _media_types(header):
+    """Media types from an Accept header, without those refused with q=0"""
+    types = set()
+    for part in header.split(","):
+        media_type, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        types.add(media_type.strip().lower())
+    return types
+
+class EncodedResponse(Response):
+    """A dict or list body, as MessagePack when the client asked for it and JSON otherwise
+
+    MessagePack keeps integer map keys as integers, where JSON turns them
+    into strings; JavaScript clients see the same object either way.
+    """
+
+    def __init__(self, content, status_code=200, headers=None, **kwargs):
+        self.media_type = MSGPACK_TYPES[0] if _accepts_msgpack.get() else JSON_TYPE
+        super().__init__(content, status_code=status_code, headers=headers, **kwargs)
+        self.headers.append("Vary", "Accept")
+
+    def render(self, content):
+        if self.media_type == JSON_TYPE:
+            return dumps_json(content)
+        return dumps_msgpack(content)
+
+def _encoded(endpoint, status_code):
+    """Wrap an async endpoint so plain dict/list results bypass jsonable_encoder"""
+    if getattr(endpoint, "_encoded", False) or not inspect.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        result = await endpoint(*args, **kwargs)
+        if isinstance(result, (dict, list)):
+            return EncodedResponse(result, status_code=status_code)
+        return result
+
+    wrapper._encoded = True
+    return wrapper
+
+class EncodedRoute(APIRoute):
+    """APIRoute that encodes returned dicts with EncodedResponse
+
+    Routes with a response_model (or a return annotation FastAPI would use
+    as one) keep FastAPI's validating serializer.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        response_model = kwargs.get("response_model", DefaultPlaceholder(None))
+        if isinstance(response_model, DefaultPlaceholder) and "return" not in getattr(endpoint, "__annotations__", {}):
+            endpoint = _encoded(endpoint, kwargs.get("status_code") or 200)
+        super().__init__(path, endpoint, **kwargs)
+
+def _compressor(encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def _compress(encoding, body):
+    compress, _, finish = _compressor(encoding)
+    return compress(body) + finish()
+
+class EncodingMiddleware:
+    """Response encoding negotiation for every route
+
+    Records whether the client accepts MessagePack (for EncodedResponse) and
+    compresses JSON, MessagePack, CSV and text bodies above
+    COMPRESS_MIN_SIZE with brotli or gzip. Streamed bodies are compressed
+    chunk by chunk; event streams, images and bodies that already carry a
+    Content-Encoding are passed through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept = ""
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept":
+                accept = value.decode("latin-1")
+            elif name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1").lower()
+
+        token = _accepts_msgpack.set(msgpack is not None and not _media_types(accept).isdisjoint(MSGPACK_TYPES))
+        codings = {part.split(";")[0].strip() for part in accept_encoding.split(",")}
+        encoding = "br" if brotli is not None and "br" in codings else "gzip" if "gzip" in codings else None
+        try:
+            if encoding is None:
+                await self.app(scope, receive, send)
+            else:
+                await self.app(scope, receive, _CompressingSend(send, encoding))
+        finally:
+            _accepts_msgpack.reset(token)
+
+class _CompressingSend:
+    def __init__(self, send, encoding):
+        self.send = send
+        self.encoding = encoding
+        self.start = None
+        self.stream = None
+        self.passthrough = False
+
+    def _compressible(self):
+        headers = {name.lower(): value for name, value in self.start["headers"]}
+        if b"content-encoding" in headers:
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip().lower()
+        return content_type in COMPRESSIBLE_TYPES
+
+    def _encoded_start(self, length=None):
+        headers = [
+            (name, value) for name, value in self.start["headers"]
+            if name.lower() not in (b"content-length", b"vary")
+        ]
+        vary = [value for name, value in self.start["headers"] if name.lower() == b"vary"]
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        return {**self.start, "headers": headers}
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            return await self.send(message)
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.stream is None:
+            if not self._compressible() or (not more_body and len(body) < COMPRESS_MIN_SIZE):
+                self.passthrough = True
+                await self.send(self.start)
+                return await self.send(message)
+            if not more_body:
+                compressed = _compress(self.encoding, body)
+                await self.send(self._encoded_start(len(compressed)))
+                return await self.send({"type": "http.response.body", "body": compressed})
+            self.stream = _compressor(self.encoding)
+            await self.send(self._encoded_start())
+
+        compress, flush, finish = self.stream
+        if more_body:
+            chunk = compress(body) + flush()
+        else:
+            chunk = compress(body) + finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
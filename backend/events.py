@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+from database import DEFAULT_EXAM_ID
+from exam_state import exam_state
+
+HEARTBEAT_SECONDS = float(os.environ.get("EXAM_EVENTS_HEARTBEAT_SECONDS", "15"))
+SUBSCRIBER_QUEUE_SIZE = 16
+
+def exam_status_payload(snapshot):
+    """Status event body, including server-computed remaining time"""
+    remaining = None
+    if snapshot.is_active and snapshot.start_time:
+        elapsed = (datetime.now() - datetime.fromisoformat(snapshot.start_time)).total_seconds()
+        remaining = max(0, int(snapshot.duration_minutes * 60 - elapsed))
+    return {
+        "exam_id": snapshot.exam_id,
+        "title": snapshot.title,
+        "is_active": snapshot.is_active,
+        "start_time": snapshot.start_time,
+        "duration_minutes": snapshot.duration_minutes,
+        "total_questions": snapshot.total_questions,
+        "remaining_seconds": remaining,
+        "version": snapshot.version
+    }
+
+def _follows(following, event, event_exam):
+    """Whether a subscriber following (exam_id, event types) wants this event"""
+    exam_id, events = following
+    if exam_id is not None and event_exam not in (None, exam_id):
+        return False
+    return events is None or event in events
+
+class EventHub:
+    """In-process fan-out of exam events to Server-Sent Event subscribers
+
+    Admin handlers publish directly after their writes. A watcher task also
+    follows the shared exam state versions, so subscribers connected to a
+    different uvicorn worker are notified within one revalidation interval.
+    Events carry the exam they concern (None for roster changes), and each
+    subscriber may follow a single exam and some event types. Events are
+    filtered before they are queued, so a busy exam never pushes another
+    exam's events out of a subscriber's queue.
+    """
+
+    def __init__(self):
+        # queue -> (exam_id, event types) it follows; None means all
+        self._subscribers = {}
+        self._last = {}
+        self._watcher = None
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, exam_id=None, events=None):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Late joiners start from the latest known state, with a fresh countdown
+        for (event, event_exam), data in list(self._last.items()):
+            if not _follows((exam_id, events), event, event_exam):
+                continue
+            if event == "status" and exam_state.snapshot(event_exam) is not None:
+                data = exam_status_payload(exam_state.snapshot(event_exam))
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, event_exam, data))
+        self._subscribers[queue] = (exam_id, events)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.pop(queue, None)
+
+    def publish(self, event, data, exam_id=None):
+        self._last[(event, exam_id)] = data
+        self.published += 1
+        for queue, following in list(self._subscribers.items()):
+            if not _follows(following, event, exam_id):
+                continue
+            if queue.full():
+                # Events are snapshots, so a slow client only needs the newest ones
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait((event, exam_id, data))
+
+    def publish_status(self, snapshot):
+        """Publish a status change, once per exam state version"""
+        last = self._last.get(("status", snapshot.exam_id))
+        if last is not None and last["version"] >= snapshot.version:
+            return
+        self.publish("status", exam_status_payload(snapshot), snapshot.exam_id)
+
+    async def _watch(self):
+        while True:
+            for exam_id in exam_state.known() or [DEFAULT_EXAM_ID]:
+                try:
+                    snapshot = await exam_state.get(exam_id)
+                    if snapshot is not None:
+                        self.publish_status(snapshot)
+                except Exception:
+                    pass
+            await asyncio.sleep(exam_state.revalidate_seconds)
+
+    def start(self):
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def stream(self, request, events=None, exam_id=None):
+        """Async generator yielding SSE frames until the client disconnects"""
+        queue = self.subscribe(exam_id, events)
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event, _, data = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+hub = EventHub()
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import HTTPException
+
+from database import run_db, DEFAULT_EXAM_ID
+
+# How long a worker trusts its cached state before checking the shared version
+# counter again. Other uvicorn workers see admin changes within this window.
+REVALIDATE_SECONDS = float(os.environ.get("EXAM_STATE_REVALIDATE_SECONDS", "1.0"))
+
+@dataclass(frozen=True)
+class ExamSnapshot:
+    exam_id: int
+    title: str
+    is_active: bool
+    start_time: Optional[str]
+    duration_minutes: int
+    total_questions: int
+    version: int
+
+class ExamStateCache:
+    """In-process copy of each exam's row and question count
+
+    Admin writes bump exams.version in the same transaction and refresh
+    this cache write-through; readers only touch the database to compare the
+    version once per REVALIDATE_SECONDS per exam.
+    """
+
+    def __init__(self, revalidate_seconds=REVALIDATE_SECONDS):
+        self.revalidate_seconds = revalidate_seconds
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._checked_at = {}
+        self.hits = 0
+        self.reloads = 0
+
+    def _load(self, conn, exam_id):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, title, is_active, start_time, duration_minutes, version
+            FROM exams WHERE id = ?
+        ''', (exam_id,))
+        exam = cursor.fetchone()
+        if exam is None:
+            return None
+        cursor.execute("SELECT COUNT(*) as count FROM questions WHERE exam_id = ?", (exam_id,))
+        return ExamSnapshot(
+            exam_id=exam['id'],
+            title=exam['title'],
+            is_active=bool(exam['is_active']),
+            start_time=exam['start_time'],
+            duration_minutes=exam['duration_minutes'],
+            total_questions=cursor.fetchone()['count'],
+            version=exam['version']
+        )
+
+    def _store(self, exam_id, snapshot):
+        with self._lock:
+            current = self._snapshots.get(exam_id)
+            if snapshot is None:
+                self._snapshots.pop(exam_id, None)
+            elif current is None or snapshot.version >= current.version:
+                self._snapshots[exam_id] = snapshot
+                self.reloads += 1
+            self._checked_at[exam_id] = time.monotonic()
+
+    def _revalidate(self, conn, exam_id):
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM exams WHERE id = ?", (exam_id,))
+        row = cursor.fetchone()
+        current = self._snapshots.get(exam_id)
+        if row is None or current is None or current.version != row['version']:
+            self._store(exam_id, self._load(conn, exam_id))
+        else:
+            with self._lock:
+                self._checked_at[exam_id] = time.monotonic()
+        return self._snapshots.get(exam_id)
+
+    def bump(self, conn, exam_id):
+        """Advance the shared version; call inside the writing transaction before commit"""
+        conn.execute("UPDATE exams SET version = version + 1 WHERE id = ?", (exam_id,))
+
+    def refresh(self, conn, exam_id):
+        """Reload from the database after a committed write (write-through)"""
+        snapshot = self._load(conn, exam_id)
+        self._store(exam_id, snapshot)
+        return snapshot
+
+    def snapshot(self, exam_id):
+        """Last loaded state without revalidation (may be None before first load)"""
+        return self._snapshots.get(exam_id)
+
+    def known(self):
+        """Exams this worker has loaded so far"""
+        return list(self._snapshots)
+
+    def invalidate(self, exam_id=None):
+        with self._lock:
+            if exam_id is None:
+                self._checked_at.clear()
+            else:
+                self._checked_at.pop(exam_id, None)
+
+    async def get(self, exam_id=DEFAULT_EXAM_ID):
+        """Current state of an exam (None if it does not exist), served from memory while fresh"""
+        snapshot = self._snapshots.get(exam_id)
+        if snapshot is not None and time.monotonic() - self._checked_at.get(exam_id, 0.0) < self.revalidate_seconds:
+            self.hits += 1
+            return snapshot
+        return await run_db(self._revalidate, exam_id, readonly=True)
+
+    async def require(self, exam_id=DEFAULT_EXAM_ID):
+        """Like get(), but a missing exam is a 404"""
+        snapshot = await self.get(exam_id)
+        if snapshot is None:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        return snapshot
+
+    def stats(self):
+        return {
+            "exams": len(self._snapshots),
+            "versions": {exam_id: snapshot.version for exam_id, snapshot in self._snapshots.items()},
+            "hits": self.hits,
+            "reloads": self.reloads,
+            "revalidate_seconds": self.revalidate_seconds
+        }
+
+exam_state = ExamStateCache()
@@ -0,0 +1,346 @@
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+
+from database import run_db
+from exam_state import exam_state, REVALIDATE_SECONDS
+from events import hub
+from answer_queue import answer_queue
+
+# How often deadlines are checked and expired attempts finalized
+TICK_SECONDS = float(os.environ.get("EXAM_TIMER_TICK_SECONDS", "1.0"))
+# Answers already in flight when time runs out are accepted for this long
+GRACE_SECONDS = float(os.environ.get("EXAM_TIMER_GRACE_SECONDS", "5"))
+# Students who start within this many minutes of the exam still get the full
+# duration; 0 means everybody's time runs out together
+JOIN_WINDOW_MINUTES = float(os.environ.get("EXAM_JOIN_WINDOW_MINUTES", "0"))
+# Exams started or stopped on other workers are picked up this often; attempt
+# changes are seen within REVALIDATE_SECONDS through exams.attempts_version
+SYNC_SECONDS = float(os.environ.get("EXAM_TIMER_SYNC_SECONDS", "5"))
+FINALIZE_CHUNK = 500
+
+@dataclass
+class Attempt:
+    started: Optional[float] = None
+    extra_minutes: int = 0
+    submitted_by: Optional[str] = None
+
+def _epoch(iso):
+    return datetime.fromisoformat(iso).timestamp() if iso else None
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch).isoformat() if epoch else None
+
+def from_row(row):
+    return Attempt(started=_epoch(row['started_at']), extra_minutes=row['extra_minutes'], submitted_by=row['submitted_by'])
+
+def window(snapshot):
+    """(start, latest personal start, duration) of a running exam, in epoch seconds"""
+    start = _epoch(snapshot.start_time)
+    return start, start + JOIN_WINDOW_MINUTES * 60, snapshot.duration_minutes * 60
+
+def deadline(snapshot, attempt, now=None):
+    """When a student's time runs out (a student who has not started yet is timed from now)"""
+    start, last_start, duration = window(snapshot)
+    started = attempt.started if attempt is not None and attempt.started else (now or time.time())
+    extra = attempt.extra_minutes * 60 if attempt is not None else 0
+    return min(max(started, start), last_start) + duration + extra
+
+def bump(conn, exam_id):
+    """Tell other workers the attempts changed; call inside the writing transaction"""
+    conn.execute("UPDATE exams SET attempts_version = attempts_version + 1 WHERE id = ?", (exam_id,))
+
+def _version(conn, exam_id):
+    row = conn.execute("SELECT start_time, attempts_version FROM exams WHERE id = ?", (exam_id,)).fetchone()
+    return (row['start_time'], row['attempts_version']) if row else (None, None)
+
+def _load(conn, exam_id):
+    cursor = conn.cursor()
+    start_time, version = _version(conn, exam_id)
+    cursor.execute('''
+        SELECT student_id, started_at, extra_minutes, submitted_by
+        FROM attempts WHERE exam_id = ?
+    ''', (exam_id,))
+    return start_time, version, {row['student_id']: from_row(row) for row in cursor.fetchall()}
+
+def _fetch(cursor, exam_id, student_id):
+    cursor.execute('''
+        SELECT started_at, extra_minutes, submitted_by
+        FROM attempts WHERE exam_id = ? AND student_id = ?
+    ''', (exam_id, student_id))
+    return from_row(cursor.fetchone())
+
+def _begin(conn, exam_id, student_id):
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO attempts (exam_id, student_id, started_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (exam_id, student_id) DO UPDATE SET
+            started_at = COALESCE(started_at, excluded.started_at)
+    ''', (exam_id, student_id, datetime.now().isoformat()))
+    bump(conn, exam_id)
+    conn.commit()
+    return _fetch(cursor, exam_id, student_id)
+
+def _submit(conn, exam_id, student_id):
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    cursor.execute('''
+        INSERT INTO attempts (exam_id, student_id, started_at, submitted_at, submitted_by)
+        VALUES (?, ?, ?, ?, 'student')
+        ON CONFLICT (exam_id, student_id) DO UPDATE SET
+            submitted_at = excluded.submitted_at,
+            submitted_by = excluded.submitted_by
+        WHERE submitted_at IS NULL
+    ''', (exam_id, student_id, now, now))
+    bump(conn, exam_id)
+    conn.commit()
+    return _fetch(cursor, exam_id, student_id)
+
+def finalize(conn, exam_id, by, student_ids=None):
+    """Mark started, unsubmitted attempts as submitted (all of the exam's by default); caller commits"""
+    query = '''
+        UPDATE attempts SET submitted_at = ?, submitted_by = ?
+        WHERE exam_id = ? AND started_at IS NOT NULL AND submitted_at IS NULL
+    '''
+    params = [datetime.now().isoformat(), by, exam_id]
+    if student_ids is not None:
+        query += f" AND student_id IN ({', '.join('?' * len(student_ids))})"
+        params += student_ids
+    conn.execute(query, params)
+    bump(conn, exam_id)
+
+def add_time(conn, exam_id, student_id, minutes):
+    """Give one student extra minutes, reopening them if the timer had closed their attempt; caller commits"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO attempts (exam_id, student_id, extra_minutes)
+        VALUES (?, ?, ?)
+        ON CONFLICT (exam_id, student_id) DO UPDATE SET
+            extra_minutes = extra_minutes + excluded.extra_minutes
+    ''', (exam_id, student_id, minutes))
+    reopen(conn, exam_id, student_id)
+
+def reopen(conn, exam_id, student_id=None):
+    """Undo timer submissions after more time was granted; caller commits"""
+    query = "UPDATE attempts SET submitted_at = NULL, submitted_by = NULL WHERE exam_id = ? AND submitted_by = 'timer'"
+    params = [exam_id]
+    if student_id is not None:
+        query += " AND student_id = ?"
+        params.append(student_id)
+    conn.execute(query, params)
+    bump(conn, exam_id)
+
+def _finalize_expired(conn, exam_id, student_ids):
+    finalize(conn, exam_id, "timer", student_ids)
+    conn.commit()
+
+def _auto_stop(conn, exam_id, start_time):
+    cursor = conn.cursor()
+    # Only the run that expired; another worker may have stopped or restarted it
+    cursor.execute('''
+        UPDATE exams
+        SET is_active = 0, start_time = NULL
+        WHERE id = ? AND is_active = 1 AND start_time = ?
+    ''', (exam_id, start_time))
+    if cursor.rowcount == 0:
+        conn.rollback()
+        return None
+    finalize(conn, exam_id, "timer")
+    exam_state.bump(conn, exam_id)
+    conn.commit()
+    return exam_state.refresh(conn, exam_id)
+
+def _running_exams(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM exams WHERE is_active = 1")
+    return [row['id'] for row in cursor.fetchall()]
+
+class ExamTimer:
+    """Server-side clock of every running exam
+
+    Attempts of running exams are mirrored in memory, so an answer is
+    checked against the student's deadline without a write; like the exam
+    state, the copy is revalidated against exams.attempts_version at most
+    once per REVALIDATE_SECONDS, so a submission or extension made on
+    another worker is seen within that window. A background
+    task finalizes expired attempts in batches and stops an exam once the
+    last possible deadline has passed, so clients need not race to submit
+    when the countdown reaches zero.
+    """
+
+    def __init__(self):
+        self._attempts = {}
+        self._runs = {}
+        self._versions = {}
+        self._checked_at = {}
+        self._running = []
+        self._running_checked = None
+        self._lock = threading.Lock()
+        self._task = None
+        self.rejected = 0
+        self.auto_submitted = 0
+        self.auto_stopped = 0
+
+    def refresh(self, conn, exam_id):
+        """Reload an exam's attempts (runs on a DB thread; write-through after changing them)"""
+        start_time, version, attempts = _load(conn, exam_id)
+        with self._lock:
+            self._runs[exam_id] = start_time
+            self._versions[exam_id] = version
+            self._attempts[exam_id] = attempts
+            self._checked_at[exam_id] = time.monotonic()
+
+    def _revalidate(self, conn, exam_id):
+        """Reload the attempts only if another worker (or this one) changed them"""
+        if _version(conn, exam_id) != (self._runs.get(exam_id), self._versions.get(exam_id)):
+            self.refresh(conn, exam_id)
+        else:
+            with self._lock:
+                self._checked_at[exam_id] = time.monotonic()
+
+    def _drop(self, exam_id):
+        with self._lock:
+            self._runs.pop(exam_id, None)
+            self._versions.pop(exam_id, None)
+            self._attempts.pop(exam_id, None)
+            self._checked_at.pop(exam_id, None)
+
+    async def _attempts_for(self, snapshot):
+        exam_id = snapshot.exam_id
+        if self._runs.get(exam_id) != snapshot.start_time:
+            # Started on another worker since the last tick
+            await run_db(self.refresh, exam_id, readonly=True)
+        elif time.monotonic() - self._checked_at.get(exam_id, 0.0) >= REVALIDATE_SECONDS:
+            await run_db(self._revalidate, exam_id, readonly=True)
+        return self._attempts.get(exam_id, {})
+
+    def _remember(self, snapshot, student_id, attempt):
+        with self._lock:
+            if self._runs.get(snapshot.exam_id) == snapshot.start_time:
+                self._attempts.setdefault(snapshot.exam_id, {})[student_id] = attempt
+
+    async def begin(self, snapshot, student_id):
+        """Start the student's clock the first time they open the exam (the paper or their timer)"""
+        attempt = (await self._attempts_for(snapshot)).get(student_id)
+        if attempt is not None and attempt.started is not None:
+            return attempt
+        attempt = await run_db(_begin, snapshot.exam_id, student_id)
+        self._remember(snapshot, student_id, attempt)
+        return attempt
+
+    async def admit(self, snapshot, student_id):
+        """Raise 403 unless the student may still answer
+
+        Read-only: the clock is started by begin(). A student without an
+        attempt yet is timed as if starting now, which the join window bounds.
+        """
+        attempt = (await self._attempts_for(snapshot)).get(student_id)
+        if attempt is not None and attempt.submitted_by is not None:
+            self.rejected += 1
+            raise HTTPException(status_code=403, detail="Exam already submitted")
+        if time.time() > deadline(snapshot, attempt) + GRACE_SECONDS:
+            self.rejected += 1
+            raise HTTPException(status_code=403, detail="Time is up")
+        return attempt
+
+    async def submit(self, snapshot, student_id):
+        """Record the student's own submission (an earlier one is kept)"""
+        attempt = await run_db(_submit, snapshot.exam_id, student_id)
+        self._remember(snapshot, student_id, attempt)
+        return attempt
+
+    def describe(self, snapshot, attempt):
+        """Timing of one attempt as reported to clients"""
+        now = time.time()
+        end = deadline(snapshot, attempt, now)
+        return {
+            "started_at": _iso(attempt.started) if attempt is not None else None,
+            "extra_minutes": attempt.extra_minutes if attempt is not None else 0,
+            "deadline": _iso(end),
+            "remaining_seconds": max(0, int(end - now)),
+            "submitted": attempt is not None and attempt.submitted_by is not None,
+            "submitted_by": attempt.submitted_by if attempt is not None else None,
+            "server_time": _iso(now)
+        }
+
+    async def _expire(self, snapshot):
+        exam_id = snapshot.exam_id
+        attempts = self._attempts.get(exam_id, {})
+        now = time.time()
+        expired = [
+            student_id for student_id, attempt in list(attempts.items())
+            if attempt.started is not None and attempt.submitted_by is None
+            and now > deadline(snapshot, attempt) + GRACE_SECONDS
+        ]
+        _, last_start, duration = window(snapshot)
+        longest = max([attempt.extra_minutes for attempt in attempts.values()], default=0)
+        over = now > last_start + duration + longest * 60 + GRACE_SECONDS
+        if not expired and not over:
+            return
+
+        # Answers accepted before the deadline must be on disk first
+        await answer_queue.flush()
+        for i in range(0, len(expired), FINALIZE_CHUNK):
+            await run_db(_finalize_expired, exam_id, expired[i:i + FINALIZE_CHUNK])
+        for student_id in expired:
+            attempts[student_id].submitted_by = "timer"
+        self.auto_submitted += len(expired)
+
+        if over:
+            stopped = await run_db(_auto_stop, exam_id, snapshot.start_time)
+            if stopped is not None:
+                self.auto_stopped += 1
+                hub.publish_status(stopped)
+            self._drop(exam_id)
+
+    async def tick(self):
+        """One pass over the running exams"""
+        now = time.monotonic()
+        if self._running_checked is None or now - self._running_checked >= SYNC_SECONDS:
+            self._running = await run_db(_running_exams, readonly=True)
+            self._running_checked = now
+        for exam_id in set(self._running) | set(self._attempts):
+            snapshot = await exam_state.get(exam_id)
+            if snapshot is None or not snapshot.is_active or not snapshot.start_time:
+                self._drop(exam_id)
+                continue
+            await self._attempts_for(snapshot)
+            await self._expire(snapshot)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                # Try again on the next tick
+                pass
+            await asyncio.sleep(TICK_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {
+            "running_exams": len(self._attempts),
+            "attempts": sum(len(attempts) for attempts in self._attempts.values()),
+            "rejected": self.rejected,
+            "auto_submitted": self.auto_submitted,
+            "auto_stopped": self.auto_stopped,
+            "grace_seconds": GRACE_SECONDS,
+            "join_window_minutes": JOIN_WINDOW_MINUTES
+        }
+
+exam_timer = ExamTimer()
@@ -0,0 +1,179 @@
+# Grading is done with set-based SQL (joins and aggregates) instead of Python
+# loops; the scores table is refreshed only for students touched by a batch.
+IS_CORRECT = "UPPER(TRIM(a.selected_answer)) = UPPER(TRIM(q.correct_answer))"
+
+def _placeholders(values):
+    return ",".join("?" for _ in values)
+
+def update_scores(cursor, keys):
+    """Recompute the running score of the given (exam_id, student_id) pairs (inside the write transaction)"""
+    by_exam = {}
+    for exam_id, student_id in set(keys):
+        by_exam.setdefault(exam_id, []).append(student_id)
+    for exam_id, student_ids in by_exam.items():
+        cursor.execute(f'''
+            INSERT INTO scores (exam_id, student_id, answered, correct, updated_at)
+            SELECT a.exam_id,
+                   a.student_id,
+                   COUNT(*),
+                   SUM(CASE WHEN {IS_CORRECT} THEN 1 ELSE 0 END),
+                   MAX(a.timestamp)
+            FROM answers a
+            JOIN questions q ON q.id = a.question_id
+            WHERE a.exam_id = ? AND a.student_id IN ({_placeholders(student_ids)})
+            GROUP BY a.exam_id, a.student_id
+            ON CONFLICT (exam_id, student_id) DO UPDATE SET
+                answered = excluded.answered,
+                correct = excluded.correct,
+                updated_at = excluded.updated_at
+        ''', [exam_id] + student_ids)
+
+def rebuild_scores(cursor, exam_id=None):
+    """Regrade one exam (or every exam), e.g. after the answer key changed"""
+    condition, params = ("WHERE a.exam_id = ?", [exam_id]) if exam_id is not None else ("", [])
+    cursor.execute("DELETE FROM scores" + (" WHERE exam_id = ?" if exam_id is not None else ""), params)
+    cursor.execute(f'''
+        INSERT INTO scores (exam_id, student_id, answered, correct, updated_at)
+        SELECT a.exam_id,
+               a.student_id,
+               COUNT(*),
+               SUM(CASE WHEN {IS_CORRECT} THEN 1 ELSE 0 END),
+               MAX(a.timestamp)
+        FROM answers a
+        JOIN questions q ON q.id = a.question_id
+        {condition}
+        GROUP BY a.exam_id, a.student_id
+    ''', params)
+
+def _total_questions(cursor, exam_id):
+    cursor.execute("SELECT COUNT(*) as count FROM questions WHERE exam_id = ?", (exam_id,))
+    return cursor.fetchone()['count']
+
+def _result(row, total_questions):
+    return {
+        "student_id": row['student_id'],
+        "answered": row['answered'],
+        "correct": row['correct'],
+        "total_questions": total_questions,
+        "score_percent": round(100.0 * row['correct'] / total_questions, 2) if total_questions else 0.0,
+        "updated_at": row['updated_at']
+    }
+
+def get_results(conn, exam_id):
+    cursor = conn.cursor()
+    total_questions = _total_questions(cursor, exam_id)
+    cursor.execute('''
+        SELECT student_id, answered, correct, updated_at
+        FROM scores
+        WHERE exam_id = ?
+        ORDER BY student_id
+    ''', (exam_id,))
+    return [_result(row, total_questions) for row in cursor.fetchall()]
+
+def get_student_result(conn, exam_id, student_id):
+    cursor = conn.cursor()
+    total_questions = _total_questions(cursor, exam_id)
+    cursor.execute('''
+        SELECT student_id, answered, correct, updated_at
+        FROM scores
+        WHERE exam_id = ? AND student_id = ?
+    ''', (exam_id, student_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    cursor.execute(f'''
+        SELECT q.id as question_id,
+               a.selected_answer,
+               q.correct_answer,
+               CASE WHEN {IS_CORRECT} THEN 1 ELSE 0 END as is_correct
+        FROM questions q
+        LEFT JOIN answers a ON a.question_id = q.id AND a.student_id = ?
+        WHERE q.exam_id = ?
+        ORDER BY q.id
+    ''', (student_id, exam_id))
+    result = _result(row, total_questions)
+    result["questions"] = [{
+        "question_id": q['question_id'],
+        "selected_answer": q['selected_answer'],
+        "correct_answer": q['correct_answer'],
+        "is_correct": bool(q['is_correct'])
+    } for q in cursor.fetchall()]
+    return result
+
+def get_leaderboard(conn, exam_id, limit):
+    cursor = conn.cursor()
+    total_questions = _total_questions(cursor, exam_id)
+    # Ties go to whoever reached the score first
+    cursor.execute('''
+        SELECT student_id, answered, correct, updated_at,
+               RANK() OVER (ORDER BY correct DESC) as rank
+        FROM scores
+        WHERE exam_id = ?
+        ORDER BY correct DESC, updated_at ASC
+        LIMIT ?
+    ''', (exam_id, limit))
+    leaderboard = []
+    for row in cursor.fetchall():
+        entry = _result(row, total_questions)
+        entry["rank"] = row['rank']
+        leaderboard.append(entry)
+    return leaderboard
+
+def get_question_stats(conn, exam_id):
+    """Per-question difficulty and upper/lower-quartile discrimination index"""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        WITH ranked AS (
+            SELECT student_id, NTILE(4) OVER (ORDER BY correct DESC) as quartile
+            FROM scores
+            WHERE exam_id = ?
+        ),
+        groups AS (
+            SELECT SUM(quartile = 1) as upper_n, SUM(quartile = 4) as lower_n FROM ranked
+        )
+        SELECT q.id as question_id,
+               q.correct_answer,
+               COUNT(a.id) as attempts,
+               COALESCE(SUM(CASE WHEN {IS_CORRECT} THEN 1 ELSE 0 END), 0) as correct,
+               COALESCE(SUM(CASE WHEN r.quartile = 1 AND {IS_CORRECT} THEN 1 ELSE 0 END), 0) as upper_correct,
+               COALESCE(SUM(CASE WHEN r.quartile = 4 AND {IS_CORRECT} THEN 1 ELSE 0 END), 0) as lower_correct,
+               COALESCE(SUM(UPPER(a.selected_answer) = 'A'), 0) as option_a,
+               COALESCE(SUM(UPPER(a.selected_answer) = 'B'), 0) as option_b,
+               COALESCE(SUM(UPPER(a.selected_answer) = 'C'), 0) as option_c,
+               COALESCE(SUM(UPPER(a.selected_answer) = 'D'), 0) as option_d,
+               COALESCE(SUM(UPPER(a.selected_answer) = 'E'), 0) as option_e,
+               (SELECT upper_n FROM groups) as upper_n,
+               (SELECT lower_n FROM groups) as lower_n
+        FROM questions q
+        LEFT JOIN answers a ON a.question_id = q.id
+        LEFT JOIN ranked r ON r.student_id = a.student_id
+        WHERE q.exam_id = ?
+        GROUP BY q.id
+        ORDER BY q.id
+    ''', (exam_id, exam_id))
+
+    stats = []
+    for row in cursor.fetchall():
+        upper_n = row['upper_n'] or 0
+        lower_n = row['lower_n'] or 0
+        discrimination = None
+        if upper_n and lower_n:
+            discrimination = round(row['upper_correct'] / upper_n - row['lower_correct'] / lower_n, 4)
+        stats.append({
+            "question_id": row['question_id'],
+            "correct_answer": row['correct_answer'],
+            "attempts": row['attempts'],
+            "correct": row['correct'],
+            # Classical difficulty index: share of attempts answered correctly
+            "difficulty": round(row['correct'] / row['attempts'], 4) if row['attempts'] else None,
+            "discrimination": discrimination,
+            "option_counts": {
+                "A": row['option_a'],
+                "B": row['option_b'],
+                "C": row['option_c'],
+                "D": row['option_d'],
+                "E": row['option_e']
+            }
+        })
+    return stats
@@ -1,15 +1,28 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-import os
 
-from database import init_db
+from database import init_db, close_pools, pool_stats
+from exam_state import exam_state
+from events import hub
+from answer_queue import answer_queue
+from exam_timer import exam_timer
+from progress import progress_board
+from transcode import transcoder
+from dedup import deduplicator
+from credentials import passwords
+from auth import tokens
+from metrics import metrics, MetricsMiddleware
+import encoding
+from encoding import EncodedRoute, EncodingMiddleware
 from routes import admin, exam, proctor
 
 # Initialize database
 init_db()
 
 app = FastAPI(title="Online Exam & Proctoring System")
+# Dict responses are encoded with orjson (or MessagePack on request), skipping jsonable_encoder
+app.router.route_class = EncodedRoute
 
 # CORS middleware
 app.add_middleware(
@@ -20,10 +33,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount screenshots directory
-SCREENSHOTS_DIR = os.path.join(os.path.dirname(__file__), "screenshots")
-os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
-app.mount("/screenshots", StaticFiles(directory=SCREENSHOTS_DIR), name="screenshots")
+# MessagePack negotiation and brotli/gzip compression of larger bodies
+app.add_middleware(EncodingMiddleware)
+
+# Per-route latency, in-flight and query counts, served at /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Stored frames are served only through the admin-only /proctor/frame/{id}
 
 # Include routers
 app.include_router(admin.router)
@@ -42,6 +58,57 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/db")
+async def database_health():
+    """Connection pool statistics"""
+    return {
+        "status": "healthy",
+        "pools": pool_stats(),
+        "exam_state": exam_state.stats(),
+        "events": hub.stats(),
+        "answers": answer_queue.stats(),
+        "timer": exam_timer.stats(),
+        "progress": progress_board.stats(),
+        "transcoding": transcoder.stats(),
+        "dedup": deduplicator.stats(),
+        "logins": passwords.stats(),
+        "auth": tokens.stats(),
+        "encoding": encoding.stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Request and component metrics of this worker in Prometheus text format"""
+    pools = pool_stats()
+    return metrics.render({
+        "db_write_connections_in_use": pools["write"]["in_use"],
+        "db_read_connections_in_use": pools["read"]["in_use"],
+        "answer_queue_pending": answer_queue.stats()["pending"],
+        "event_subscribers": hub.stats()["subscribers"],
+        "logins_pending": passwords.stats()["pending"],
+        "timer_attempts": exam_timer.stats()["attempts"]
+    })
+
+@app.on_event("startup")
+async def startup():
+    tokens.load()
+    encoding.log_encoders()
+    hub.start()
+    answer_queue.start()
+    exam_timer.start()
+    progress_board.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    hub.stop()
+    exam_timer.stop()
+    progress_board.stop()
+    await answer_queue.stop()
+    await transcoder.drain()
+    transcoder.shutdown()
+    passwords.shutdown()
+    close_pools()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,272 @@
+import bisect
+import collections
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the SQL statements-per-request histogram buckets
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 500)
+PROFILE_MAX_SECONDS = float(os.environ.get("EXAM_PROFILE_MAX_SECONDS", "30"))
+# Innermost Python frames of threads that are waiting for work, not doing it
+IDLE_FRAMES = {
+    "thread.py:_worker",
+    "threading.py:wait",
+    "queue.py:get",
+    "selectors.py:select",
+    "threading.py:_wait_for_tstate_lock"
+}
+
+class RequestStats:
+    """Database work done on behalf of one request (filled in from DB threads)"""
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+def count_statement(statement):
+    """sqlite3 trace callback: one call per executed statement"""
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+
+def add_db_time(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.db_seconds += seconds
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _number(value):
+    return int(value) if float(value).is_integer() else value
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+def _histogram_lines(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+class Metrics:
+    """Per-route request metrics kept in process and rendered for Prometheus
+
+    Every uvicorn worker keeps its own numbers; scrape each worker, or
+    aggregate them in Prometheus.
+    """
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.latency = {}
+        self.queries = {}
+        self.db_seconds = defaultdict(float)
+        self.in_flight = defaultdict(int)
+        self.counters = defaultdict(float)
+
+    def observe(self, method, route, status, seconds, stats):
+        key = (method, route)
+        self.requests[key + (status,)] += 1
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.queries[key] = Histogram(QUERY_BUCKETS)
+        self.latency[key].observe(seconds)
+        self.queries[key].observe(stats.queries)
+        self.db_seconds[key] += stats.db_seconds
+
+    def add(self, name, value=1):
+        """Bump an application counter, e.g. bytes written"""
+        self.counters[name] += value
+
+    def render(self, gauges=None):
+        """Prometheus text exposition format; `gauges` adds {name: value} samples"""
+        lines = [
+            "# HELP exam_http_requests_total Requests by route and status",
+            "# TYPE exam_http_requests_total counter"
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f"exam_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+        lines += [
+            "# HELP exam_http_requests_in_flight Requests being handled (open event streams included)",
+            "# TYPE exam_http_requests_in_flight gauge"
+        ]
+        for (method, route), count in sorted(self.in_flight.items()):
+            lines.append(f"exam_http_requests_in_flight{_labels(method=method, route=route)} {count}")
+
+        lines += [
+            "# HELP exam_http_request_duration_seconds Request latency by route",
+            "# TYPE exam_http_request_duration_seconds histogram"
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            lines += _histogram_lines("exam_http_request_duration_seconds", histogram, {"method": method, "route": route})
+
+        lines += [
+            "# HELP exam_db_queries_per_request SQL statements executed per request",
+            "# TYPE exam_db_queries_per_request histogram"
+        ]
+        for (method, route), histogram in sorted(self.queries.items()):
+            lines += _histogram_lines("exam_db_queries_per_request", histogram, {"method": method, "route": route})
+
+        lines += [
+            "# HELP exam_db_seconds_total Time spent in database calls by route",
+            "# TYPE exam_db_seconds_total counter"
+        ]
+        for (method, route), seconds in sorted(self.db_seconds.items()):
+            lines.append(f"exam_db_seconds_total{_labels(method=method, route=route)} {seconds:.6f}")
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE exam_{name}_total counter")
+            lines.append(f"exam_{name}_total {_number(value)}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE exam_{name} gauge")
+            lines.append(f"exam_{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+_route_tables = {}
+
+def _route_table(app):
+    """Routes grouped by first path segment, built once per app"""
+    table = _route_tables.get(id(app))
+    if table is None:
+        table = defaultdict(list)
+        for route in app.router.routes:
+            table[route.path.split("/")[1]].append((route.path_regex, getattr(route, "methods", None), route.path))
+        _route_tables[id(app)] = table
+    return table
+
+def _route_of(scope):
+    """Path template of the route serving this request (bounded label values)"""
+    path = scope["path"]
+    partial = None
+    for regex, methods, template in _route_table(scope["app"]).get(path.split("/")[1], ()):
+        if regex.match(path):
+            if methods is None or scope["method"] in methods:
+                return template
+            partial = partial or template
+    return partial or "unmatched"
+
+class MetricsMiddleware:
+    """Times every HTTP request and collects its database work"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route = _route_of(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        metrics.in_flight[(method, route)] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight[(method, route)] -= 1
+            metrics.observe(method, route, status, time.perf_counter() - started, stats)
+            _current.reset(token)
+
+class Profiler:
+    """Time-boxed sampling profiler over all threads of the live process
+
+    A background thread snapshots every thread's stack each interval; the
+    request handlers never run under a tracing hook.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.running = False
+
+    def sample(self, seconds, interval, include_idle=False):
+        """Collect stacks for `seconds` (blocking); returns (samples, Counter of stacks)
+
+        Threads parked waiting for work are left out unless `include_idle`.
+        """
+        with self._lock:
+            if self.running:
+                raise RuntimeError("A profile is already running")
+            self.running = True
+        try:
+            me = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = collections.Counter()
+            samples = 0
+            deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    code = frame.f_code
+                    if not include_idle and f"{os.path.basename(code.co_filename)}:{code.co_name}" in IDLE_FRAMES:
+                        continue
+                    calls = []
+                    while frame is not None:
+                        code = frame.f_code
+                        calls.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                        frame = frame.f_back
+                    calls.append(names.get(ident, "thread"))
+                    stacks[";".join(reversed(calls))] += 1
+                samples += 1
+                time.sleep(interval)
+            return samples, stacks
+        finally:
+            self.running = False
+
+def summarize(samples, stacks, top=30):
+    """Hottest stacks plus per-function self/total sample counts"""
+    self_counts = collections.Counter()
+    total_counts = collections.Counter()
+    for stack, count in stacks.items():
+        # Functions are counted once per stack, whatever line they were on
+        calls = [call.rsplit(":", 1)[0] for call in stack.split(";")[1:]]
+        if calls:
+            self_counts[calls[-1]] += count
+        for call in set(calls):
+            total_counts[call] += count
+    return {
+        "samples": samples,
+        "stacks": [{"stack": stack, "count": count} for stack, count in stacks.most_common(top)],
+        "functions": [
+            {"function": function, "self": count, "total": total_counts[function]}
+            for function, count in self_counts.most_common(top)
+        ]
+    }
+
+profiler = Profiler()
@@ -0,0 +1,79 @@
+"""Move legacy flat screenshot files into the configured screenshot store
+
+Usage (from the backend directory):
+    python migrate_screenshots.py [--store files|segments] [--dry-run]
+
+Rows whose filename/thumbnail still points at a file directly inside
+screenshots/ are handed to the store and updated in place. Files that no
+row references are left alone and reported.
+"""
+import argparse
+import os
+
+from database import init_db, get_db
+from screenshot_store import SCREENSHOTS_DIR, create_store
+
+def _session(student_id, timestamp):
+    safe = "".join(c if c.isalnum() or c in "_.-" else "_" for c in student_id)
+    return f"{safe}_{timestamp[:10].replace('-', '')}"
+
+def _is_legacy(key):
+    return bool(key) and "/" not in key and "@" not in key
+
+def migrate(store, dry_run=False):
+    moved = 0
+    missing = 0
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, student_id, filename, thumbnail, timestamp FROM screenshots ORDER BY id")
+        rows = cursor.fetchall()
+
+        for row in rows:
+            updates = {}
+            for column in ("filename", "thumbnail"):
+                key = row[column]
+                if not _is_legacy(key):
+                    continue
+                filepath = os.path.join(SCREENSHOTS_DIR, key)
+                if not os.path.isfile(filepath):
+                    missing += 1
+                    continue
+                if not dry_run:
+                    updates[column] = store.put(filepath, _session(row['student_id'], row['timestamp']))
+                moved += 1
+
+            if updates:
+                assignments = ", ".join(f"{column} = ?" for column in updates)
+                cursor.execute(
+                    f"UPDATE screenshots SET {assignments} WHERE id = ?",
+                    list(updates.values()) + [row['id']]
+                )
+                # Commit per row so an interrupted run never loses track of moved files
+                conn.commit()
+
+    orphans = [
+        name for name in os.listdir(SCREENSHOTS_DIR)
+        if os.path.isfile(os.path.join(SCREENSHOTS_DIR, name))
+    ]
+    return moved, missing, orphans
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--store", choices=["files", "segments"], default=None,
+                        help="target store (defaults to EXAM_SCREENSHOT_STORE)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would move")
+    args = parser.parse_args()
+
+    init_db()
+    store = create_store(args.store) if args.store else create_store()
+    moved, missing, orphans = migrate(store, dry_run=args.dry_run)
+
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"{verb} {moved} files into the {store.name} store")
+    if missing:
+        print(f"{missing} rows point at files that no longer exist")
+    if orphans:
+        print(f"{len(orphans)} unreferenced files left in {SCREENSHOTS_DIR}")
+
+if __name__ == "__main__":
+    main()
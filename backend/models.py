@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Dict, List, Optional
 
 class QuestionOption(BaseModel):
@@ -21,6 +21,10 @@ class ExamStatus(BaseModel):
     start_time: Optional[str] = None
     duration_minutes: int = 60
 
+class ExamCreate(BaseModel):
+    title: str
+    duration_minutes: int = 60
+
 class Student(BaseModel):
     student_id: str
     name: str
@@ -38,6 +42,15 @@ class Answer(BaseModel):
     question_id: int
     selected_answer: str
 
+class AnswerChange(BaseModel):
+    seq: int = Field(gt=0)
+    question_id: int
+    selected_answer: str
+
+class AnswerSync(BaseModel):
+    student_id: str
+    changes: List[AnswerChange] = Field(default_factory=list, max_length=1000)
+
 class ScreenshotUpload(BaseModel):
     student_id: str
     image_data: str  # Base64 encoded
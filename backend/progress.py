@@ -0,0 +1,182 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from database import run_db
+
+# A student shows as offline after this long without a heartbeat, answer or frame
+OFFLINE_SECONDS = float(os.environ.get("EXAM_PROGRESS_OFFLINE_SECONDS", "45"))
+# Heartbeats are kept in memory and written (and offline students marked) this often
+FLUSH_SECONDS = float(os.environ.get("EXAM_PROGRESS_FLUSH_SECONDS", "5"))
+
+COLUMNS = "student_id, answered, last_answer_at, last_screenshot_at, last_seen_at, online, version"
+
+def _placeholders(values):
+    return ",".join("?" for _ in values)
+
+def _by_exam(keys):
+    by_exam = {}
+    for exam_id, student_id in keys:
+        by_exam.setdefault(exam_id, []).append(student_id)
+    return by_exam
+
+def _next_version(cursor, exam_id):
+    """Version for this transaction's changes (call after a write, so the write lock is held)"""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM progress WHERE exam_id = ?", (exam_id,))
+    return cursor.fetchone()[0]
+
+def record_answers(cursor, keys):
+    """Copy the answered count of the given (exam_id, student_id) pairs from scores (after grading.update_scores); caller commits"""
+    now = datetime.now().isoformat()
+    for exam_id, student_ids in _by_exam(set(keys)).items():
+        version = _next_version(cursor, exam_id)
+        cursor.execute(f'''
+            INSERT INTO progress (exam_id, student_id, answered, last_answer_at, last_seen_at, online, version)
+            SELECT exam_id, student_id, answered, updated_at, ?, 1, ?
+            FROM scores
+            WHERE exam_id = ? AND student_id IN ({_placeholders(student_ids)})
+            ON CONFLICT (exam_id, student_id) DO UPDATE SET
+                answered = excluded.answered,
+                last_answer_at = excluded.last_answer_at,
+                last_seen_at = excluded.last_seen_at,
+                online = 1,
+                version = excluded.version
+        ''', [now, version, exam_id] + student_ids)
+
+def record_screenshot(cursor, exam_id, student_id, timestamp):
+    """Note a stored frame (after inserting it); caller commits"""
+    version = _next_version(cursor, exam_id)
+    cursor.execute('''
+        INSERT INTO progress (exam_id, student_id, last_screenshot_at, last_seen_at, online, version)
+        VALUES (?, ?, ?, ?, 1, ?)
+        ON CONFLICT (exam_id, student_id) DO UPDATE SET
+            last_screenshot_at = excluded.last_screenshot_at,
+            last_seen_at = excluded.last_seen_at,
+            online = 1,
+            version = excluded.version
+    ''', (exam_id, student_id, timestamp, timestamp, version))
+
+def _flush_seen(conn, seen):
+    cursor = conn.cursor()
+    by_exam = {}
+    for (exam_id, student_id), timestamp in seen.items():
+        by_exam.setdefault(exam_id, {})[student_id] = timestamp
+    for exam_id, students in by_exam.items():
+        # Writing first takes the write lock, so the version read below is the latest
+        cursor.executemany('''
+            INSERT INTO progress (exam_id, student_id, last_seen_at, online, version)
+            VALUES (?, ?, ?, 0, 0)
+            ON CONFLICT (exam_id, student_id) DO UPDATE SET
+                last_seen_at = MAX(COALESCE(last_seen_at, ''), excluded.last_seen_at)
+        ''', [(exam_id, student_id, timestamp) for student_id, timestamp in students.items()])
+        # Only students coming online are a change worth a new version
+        version = _next_version(cursor, exam_id)
+        student_ids = list(students)
+        cursor.execute(f'''
+            UPDATE progress SET online = 1, version = ?
+            WHERE exam_id = ? AND online = 0 AND student_id IN ({_placeholders(student_ids)})
+        ''', [version, exam_id] + student_ids)
+    conn.commit()
+
+def _mark_offline(conn, cutoff):
+    cursor = conn.cursor()
+    # Park them at their negated version (online rows have one >= 1) while
+    # holding the write lock, then give each exam's batch its next version
+    cursor.execute('''
+        UPDATE progress SET online = 0, version = -version
+        WHERE online = 1 AND last_seen_at < ?
+    ''', (cutoff,))
+    count = cursor.rowcount
+    if count:
+        cursor.execute("SELECT DISTINCT exam_id FROM progress WHERE version < 0")
+        for exam_id in [row[0] for row in cursor.fetchall()]:
+            cursor.execute("SELECT MAX(ABS(version)) + 1 FROM progress WHERE exam_id = ?", (exam_id,))
+            version = cursor.fetchone()[0]
+            cursor.execute("UPDATE progress SET version = ? WHERE exam_id = ? AND version < 0", (version, exam_id))
+    conn.commit()
+    return count
+
+def _row(row):
+    row = dict(row)
+    row['online'] = bool(row['online'])
+    return row
+
+def changes_since(conn, exam_id, since):
+    """(version, rows changed after `since`, reset); reset means the client's version is unknown here"""
+    cursor = conn.cursor()
+    query = f"SELECT {COLUMNS} FROM progress WHERE exam_id = ? AND version > ? ORDER BY version"
+    cursor.execute(query, (exam_id, since))
+    rows = [_row(row) for row in cursor.fetchall()]
+    if not rows and since:
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM progress WHERE exam_id = ?", (exam_id,))
+        if cursor.fetchone()[0] < since:
+            # E.g. the database was replaced; send everything again
+            cursor.execute(query, (exam_id, 0))
+            rows = [_row(row) for row in cursor.fetchall()]
+            return max([row['version'] for row in rows], default=0), rows, True
+    return max([row['version'] for row in rows], default=since), rows, False
+
+class ProgressBoard:
+    """Live per-student progress, materialized in the progress table
+
+    Answer and frame writes update the student's row in their own
+    transaction. Heartbeats only touch memory; a background task writes them
+    every FLUSH_SECONDS and marks students not seen for OFFLINE_SECONDS as
+    offline. Every change stamps the row with the exam's next version, so
+    the dashboard only fetches rows changed since the version it holds.
+    """
+
+    def __init__(self):
+        self._seen = {}
+        self._task = None
+        self.heartbeats = 0
+        self.flushes = 0
+        self.went_offline = 0
+
+    def seen(self, exam_id, student_id):
+        """Record a heartbeat (written with the next flush)"""
+        self._seen[(exam_id, student_id)] = datetime.now().isoformat()
+        self.heartbeats += 1
+
+    async def flush(self):
+        if self._seen:
+            seen, self._seen = self._seen, {}
+            try:
+                await run_db(_flush_seen, seen)
+            except Exception:
+                # Keep them for the next flush unless newer ones arrived
+                for key, timestamp in seen.items():
+                    self._seen.setdefault(key, timestamp)
+                raise
+            self.flushes += 1
+        cutoff = (datetime.now() - timedelta(seconds=OFFLINE_SECONDS)).isoformat()
+        self.went_offline += await run_db(_mark_offline, cutoff)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                # Try again on the next round
+                pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {
+            "pending_heartbeats": len(self._seen),
+            "heartbeats": self.heartbeats,
+            "flushes": self.flushes,
+            "went_offline": self.went_offline,
+            "offline_seconds": OFFLINE_SECONDS
+        }
+
+progress_board = ProgressBoard()
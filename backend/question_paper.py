@@ -0,0 +1,177 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+from fastapi import Request, Response
+
+from database import run_db
+import shuffle
+
+GZIP_MIN_SIZE = 1024
+
+def _encode(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _respond(request, body, etag, gzipped=None):
+    """JSON response honouring If-None-Match and Accept-Encoding
+
+    `body` may be a callable so a 304 never builds it; gzipped=None
+    compresses on demand, b"" means the body is too small to bother.
+    Always JSON, whatever the Accept header (so no Vary: Accept): the bytes
+    are built once per paper and ordering, not per request.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if callable(body):
+        body = body()
+    if "gzip" in request.headers.get("accept-encoding", "") and len(body) >= GZIP_MIN_SIZE:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=gzipped or gzip.compress(body, compresslevel=6), media_type="application/json", headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@dataclass(frozen=True)
+class EncodedPayload:
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+    @classmethod
+    def build(cls, data):
+        body = _encode(data)
+        gzipped = gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_SIZE else b""
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        return cls(body=body, gzipped=gzipped, etag=etag)
+
+    def response(self, request: Request):
+        """Build a response honouring If-None-Match and Accept-Encoding"""
+        return _respond(request, self.body, self.etag, self.gzipped)
+
+def _student_etag(etag, student_tag):
+    return etag[:-1] + "-" + student_tag + '"'
+
+@dataclass(frozen=True)
+class QuestionPaper:
+    exam_id: int
+    version: int
+    paper: EncodedPayload
+    questions: Dict[int, EncodedPayload]
+    # Per question: the encoded JSON up to the options object, and each encoded option value
+    pieces: Dict[int, Tuple[bytes, Tuple[bytes, ...]]]
+
+    def _question_bytes(self, student_id, question_id):
+        head, options = self.pieces[question_id]
+        order = shuffle.option_order(self.exam_id, student_id, question_id)
+        shown = b",".join(
+            b'"' + letter.encode() + b'":' + options[shuffle.LETTERS.index(stored)]
+            for letter, stored in zip(shuffle.LETTERS, order)
+        )
+        return head + shown + b"}}"
+
+    def _paper_body(self, student_id):
+        ids = shuffle.question_order(self.exam_id, student_id, self.pieces)
+        return (
+            b'{"success":true,"questions":['
+            + b",".join(self._question_bytes(student_id, question_id) for question_id in ids)
+            + b"]}"
+        )
+
+    def paper_response(self, request: Request, student_id=None):
+        """The whole paper in this student's order, assembled from the cached pieces"""
+        if student_id is None or not (shuffle.SHUFFLE_QUESTIONS or shuffle.SHUFFLE_OPTIONS):
+            return self.paper.response(request)
+        etag = _student_etag(self.paper.etag, shuffle.seed_tag(self.exam_id, student_id))
+        return _respond(request, lambda: self._paper_body(student_id), etag)
+
+    def question_response(self, request: Request, question_id, student_id=None):
+        """One question with this student's option order (the question must exist)"""
+        payload = self.questions[question_id]
+        if student_id is None or not shuffle.SHUFFLE_OPTIONS:
+            return payload.response(request)
+        etag = _student_etag(payload.etag, shuffle.seed_tag(self.exam_id, student_id))
+        return _respond(
+            request,
+            lambda: b'{"success":true,"question":' + self._question_bytes(student_id, question_id) + b"}",
+            etag
+        )
+
+def _question_pieces(q):
+    head = b'{"id":' + _encode(q['id']) + b',"question":' + _encode(q['question']) + b',"options":{'
+    options = tuple(_encode(q[f"option_{letter.lower()}"]) for letter in shuffle.LETTERS)
+    return head, options
+
+def _question_dict(q):
+    return {
+        "id": q['id'],
+        "question": q['question'],
+        "options": {
+            "A": q['option_a'],
+            "B": q['option_b'],
+            "C": q['option_c'],
+            "D": q['option_d'],
+            "E": q['option_e']
+        }
+    }
+
+class QuestionPaperCache:
+    """Student-facing question papers, encoded once per exam and state version
+
+    upload_questions compiles them write-through; any worker that sees a
+    newer exam state version recompiles that exam's paper with a single
+    query, and concurrent requests wait for that one rebuild instead of
+    each running their own.
+    """
+
+    def __init__(self):
+        self._papers = {}
+        self._lock = threading.Lock()
+        self._rebuilds = {}
+        self.compiles = 0
+
+    def compile(self, conn, exam_id, version):
+        """Encode an exam's paper from the questions table (runs on a DB thread)"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM questions WHERE exam_id = ? ORDER BY id", (exam_id,))
+        rows = cursor.fetchall()
+        questions = [_question_dict(q) for q in rows]
+
+        paper = QuestionPaper(
+            exam_id=exam_id,
+            version=version,
+            paper=EncodedPayload.build({"success": True, "questions": questions}),
+            questions={
+                q["id"]: EncodedPayload.build({"success": True, "question": q})
+                for q in questions
+            },
+            pieces={q['id']: _question_pieces(q) for q in rows}
+        )
+        with self._lock:
+            current = self._papers.get(exam_id)
+            if current is None or version >= current.version:
+                self._papers[exam_id] = paper
+                self.compiles += 1
+        return paper
+
+    async def get(self, exam_id, version):
+        """Paper of an exam at the given state version, compiling it at most once"""
+        paper = self._papers.get(exam_id)
+        if paper is not None and paper.version >= version:
+            return paper
+
+        pending = self._rebuilds.get(exam_id)
+        if pending is None or pending[0] < version:
+            pending = (version, asyncio.ensure_future(run_db(self.compile, exam_id, version, readonly=True)))
+            self._rebuilds[exam_id] = pending
+        rebuild = pending[1]
+        try:
+            return await asyncio.shield(rebuild)
+        finally:
+            if self._rebuilds.get(exam_id) is pending and rebuild.done():
+                del self._rebuilds[exam_id]
+
+question_paper = QuestionPaperCache()
@@ -1,257 +1,786 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from datetime import datetime
-from models import QuestionList, ExamStatus, AdminLogin, Student
-from database import get_db
+from typing import Optional
+import asyncio
+import csv
+import io
+from models import QuestionList, ExamStatus, AdminLogin, Student, ExamCreate
+from database import run_db, DEFAULT_EXAM_ID
+from exam_state import exam_state
+from question_paper import question_paper
+from events import hub, SSE_HEADERS
+from answer_queue import answer_queue
+from credentials import passwords, LoginBusy
+from auth import tokens, current_admin, ADMIN_TOKEN_MINUTES
+from exam_timer import exam_timer
+from metrics import profiler, summarize, PROFILE_MAX_SECONDS
+import exam_timer as timer
+import grading
+import progress
+import student_import
+from encoding import EncodedRoute, dumps_json
 
-router = APIRouter(prefix="/admin", tags=["admin"])
+router = APIRouter(prefix="/admin", tags=["admin"], route_class=EncodedRoute)
+
+# Every admin endpoint except login needs an admin session token
+ADMIN_ONLY = [Depends(current_admin)]
+
+def _admin_password(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT password FROM admin_credentials WHERE id = 1")
+    result = cursor.fetchone()
+    return result['password'] if result else None
+
+def _set_admin_password(conn, new_hash, old):
+    """Replace the admin password unless it changed since it was read"""
+    cursor = conn.cursor()
+    cursor.execute("UPDATE admin_credentials SET password = ? WHERE id = 1 AND password = ?", (new_hash, old))
+    conn.commit()
+    return cursor.rowcount == 1
 
 @router.post("/login")
 async def admin_login(credentials: AdminLogin):
     """Admin login"""
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT password FROM admin_credentials WHERE id = 1")
-            result = cursor.fetchone()
-            
-            if result and result['password'] == credentials.password:
-                return {
-                    "success": True,
-                    "message": "Login successful"
-                }
-            else:
-                raise HTTPException(status_code=401, detail="Invalid password")
+        stored = await run_db(_admin_password, readonly=True)
+        ok, new_hash = await passwords.verify("admin", credentials.password, stored)
+
+        if ok:
+            if new_hash:
+                await run_db(_set_admin_password, new_hash, stored)
+            token, expires_at = tokens.issue("admin", "admin", ADMIN_TOKEN_MINUTES)
+            return {
+                "success": True,
+                "message": "Login successful",
+                "token": token,
+                "expires_at": expires_at
+            }
+        else:
+            raise HTTPException(status_code=401, detail="Invalid password")
+    except HTTPException:
+        raise
+    except LoginBusy:
+        raise HTTPException(status_code=429, detail="Too many logins in progress, retry shortly", headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/change-password")
+@router.post("/logout")
+async def admin_logout(admin: Optional[dict] = Depends(current_admin)):
+    """Revoke the presented session token"""
+    if admin is not None:
+        tokens.revoke(admin)
+    return {
+        "success": True,
+        "message": "Logged out"
+    }
+
+@router.post("/change-password", dependencies=ADMIN_ONLY)
 async def change_admin_password(old_password: str, new_password: str):
     """Change admin password"""
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT password FROM admin_credentials WHERE id = 1")
-            result = cursor.fetchone()
-            
-            if result and result['password'] == old_password:
-                cursor.execute("UPDATE admin_credentials SET password = ? WHERE id = 1", (new_password,))
-                conn.commit()
-                return {
-                    "success": True,
-                    "message": "Password changed successfully"
-                }
-            else:
-                raise HTTPException(status_code=401, detail="Invalid old password")
+        stored = await run_db(_admin_password, readonly=True)
+        ok, _ = await passwords.verify("admin", old_password, stored)
+
+        if ok and await run_db(_set_admin_password, await passwords.hash(new_password), stored):
+            # Sign out every other admin session
+            tokens.revoke_subject("admin", "admin")
+            token, expires_at = tokens.issue("admin", "admin", ADMIN_TOKEN_MINUTES)
+            return {
+                "success": True,
+                "message": "Password changed successfully",
+                "token": token,
+                "expires_at": expires_at
+            }
+        else:
+            raise HTTPException(status_code=401, detail="Invalid old password")
+    except HTTPException:
+        raise
+    except LoginBusy:
+        raise HTTPException(status_code=429, detail="Too many logins in progress, retry shortly", headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/add-student")
+@router.post("/add-student", dependencies=ADMIN_ONLY)
 async def add_student(student: Student):
     """Admin adds a student with credentials"""
+    def insert(conn, password_hash):
+        cursor = conn.cursor()
+        connected_at = datetime.now().isoformat()
+
+        # Check if student exists
+        cursor.execute("SELECT * FROM students WHERE student_id = ?", (student.student_id,))
+        existing = cursor.fetchone()
+
+        if existing:
+            raise HTTPException(status_code=400, detail="Student ID already exists")
+
+        # Insert new student
+        cursor.execute('''
+            INSERT INTO students (student_id, name, password, connected_at)
+            VALUES (?, ?, ?, ?)
+        ''', (student.student_id, student.name, password_hash, connected_at))
+
+        conn.commit()
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            connected_at = datetime.now().isoformat()
-            
-            # Check if student exists
-            cursor.execute("SELECT * FROM students WHERE student_id = ?", (student.student_id,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                raise HTTPException(status_code=400, detail="Student ID already exists")
-            
-            # Insert new student
-            cursor.execute('''
-                INSERT INTO students (student_id, name, password, connected_at)
-                VALUES (?, ?, ?, ?)
-            ''', (student.student_id, student.name, student.password, connected_at))
-            
-            conn.commit()
-            return {
-                "success": True,
-                "message": f"Student {student.name} added successfully"
-            }
+        if not student.password:
+            raise HTTPException(status_code=400, detail="Password is required")
+        await run_db(insert, await passwords.hash(student.password))
+        hub.publish("students", {"changed": student.student_id})
+        return {
+            "success": True,
+            "message": f"Student {student.name} added successfully"
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.delete("/delete-student/{student_id}")
+@router.delete("/delete-student/{student_id}", dependencies=ADMIN_ONLY)
 async def delete_student(student_id: str):
     """Delete a student"""
+    def delete(conn):
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM students WHERE student_id = ?", (student_id,))
+        conn.commit()
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM students WHERE student_id = ?", (student_id,))
-            conn.commit()
-            return {
-                "success": True,
-                "message": "Student deleted successfully"
-            }
+        await run_db(delete)
+        tokens.revoke_subject("student", student_id)
+        hub.publish("students", {"changed": student_id})
+        return {
+            "success": True,
+            "message": "Student deleted successfully"
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/upload-questions")
-async def upload_questions(questions: QuestionList):
-    """Upload exam questions before exam starts"""
+IMPORT_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl"
+}
+
+@router.post("/import-students", dependencies=ADMIN_ONLY)
+async def import_students(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|jsonl)$"),
+    on_conflict: str = Query("skip", pattern="^(skip|update)$")
+):
+    """Bulk-add students from a CSV or JSON-lines upload
+
+    The body is parsed as it streams in. CSV needs a header with
+    student_id, name and password columns; JSON lines need objects with
+    those keys. Passwords are hashed in the KDF pool and valid rows are
+    inserted in chunked transactions; the summary lists invalid rows and
+    existing students by line number.
+    Existing students are skipped, or updated with on_conflict=update.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    format = format or IMPORT_FORMATS.get(content_type, "csv")
+    update_existing = on_conflict == "update"
+    summary = student_import.ImportSummary()
+    seen = set()
+    chunk = []
+    lines_by_id = {}
+
+    async def flush():
+        hashes = await passwords.hash_many([password for _, _, password in chunk])
+        rows = [(student_id, name, password_hash) for (student_id, name, _), password_hash in zip(chunk, hashes)]
+        inserted, existing = await run_db(student_import.insert_students, rows, update_existing)
+        summary.inserted += len(inserted)
+        if update_existing:
+            summary.updated += len(existing)
+            # Their passwords may have changed
+            for student_id in existing:
+                tokens.revoke_subject("student", student_id)
+        else:
+            summary.conflicts += len(existing)
+            for student_id in existing:
+                summary.error(lines_by_id[student_id], student_id, "Student ID already exists")
+        chunk.clear()
+        lines_by_id.clear()
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            # Check if exam is active
-            cursor.execute("SELECT is_active FROM exam_status WHERE id = 1")
-            status = cursor.fetchone()
-            if status and status['is_active'] == 1:
-                raise HTTPException(status_code=400, detail="Cannot upload questions while exam is active")
-            
-            # Clear existing questions
-            cursor.execute("DELETE FROM questions")
-            
-            # Insert new questions
-            for q in questions.questions:
-                cursor.execute('''
-                    INSERT INTO questions 
-                    (question, option_a, option_b, option_c, option_d, option_e, correct_answer)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    q.question,
-                    q.options.A,
-                    q.options.B,
-                    q.options.C,
-                    q.options.D,
-                    q.options.E,
-                    q.correct
-                ))
-            
-            conn.commit()
-            return {
-                "success": True,
-                "message": f"Successfully uploaded {len(questions.questions)} questions"
-            }
+        lines = student_import.iter_lines(request.stream())
+        parse = student_import.parse_jsonl if format == "jsonl" else student_import.parse_csv
+        async for number, row in parse(lines):
+            summary.rows += 1
+            if isinstance(row, str):
+                summary.invalid += 1
+                summary.error(number, None, row)
+                continue
+            try:
+                values = student_import.validate(row)
+            except ValueError as e:
+                summary.invalid += 1
+                summary.error(number, row.get("student_id"), str(e))
+                continue
+            if values[0] in seen:
+                summary.invalid += 1
+                summary.error(number, values[0], "Duplicate student ID in upload")
+                continue
+            seen.add(values[0])
+            chunk.append(values)
+            lines_by_id[values[0]] = number
+            if len(chunk) >= student_import.IMPORT_CHUNK_ROWS:
+                await flush()
+        if chunk:
+            await flush()
+    except student_import.ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Upload is not valid UTF-8")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if summary.inserted or summary.updated:
+            hub.publish("students", {"imported": summary.inserted + summary.updated})
+
+    return {
+        "success": True,
+        "message": f"Imported {summary.inserted} students",
+        **summary.as_dict()
+    }
 
-@router.post("/start-exam")
-async def start_exam(duration_minutes: int = 60):
+@router.post("/exams", dependencies=ADMIN_ONLY)
+async def create_exam(exam: ExamCreate):
+    """Create a new exam; questions are uploaded to it separately"""
+    def insert(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO exams (title, duration_minutes, created_at)
+            VALUES (?, ?, ?)
+        ''', (exam.title, exam.duration_minutes, datetime.now().isoformat()))
+        conn.commit()
+        return exam_state.refresh(conn, cursor.lastrowid)
+
+    try:
+        snapshot = await run_db(insert)
+        hub.publish_status(snapshot)
+        return {
+            "success": True,
+            "message": f"Exam {exam.title} created",
+            "exam_id": snapshot.exam_id
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/exams", dependencies=ADMIN_ONLY)
+async def list_exams():
+    """Every exam with its question and participant counts"""
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT e.id, e.title, e.is_active, e.start_time, e.duration_minutes, e.created_at,
+                   (SELECT COUNT(*) FROM questions q WHERE q.exam_id = e.id) as total_questions,
+                   (SELECT COUNT(*) FROM scores s WHERE s.exam_id = e.id) as participants
+            FROM exams e
+            ORDER BY e.id
+        ''')
+        return [dict(e, is_active=bool(e['is_active'])) for e in cursor.fetchall()]
+
+    try:
+        return {
+            "success": True,
+            "exams": await run_db(query, readonly=True)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/upload-questions", dependencies=ADMIN_ONLY)
+@router.post("/exams/{exam_id}/upload-questions", dependencies=ADMIN_ONLY)
+async def upload_questions(questions: QuestionList, exam_id: int = DEFAULT_EXAM_ID):
+    """Upload exam questions before exam starts
+
+    Replaces the questions of this exam only; other exams and their
+    results are left alone.
+    """
+    def replace_questions(conn):
+        cursor = conn.cursor()
+
+        # Check if exam is active
+        cursor.execute("SELECT is_active FROM exams WHERE id = ?", (exam_id,))
+        status = cursor.fetchone()
+        if status is None:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        if status['is_active'] == 1:
+            raise HTTPException(status_code=400, detail="Cannot upload questions while exam is active")
+
+        # Clear existing questions
+        cursor.execute("DELETE FROM questions WHERE exam_id = ?", (exam_id,))
+
+        # Insert new questions
+        cursor.executemany('''
+            INSERT INTO questions
+            (exam_id, question, option_a, option_b, option_c, option_d, option_e, correct_answer)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            exam_id,
+            q.question,
+            q.options.A,
+            q.options.B,
+            q.options.C,
+            q.options.D,
+            q.options.E,
+            q.correct
+        ) for q in questions.questions])
+
+        # The answer key changed, so every running score of this exam is stale
+        grading.rebuild_scores(cursor, exam_id)
+
+        exam_state.bump(conn, exam_id)
+        conn.commit()
+        snapshot = exam_state.refresh(conn, exam_id)
+        question_paper.compile(conn, exam_id, snapshot.version)
+        return snapshot
+
+    try:
+        hub.publish_status(await run_db(replace_questions))
+        return {
+            "success": True,
+            "message": f"Successfully uploaded {len(questions.questions)} questions"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/start-exam", dependencies=ADMIN_ONLY)
+@router.post("/exams/{exam_id}/start-exam", dependencies=ADMIN_ONLY)
+async def start_exam(duration_minutes: int = 60, exam_id: int = DEFAULT_EXAM_ID):
     """Start the exam"""
+    def start(conn):
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT id FROM exams WHERE id = ?", (exam_id,))
+        if cursor.fetchone() is None:
+            raise HTTPException(status_code=404, detail="Exam not found")
+
+        # Check if questions exist
+        cursor.execute("SELECT COUNT(*) as count FROM questions WHERE exam_id = ?", (exam_id,))
+        count = cursor.fetchone()['count']
+        if count == 0:
+            raise HTTPException(status_code=400, detail="No questions uploaded. Please upload questions first.")
+
+        # Start exam; every start is a new sitting with fresh per-student clocks
+        cursor.execute('''
+            UPDATE exams
+            SET is_active = 1, start_time = ?, duration_minutes = ?
+            WHERE id = ?
+        ''', (datetime.now().isoformat(), duration_minutes, exam_id))
+        cursor.execute("DELETE FROM attempts WHERE exam_id = ?", (exam_id,))
+
+        exam_state.bump(conn, exam_id)
+        conn.commit()
+        exam_timer.refresh(conn, exam_id)
+        return exam_state.refresh(conn, exam_id)
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            # Check if questions exist
-            cursor.execute("SELECT COUNT(*) as count FROM questions")
-            count = cursor.fetchone()['count']
-            if count == 0:
-                raise HTTPException(status_code=400, detail="No questions uploaded. Please upload questions first.")
-            
-            # Start exam
-            start_time = datetime.now().isoformat()
-            cursor.execute('''
-                UPDATE exam_status 
-                SET is_active = 1, start_time = ?, duration_minutes = ?
-                WHERE id = 1
-            ''', (start_time, duration_minutes))
-            
-            conn.commit()
-            return {
-                "success": True,
-                "message": "Exam started successfully",
-                "start_time": start_time,
-                "duration_minutes": duration_minutes
-            }
+        snapshot = await run_db(start)
+        hub.publish_status(snapshot)
+        return {
+            "success": True,
+            "message": "Exam started successfully",
+            "start_time": snapshot.start_time,
+            "duration_minutes": duration_minutes
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/stop-exam")
-async def stop_exam():
+@router.post("/stop-exam", dependencies=ADMIN_ONLY)
+@router.post("/exams/{exam_id}/stop-exam", dependencies=ADMIN_ONLY)
+async def stop_exam(exam_id: int = DEFAULT_EXAM_ID):
     """Stop/terminate the exam"""
+    def stop(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE exams
+            SET is_active = 0, start_time = NULL
+            WHERE id = ?
+        ''', (exam_id,))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        timer.finalize(conn, exam_id, "admin")
+        exam_state.bump(conn, exam_id)
+        conn.commit()
+        exam_timer.refresh(conn, exam_id)
+        return exam_state.refresh(conn, exam_id)
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE exam_status 
-                SET is_active = 0, start_time = NULL
-                WHERE id = 1
-            ''')
-            conn.commit()
-            return {
-                "success": True,
-                "message": "Exam stopped successfully"
-            }
+        hub.publish_status(await run_db(stop))
+        # Answers accepted before the stop must not be lost
+        await answer_queue.flush()
+        return {
+            "success": True,
+            "message": "Exam stopped successfully"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/extend-time", dependencies=ADMIN_ONLY)
+@router.post("/exams/{exam_id}/extend-time", dependencies=ADMIN_ONLY)
+async def extend_time(minutes: int = Query(..., ge=1, le=600), student_id: Optional[str] = None, exam_id: int = DEFAULT_EXAM_ID):
+    """Give one student, or everybody, extra minutes on a running exam
+
+    Students whose time had already run out can answer again.
+    """
+    def extend(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT is_active FROM exams WHERE id = ?", (exam_id,))
+        exam = cursor.fetchone()
+        if exam is None:
+            raise HTTPException(status_code=404, detail="Exam not found")
+        if not exam['is_active']:
+            raise HTTPException(status_code=400, detail="Exam is not running")
+
+        if student_id is None:
+            cursor.execute("UPDATE exams SET duration_minutes = duration_minutes + ? WHERE id = ?", (minutes, exam_id))
+            timer.reopen(conn, exam_id)
+            exam_state.bump(conn, exam_id)
+        else:
+            timer.add_time(conn, exam_id, student_id, minutes)
+        conn.commit()
+        exam_timer.refresh(conn, exam_id)
+        return exam_state.refresh(conn, exam_id)
+
+    try:
+        snapshot = await run_db(extend)
+        if student_id is None:
+            hub.publish_status(snapshot)
+        return {
+            "success": True,
+            "message": f"Added {minutes} minutes for {student_id or 'all students'}",
+            "duration_minutes": snapshot.duration_minutes
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/attempts", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/attempts", dependencies=ADMIN_ONLY)
+async def get_attempts(exam_id: int = DEFAULT_EXAM_ID):
+    """Each student's start, extra time, deadline and submission for an exam"""
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT student_id, started_at, extra_minutes, submitted_at, submitted_by
+            FROM attempts
+            WHERE exam_id = ?
+            ORDER BY student_id
+        ''', (exam_id,))
+        return [dict(a) for a in cursor.fetchall()]
+
+    try:
+        status = await exam_state.require(exam_id)
+        attempts = await run_db(query, readonly=True)
+        if status.is_active and status.start_time:
+            for attempt in attempts:
+                timing = exam_timer.describe(status, timer.from_row(attempt))
+                attempt["deadline"] = timing["deadline"]
+                attempt["remaining_seconds"] = timing["remaining_seconds"]
+
+        return {
+            "success": True,
+            "exam_id": exam_id,
+            "attempts": attempts
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/students")
+@router.get("/students", dependencies=ADMIN_ONLY)
 async def get_students():
     """Get list of connected students"""
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT student_id, name, connected_at FROM students")
+        return [dict(s) for s in cursor.fetchall()]
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT student_id, name, connected_at FROM students")
-            students = cursor.fetchall()
-            return {
-                "success": True,
-                "students": [dict(s) for s in students]
-            }
+        students = await run_db(query, readonly=True)
+        return {
+            "success": True,
+            "students": students
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/exam-status")
-async def get_exam_status():
+@router.get("/exam-status", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/exam-status", dependencies=ADMIN_ONLY)
+async def get_exam_status(exam_id: int = DEFAULT_EXAM_ID):
     """Get current exam status"""
+    def count_students(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) as count FROM students")
+        return cursor.fetchone()['count']
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM exam_status WHERE id = 1")
-            status = cursor.fetchone()
-            
-            cursor.execute("SELECT COUNT(*) as count FROM questions")
-            question_count = cursor.fetchone()['count']
-            
-            cursor.execute("SELECT COUNT(*) as count FROM students")
-            student_count = cursor.fetchone()['count']
-            
-            return {
-                "success": True,
-                "is_active": bool(status['is_active']),
-                "start_time": status['start_time'],
-                "duration_minutes": status['duration_minutes'],
-                "total_questions": question_count,
-                "total_students": student_count
-            }
+        status = await exam_state.require(exam_id)
+        student_count = await run_db(count_students, readonly=True)
+
+        return {
+            "success": True,
+            "exam_id": status.exam_id,
+            "title": status.title,
+            "is_active": status.is_active,
+            "start_time": status.start_time,
+            "duration_minutes": status.duration_minutes,
+            "total_questions": status.total_questions,
+            "total_students": student_count
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/submissions")
-async def get_submissions():
-    """Get all student submissions"""
+@router.get("/progress", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/progress", dependencies=ADMIN_ONLY)
+async def get_progress(exam_id: int = DEFAULT_EXAM_ID, since: int = Query(0, ge=0)):
+    """Live per-student progress, only the rows changed after version `since`
+
+    Start with since=0 for every student with activity, then pass back the
+    returned version. When `reset` is true the client should drop what it
+    holds and use the rows returned.
+    """
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT DISTINCT student_id 
-                FROM answers
-            ''')
-            students = cursor.fetchall()
-            
-            submissions = []
-            for student in students:
-                student_id = student['student_id']
-                cursor.execute('''
-                    SELECT question_id, selected_answer, timestamp
-                    FROM answers
-                    WHERE student_id = ?
-                    ORDER BY question_id
-                ''', (student_id,))
-                answers = cursor.fetchall()
-                
-                submissions.append({
-                    "student_id": student_id,
-                    "answers": [dict(a) for a in answers],
-                    "total_answered": len(answers)
-                })
-            
-            return {
-                "success": True,
-                "submissions": submissions
-            }
+        status = await exam_state.require(exam_id)
+        version, rows, reset = await run_db(progress.changes_since, exam_id, since, readonly=True)
+
+        return {
+            "success": True,
+            "exam_id": status.exam_id,
+            "is_active": status.is_active,
+            "total_questions": status.total_questions,
+            "version": version,
+            "reset": reset,
+            "students": rows,
+            "server_time": datetime.now().isoformat()
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+SUBMISSIONS_CHUNK_ROWS = 2000
+
+def _fetch_answer_chunk(conn, exam_id, after, since, limit):
+    """Next chunk of an exam's answers in (student_id, question_id) order"""
+    cursor = conn.cursor()
+    conditions = ["exam_id = ?", "(student_id, question_id) > (?, ?)"]
+    params = [exam_id, after[0], after[1]]
+    if since:
+        conditions.append("student_id IN (SELECT DISTINCT student_id FROM answers WHERE exam_id = ? AND timestamp > ?)")
+        params.extend([exam_id, since])
+    cursor.execute(f'''
+        SELECT student_id, question_id, selected_answer, timestamp
+        FROM answers
+        WHERE {" AND ".join(conditions)}
+        ORDER BY student_id, question_id
+        LIMIT ?
+    ''', params + [limit])
+    return [tuple(row) for row in cursor.fetchall()]
+
+async def _iter_submissions(exam_id, cursor, since, limit):
+    """Group one ordered scan of answers into per-student submissions"""
+    # A cursor names the last student of the previous page: skip all of it
+    after = (cursor, 2 ** 63 - 1) if cursor else ("", -1)
+    current = None
+    emitted = 0
+    while True:
+        rows = await run_db(_fetch_answer_chunk, exam_id, after, since, SUBMISSIONS_CHUNK_ROWS, readonly=True)
+        for student_id, question_id, selected_answer, timestamp in rows:
+            if current is None or current["student_id"] != student_id:
+                if current is not None:
+                    yield current
+                    emitted += 1
+                    if limit and emitted >= limit:
+                        return
+                current = {"student_id": student_id, "answers": [], "total_answered": 0}
+            current["answers"].append({
+                "question_id": question_id,
+                "selected_answer": selected_answer,
+                "timestamp": timestamp
+            })
+            current["total_answered"] += 1
+        if len(rows) < SUBMISSIONS_CHUNK_ROWS:
+            break
+        after = rows[-1][:2]
+    if current is not None:
+        yield current
+
+async def _submissions_json(submissions, limit):
+    """`submissions` yields up to limit + 1 students; the extra one only tells another page exists"""
+    yield b'{"success":true,"submissions":['
+    count = 0
+    last = None
+    next_cursor = None
+    async for submission in submissions:
+        if limit and count >= limit:
+            next_cursor = last
+            break
+        yield (b"," if count else b"") + dumps_json(submission)
+        count += 1
+        last = submission["student_id"]
+    yield b'],"next_cursor":' + dumps_json(next_cursor) + b"}"
+
+async def _submissions_jsonl(submissions):
+    async for submission in submissions:
+        yield dumps_json(submission) + b"\n"
+
+async def _submissions_csv(submissions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["student_id", "question_id", "selected_answer", "timestamp"])
+    async for submission in submissions:
+        for answer in submission["answers"]:
+            writer.writerow([
+                submission["student_id"],
+                answer["question_id"],
+                answer["selected_answer"],
+                answer["timestamp"]
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+@router.get("/submissions", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/submissions", dependencies=ADMIN_ONLY)
+async def get_submissions(
+    format: str = Query("json", pattern="^(json|jsonl|csv)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(0, ge=0),
+    since: Optional[str] = None,
+    exam_id: int = DEFAULT_EXAM_ID
+):
+    """Get all student submissions
+
+    Streams one ordered scan of the answers table. `limit` pages by student
+    (continue with `cursor` = last student_id), and `since` returns only
+    students with answers newer than that timestamp; pass the X-As-Of
+    header of the previous response to refresh incrementally.
+    """
+    try:
+        # Make sure accepted answers are visible to the export
+        await answer_queue.flush()
+        headers = {"X-As-Of": datetime.now().isoformat()}
+
+        if format == "csv":
+            headers["Content-Disposition"] = "attachment; filename=submissions.csv"
+            submissions = _iter_submissions(exam_id, cursor, since, limit)
+            return StreamingResponse(_submissions_csv(submissions), media_type="text/csv", headers=headers)
+        if format == "jsonl":
+            submissions = _iter_submissions(exam_id, cursor, since, limit)
+            return StreamingResponse(_submissions_jsonl(submissions), media_type="application/x-ndjson", headers=headers)
+        # One student more than the page, so next_cursor is only set when more remain
+        submissions = _iter_submissions(exam_id, cursor, since, limit + 1 if limit else 0)
+        return StreamingResponse(_submissions_json(submissions, limit), media_type="application/json", headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/results", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/results", dependencies=ADMIN_ONLY)
+async def get_results(exam_id: int = DEFAULT_EXAM_ID):
+    """Scores for every student who has answered"""
+    try:
+        await answer_queue.flush()
+        results = await run_db(grading.get_results, exam_id, readonly=True)
+        return {
+            "success": True,
+            "results": results
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/results/{student_id}", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/results/{student_id}", dependencies=ADMIN_ONLY)
+async def get_student_result(student_id: str, exam_id: int = DEFAULT_EXAM_ID):
+    """Score and per-question breakdown for one student"""
+    try:
+        await answer_queue.flush()
+        result = await run_db(grading.get_student_result, exam_id, student_id, readonly=True)
+        if result is None:
+            raise HTTPException(status_code=404, detail="No answers recorded for this student")
+        return {
+            "success": True,
+            "result": result
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/leaderboard", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/leaderboard", dependencies=ADMIN_ONLY)
+async def get_leaderboard(limit: int = Query(10, ge=1, le=1000), exam_id: int = DEFAULT_EXAM_ID):
+    """Top students by number of correct answers"""
+    try:
+        await answer_queue.flush()
+        leaderboard = await run_db(grading.get_leaderboard, exam_id, limit, readonly=True)
+        return {
+            "success": True,
+            "leaderboard": leaderboard
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/question-stats", dependencies=ADMIN_ONLY)
+@router.get("/exams/{exam_id}/question-stats", dependencies=ADMIN_ONLY)
+async def get_question_stats(exam_id: int = DEFAULT_EXAM_ID):
+    """Difficulty, discrimination and option spread for each question"""
+    try:
+        await answer_queue.flush()
+        stats = await run_db(grading.get_question_stats, exam_id, readonly=True)
+        return {
+            "success": True,
+            "questions": stats
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/events", dependencies=ADMIN_ONLY)
+async def admin_events(request: Request, exam_id: Optional[int] = None):
+    """Server-Sent Events stream of exam status and roster changes
+
+    Covers every exam unless `exam_id` picks one.
+    """
+    return StreamingResponse(
+        hub.stream(request, events={"status", "students"}, exam_id=exam_id),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@router.get("/profile", dependencies=ADMIN_ONLY)
+async def profile(
+    seconds: float = Query(5, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    format: str = Query("json", pattern="^(json|collapsed)$"),
+    include_idle: bool = False
+):
+    """Sample every thread of this worker for a few seconds and return the hot stacks
+
+    Threads waiting for work are skipped unless `include_idle` is set.
+    `format=collapsed` returns "frame;frame;frame count" lines for flame graph tools.
+    """
+    try:
+        # Off the I/O pool, so a profile does not hold up screenshot writes
+        samples, stacks = await asyncio.to_thread(profiler.sample, seconds, interval_ms / 1000, include_idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "collapsed":
+        return PlainTextResponse("".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
+    return {
+        "success": True,
+        "seconds": seconds,
+        "interval_ms": interval_ms,
+        **summarize(samples, stacks)
+    }
@@ -1,228 +1,429 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from datetime import datetime
-from models import Answer, StudentLogin
-from database import get_db
+from typing import Optional
+import asyncio
+from models import Answer, AnswerSync, StudentLogin
+from database import run_db, DEFAULT_EXAM_ID
+from exam_state import exam_state
+from question_paper import question_paper
+from events import hub, SSE_HEADERS
+from answer_queue import answer_queue, QueueFull, WAIT_FOR_COMMIT
+from credentials import passwords, LoginBusy
+from auth import tokens, current_student, check_student, STUDENT_TOKEN_MINUTES
+from exam_timer import exam_timer
+import shuffle
+import grading
+import progress
+from progress import progress_board
+from metrics import metrics
+from encoding import EncodedRoute
 
-router = APIRouter(prefix="/exam", tags=["exam"])
+router = APIRouter(prefix="/exam", tags=["exam"], route_class=EncodedRoute)
 
 @router.post("/student-login")
 async def student_login(credentials: StudentLogin):
     """Student login with password"""
-    try:
-        with get_db() as conn:
-            cursor = conn.cursor()
+    def lookup(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT student_id, name, password FROM students
+            WHERE student_id = ?
+        ''', (credentials.student_id,))
+        return cursor.fetchone()
+
+    def login(conn, stored, new_hash):
+        cursor = conn.cursor()
+        if new_hash:
+            # Upgrade a plaintext (or outdated) password unless it changed meanwhile
             cursor.execute('''
-                SELECT * FROM students 
+                UPDATE students
+                SET password = ?
                 WHERE student_id = ? AND password = ?
-            ''', (credentials.student_id, credentials.password))
-            
-            student = cursor.fetchone()
-            
-            if student:
-                # Update connection time
-                cursor.execute('''
-                    UPDATE students 
-                    SET connected_at = ?
-                    WHERE student_id = ?
-                ''', (datetime.now().isoformat(), credentials.student_id))
-                conn.commit()
-                
-                return {
-                    "success": True,
-                    "message": "Login successful",
-                    "student": {
-                        "student_id": student['student_id'],
-                        "name": student['name']
-                    }
-                }
-            else:
-                raise HTTPException(status_code=401, detail="Invalid student ID or password")
+            ''', (new_hash, credentials.student_id, stored))
+
+        # Update connection time
+        cursor.execute('''
+            UPDATE students
+            SET connected_at = ?
+            WHERE student_id = ?
+        ''', (datetime.now().isoformat(), credentials.student_id))
+        conn.commit()
+
+    try:
+        student = await run_db(lookup, readonly=True)
+        stored = student['password'] if student else None
+        ok, new_hash = await passwords.verify(f"student:{credentials.student_id}", credentials.password, stored)
+
+        if ok:
+            await run_db(login, stored, new_hash)
+            token, expires_at = tokens.issue(student['student_id'], "student", STUDENT_TOKEN_MINUTES)
+            return {
+                "success": True,
+                "message": "Login successful",
+                "student": {
+                    "student_id": student['student_id'],
+                    "name": student['name']
+                },
+                "token": token,
+                "expires_at": expires_at
+            }
+        else:
+            raise HTTPException(status_code=401, detail="Invalid student ID or password")
     except HTTPException:
         raise
+    except LoginBusy:
+        raise HTTPException(status_code=429, detail="Too many logins in progress, retry shortly", headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/logout")
+async def student_logout(student: Optional[dict] = Depends(current_student)):
+    """Revoke the presented session token"""
+    if student is not None:
+        tokens.revoke(student)
+    return {
+        "success": True,
+        "message": "Logged out"
+    }
+
+@router.get("/exams")
+async def list_open_exams():
+    """Exams that are currently running"""
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, title, start_time, duration_minutes
+            FROM exams
+            WHERE is_active = 1
+            ORDER BY id
+        ''')
+        return [dict(e) for e in cursor.fetchall()]
+
+    try:
+        return {
+            "success": True,
+            "exams": await run_db(query, readonly=True)
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/status")
-async def get_exam_status():
+@router.get("/exams/{exam_id}/status")
+async def get_exam_status(exam_id: int = DEFAULT_EXAM_ID):
     """Get current exam status"""
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM exam_status WHERE id = 1")
-            status = cursor.fetchone()
-            
-            cursor.execute("SELECT COUNT(*) as count FROM questions")
-            question_count = cursor.fetchone()['count']
-            
-            return {
-                "success": True,
-                "is_active": bool(status['is_active']),
-                "start_time": status['start_time'],
-                "duration_minutes": status['duration_minutes'],
-                "total_questions": question_count
-            }
+        status = await exam_state.require(exam_id)
+
+        return {
+            "success": True,
+            "exam_id": status.exam_id,
+            "title": status.title,
+            "is_active": status.is_active,
+            "start_time": status.start_time,
+            "duration_minutes": status.duration_minutes,
+            "total_questions": status.total_questions
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/events")
+@router.get("/exams/{exam_id}/events")
+async def exam_events(request: Request, exam_id: int = DEFAULT_EXAM_ID):
+    """Server-Sent Events stream pushing exam start/stop and timing changes"""
+    await exam_state.require(exam_id)
+    return StreamingResponse(
+        hub.stream(request, events={"status"}, exam_id=exam_id),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+async def _active_paper(exam_id):
+    """State and question paper of a running exam"""
+    status = await exam_state.require(exam_id)
+    if not status.is_active:
+        raise HTTPException(status_code=403, detail="Exam is not active")
+    return status, await question_paper.get(exam_id, status.version)
+
+def _viewer(student, student_id):
+    """Whose ordering to serve: the token's student, else ?student_id= while auth is optional
+
+    Answers are always mapped back through the student's ordering, so the
+    paper is never served without one.
+    """
+    if student_id is not None:
+        check_student(student, student_id)
+    viewer = student["sub"] if student is not None else student_id
+    if viewer is None:
+        raise HTTPException(status_code=400, detail="student_id is required")
+    return viewer
+
 @router.get("/questions")
-async def get_all_questions():
-    """Get all exam questions (only when exam is active)"""
+@router.get("/exams/{exam_id}/questions")
+async def get_all_questions(request: Request, exam_id: int = DEFAULT_EXAM_ID, student_id: Optional[str] = None, student: Optional[dict] = Depends(current_student)):
+    """Get all exam questions (only when exam is active)
+
+    Served from the pre-encoded question paper with ETag / gzip support,
+    in the student's own question and option order.
+    """
+    viewer = _viewer(student, student_id)
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            # Check if exam is active
-            cursor.execute("SELECT is_active FROM exam_status WHERE id = 1")
-            status = cursor.fetchone()
-            if not status or status['is_active'] == 0:
-                raise HTTPException(status_code=403, detail="Exam is not active")
-            
-            cursor.execute("SELECT * FROM questions")
-            questions = cursor.fetchall()
-            
-            return {
-                "success": True,
-                "questions": [{
-                    "id": q['id'],
-                    "question": q['question'],
-                    "options": {
-                        "A": q['option_a'],
-                        "B": q['option_b'],
-                        "C": q['option_c'],
-                        "D": q['option_d'],
-                        "E": q['option_e']
-                    }
-                } for q in questions]
-            }
+        status, paper = await _active_paper(exam_id)
+        # Opening the paper starts the student's own clock
+        await exam_timer.begin(status, viewer)
+        return paper.paper_response(request, viewer)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/question/{question_id}")
-async def get_question(question_id: int):
+@router.get("/exams/{exam_id}/question/{question_id}")
+async def get_question(question_id: int, request: Request, exam_id: int = DEFAULT_EXAM_ID, student_id: Optional[str] = None, student: Optional[dict] = Depends(current_student)):
     """Get a specific question by ID"""
+    viewer = _viewer(student, student_id)
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            # Check if exam is active
-            cursor.execute("SELECT is_active FROM exam_status WHERE id = 1")
-            status = cursor.fetchone()
-            if not status or status['is_active'] == 0:
-                raise HTTPException(status_code=403, detail="Exam is not active")
-            
-            cursor.execute("SELECT * FROM questions WHERE id = ?", (question_id,))
-            question = cursor.fetchone()
-            
-            if not question:
-                raise HTTPException(status_code=404, detail="Question not found")
-            
-            return {
-                "success": True,
-                "question": {
-                    "id": question['id'],
-                    "question": question['question'],
-                    "options": {
-                        "A": question['option_a'],
-                        "B": question['option_b'],
-                        "C": question['option_c'],
-                        "D": question['option_d'],
-                        "E": question['option_e']
-                    }
-                }
-            }
+        _, paper = await _active_paper(exam_id)
+
+        if question_id not in paper.questions:
+            raise HTTPException(status_code=404, detail="Question not found")
+
+        return paper.question_response(request, question_id, viewer)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/answer")
-async def submit_answer(answer: Answer):
-    """Submit an answer for a question"""
+@router.post("/exams/{exam_id}/answer")
+async def submit_answer(answer: Answer, exam_id: int = DEFAULT_EXAM_ID, student: Optional[dict] = Depends(current_student)):
+    """Submit an answer for a question
+
+    Answers are coalesced and committed in batches; by default the response
+    waits until the batch containing this answer is committed. The letter is
+    the one the student saw and is stored as the original option letter.
+    Answers after the student's deadline or submission are refused.
+    """
+    check_student(student, answer.student_id)
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            # Check if exam is active
-            cursor.execute("SELECT is_active FROM exam_status WHERE id = 1")
-            status = cursor.fetchone()
-            if not status or status['is_active'] == 0:
-                raise HTTPException(status_code=403, detail="Exam is not active")
-            
-            timestamp = datetime.now().isoformat()
-            
-            # Check if answer already exists
+        # The cached paper also tells whether the question belongs to this exam
+        status, paper = await _active_paper(exam_id)
+        if answer.question_id not in paper.questions:
+            raise HTTPException(status_code=404, detail="Question not found")
+        await exam_timer.admit(status, answer.student_id)
+
+        commit = answer_queue.enqueue(
+            answer.student_id,
+            answer.question_id,
+            shuffle.to_stored(exam_id, answer.student_id, answer.question_id, answer.selected_answer),
+            datetime.now().isoformat(),
+            exam_id
+        )
+        if WAIT_FOR_COMMIT:
+            await asyncio.shield(commit)
+
+        return {
+            "success": True,
+            "message": "Answer saved successfully"
+        }
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/answers/sync")
+@router.post("/exams/{exam_id}/answers/sync")
+async def sync_answers(batch: AnswerSync, exam_id: int = DEFAULT_EXAM_ID, student: Optional[dict] = Depends(current_student)):
+    """Apply a batch of journaled answer changes
+
+    Every change carries the student's own increasing sequence number.
+    Changes at or below the last sequence already applied are skipped, so a
+    batch whose response got lost can simply be sent again; the others are
+    written in one transaction. The returned last_seq tells the client which
+    journal entries it may drop. An empty batch only reports last_seq.
+    """
+    check_student(student, batch.student_id)
+    student_id = batch.student_id
+
+    def apply(conn, changes, max_seq, timestamp):
+        cursor = conn.cursor()
+        # Write first, so the sequence below is read under the write lock
+        cursor.execute('''
+            INSERT INTO answer_sync (exam_id, student_id) VALUES (?, ?)
+            ON CONFLICT (exam_id, student_id) DO NOTHING
+        ''', (exam_id, student_id))
+        cursor.execute('''
+            SELECT last_seq FROM answer_sync
+            WHERE exam_id = ? AND student_id = ?
+        ''', (exam_id, student_id))
+        last_seq = cursor.fetchone()['last_seq']
+
+        fresh = [change for change in changes if change[0] > last_seq]
+        # Changes are in sequence order, so a question's latest change wins
+        latest = {question_id: selected for _, question_id, selected in fresh}
+        if latest:
+            cursor.executemany('''
+                INSERT INTO answers (student_id, question_id, selected_answer, timestamp, exam_id)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (student_id, question_id) DO UPDATE SET
+                    selected_answer = excluded.selected_answer,
+                    timestamp = excluded.timestamp
+            ''', [(student_id, question_id, selected, timestamp, exam_id) for question_id, selected in latest.items()])
+            grading.update_scores(cursor, [(exam_id, student_id)])
+            progress.record_answers(cursor, [(exam_id, student_id)])
+        if max_seq > last_seq:
             cursor.execute('''
-                SELECT id FROM answers 
-                WHERE student_id = ? AND question_id = ?
-            ''', (answer.student_id, answer.question_id))
-            
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing answer
-                cursor.execute('''
-                    UPDATE answers 
-                    SET selected_answer = ?, timestamp = ?
-                    WHERE student_id = ? AND question_id = ?
-                ''', (answer.selected_answer, timestamp, answer.student_id, answer.question_id))
-            else:
-                # Insert new answer
-                cursor.execute('''
-                    INSERT INTO answers (student_id, question_id, selected_answer, timestamp)
-                    VALUES (?, ?, ?, ?)
-                ''', (answer.student_id, answer.question_id, answer.selected_answer, timestamp))
-            
-            conn.commit()
-            return {
-                "success": True,
-                "message": "Answer saved successfully"
-            }
+                UPDATE answer_sync SET last_seq = ?, synced_at = ?
+                WHERE exam_id = ? AND student_id = ?
+            ''', (max_seq, timestamp, exam_id, student_id))
+        conn.commit()
+        return max(last_seq, max_seq), len(fresh), len(changes) - len(fresh)
+
+    try:
+        status, paper = await _active_paper(exam_id)
+        changes = sorted(batch.changes, key=lambda change: change.seq)
+        # Changes for unknown questions are acknowledged (so the client drops them) but not stored
+        rejected = [change.seq for change in changes if change.question_id not in paper.questions]
+        valid = [
+            (change.seq, change.question_id, shuffle.to_stored(exam_id, student_id, change.question_id, change.selected_answer))
+            for change in changes if change.question_id in paper.questions
+        ]
+        if changes:
+            await exam_timer.admit(status, student_id)
+        if answer_queue.has_pending(student_id, [question_id for _, question_id, _ in valid]):
+            # An older click still queued from /answer must not land after this batch
+            await answer_queue.flush()
+
+        max_seq = changes[-1].seq if changes else 0
+        last_seq, applied, duplicates = await run_db(apply, valid, max_seq, datetime.now().isoformat())
+        metrics.add("answer_changes_synced", applied)
+        metrics.add("answer_changes_duplicate", duplicates)
+
+        return {
+            "success": True,
+            "last_seq": last_seq,
+            "applied": applied,
+            "duplicates": duplicates,
+            "rejected": rejected
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/submit")
-async def submit_exam(student_id: str):
+@router.post("/exams/{exam_id}/submit")
+async def submit_exam(student_id: str, exam_id: int = DEFAULT_EXAM_ID, student: Optional[dict] = Depends(current_student)):
     """Submit the entire exam"""
+    check_student(student, student_id)
+
+    def query(conn):
+        cursor = conn.cursor()
+
+        # Count student's answers
+        cursor.execute('''
+            SELECT COUNT(*) as count
+            FROM answers
+            WHERE exam_id = ? AND student_id = ?
+        ''', (exam_id, student_id))
+        return cursor.fetchone()['count']
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            # Get student's answers
-            cursor.execute('''
-                SELECT question_id, selected_answer
-                FROM answers
-                WHERE student_id = ?
-            ''', (student_id,))
-            
-            answers = cursor.fetchall()
-            
+        status = await exam_state.require(exam_id)
+        # Make sure every queued answer is on disk before counting
+        await answer_queue.flush()
+        total_answered = await run_db(query, readonly=True)
+        # Once stopped, the exam's attempts have already been closed
+        attempt = await exam_timer.submit(status, student_id) if status.is_active else None
+
+        return {
+            "success": True,
+            "message": "Exam submitted successfully",
+            "total_answered": total_answered,
+            "student_id": student_id,
+            "exam_id": exam_id,
+            "submitted_by": attempt.submitted_by if attempt is not None else None
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/heartbeat")
+@router.post("/exams/{exam_id}/heartbeat")
+async def heartbeat(student_id: str, exam_id: int = DEFAULT_EXAM_ID, student: Optional[dict] = Depends(current_student)):
+    """Keep the student shown as online on the admin dashboard (no database write)"""
+    check_student(student, student_id)
+    try:
+        await exam_state.require(exam_id)
+        progress_board.seen(exam_id, student_id)
+        return {
+            "success": True
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/my-time/{student_id}")
+@router.get("/exams/{exam_id}/my-time/{student_id}")
+async def get_my_time(student_id: str, exam_id: int = DEFAULT_EXAM_ID, student: Optional[dict] = Depends(current_student)):
+    """The student's own deadline as kept by the server (starts their clock)"""
+    check_student(student, student_id)
+    try:
+        status = await exam_state.require(exam_id)
+        if not status.is_active or not status.start_time:
             return {
                 "success": True,
-                "message": "Exam submitted successfully",
-                "total_answered": len(answers),
-                "student_id": student_id
+                "is_active": False,
+                "remaining_seconds": None
             }
+
+        attempt = await exam_timer.begin(status, student_id)
+        return {
+            "success": True,
+            "is_active": True,
+            **exam_timer.describe(status, attempt)
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/my-answers/{student_id}")
-async def get_my_answers(student_id: str):
+@router.get("/exams/{exam_id}/my-answers/{student_id}")
+async def get_my_answers(student_id: str, exam_id: int = DEFAULT_EXAM_ID, student: Optional[dict] = Depends(current_student)):
     """Get all answers for a specific student"""
+    check_student(student, student_id)
+
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT question_id, selected_answer
+            FROM answers
+            WHERE exam_id = ? AND student_id = ?
+        ''', (exam_id, student_id))
+        return cursor.fetchall()
+
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT question_id, selected_answer
-                FROM answers
-                WHERE student_id = ?
-            ''', (student_id,))
-            
-            answers = cursor.fetchall()
-            
-            # Convert to dictionary for easy lookup
-            answer_dict = {a['question_id']: a['selected_answer'] for a in answers}
-            
-            return {
-                "success": True,
-                "answers": answer_dict
-            }
+        answers = await run_db(query, readonly=True)
+
+        # Convert to dictionary for easy lookup, including not-yet-committed answers
+        answer_dict = {a['question_id']: a['selected_answer'] for a in answers}
+        answer_dict.update(answer_queue.pending_for(student_id, exam_id))
+        # Report the letters as this student sees them
+        answer_dict = {
+            question_id: shuffle.to_shown(exam_id, student_id, question_id, selected)
+            for question_id, selected in answer_dict.items()
+        }
+
+        return {
+            "success": True,
+            "answers": answer_dict
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
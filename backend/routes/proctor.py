@@ -1,72 +1,355 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from datetime import datetime
+from typing import Optional
 import base64
+import hashlib
 import os
+import re
 from models import ScreenshotUpload
-from database import get_db
+from database import run_db, run_io, DEFAULT_EXAM_ID
+from transcode import transcoder
+from dedup import deduplicator
+from auth import current_student, current_admin, check_student
+from metrics import metrics
+import progress
+from progress import progress_board
+from encoding import EncodedRoute
+# Frames are written to INCOMING_DIR, then handed to the configured store
+# (sharded content-addressed files or per-session segment packs)
+from screenshot_store import INCOMING_DIR, store, reader, incoming_key
 
-router = APIRouter(prefix="/proctor", tags=["proctor"])
+router = APIRouter(prefix="/proctor", tags=["proctor"], route_class=EncodedRoute)
 
-SCREENSHOTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "screenshots")
+MAX_SCREENSHOT_BYTES = int(os.environ.get("EXAM_MAX_SCREENSHOT_BYTES", str(5 * 1024 * 1024)))
+WRITE_BUFFER_BYTES = 256 * 1024
+IMAGE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp"
+}
 
-# Ensure screenshots directory exists
-os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+def _write_file(filepath, data):
+    with open(filepath, "wb") as f:
+        f.write(data)
+
+def _record_screenshot(conn, exam_id, student_id, filename, fmt, size_bytes, phash):
+    cursor = conn.cursor()
+    timestamp = datetime.now().isoformat()
+    cursor.execute('''
+        INSERT INTO screenshots (exam_id, student_id, filename, timestamp, format, size_bytes, phash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (exam_id, student_id, filename, timestamp, fmt, size_bytes, phash))
+    screenshot_id = cursor.lastrowid
+    progress.record_screenshot(cursor, exam_id, student_id, timestamp)
+    conn.commit()
+    return screenshot_id
+
+def _safe_name(value):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value)
+
+def _session(student_id):
+    """Frames of one student on one day share a storage segment"""
+    return f"{_safe_name(student_id)}_{datetime.now().strftime('%Y%m%d')}"
+
+async def _store_frame(exam_id, student_id, filepath, fmt, size):
+    """Keep an incoming frame unless it duplicates the previous one"""
+    metrics.add("screenshot_bytes_written", size)
+    phash, duplicate_of = await deduplicator.check(exam_id, student_id, filepath)
+    if duplicate_of is not None:
+        metrics.add("screenshots_skipped")
+        # Not stored, but the student is still there
+        progress_board.seen(exam_id, student_id)
+        await run_io(_remove_quietly, filepath)
+        return {
+            "success": True,
+            "message": "Screenshot unchanged, skipped",
+            "filename": None,
+            "duplicate_of": duplicate_of
+        }
+
+    # Either compress in the background (which then stores it) or store it now
+    session = _session(student_id)
+    transcode = transcoder.accepting
+    if transcode:
+        key = incoming_key(filepath)
+    else:
+        key = await run_io(store.put, filepath, session)
+
+    screenshot_id = await run_db(_record_screenshot, exam_id, student_id, key, fmt, size, phash)
+    deduplicator.remember(exam_id, student_id, screenshot_id, phash)
+    if transcode:
+        transcoder.schedule(screenshot_id, filepath, size, session)
+
+    return {
+        "success": True,
+        "message": "Screenshot saved successfully",
+        "filename": key
+    }
+
+async def _stream_to_file(chunks, filepath):
+    """Write an async stream of chunks to disk off the event loop, enforcing the size limit"""
+    partial = filepath + ".part"
+    f = await run_io(open, partial, "wb")
+    try:
+        size = 0
+        buffer = bytearray()
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > MAX_SCREENSHOT_BYTES:
+                raise HTTPException(status_code=413, detail="Screenshot too large")
+            buffer += chunk
+            if len(buffer) >= WRITE_BUFFER_BYTES:
+                await run_io(f.write, bytes(buffer))
+                buffer.clear()
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty screenshot")
+        if buffer:
+            await run_io(f.write, bytes(buffer))
+        await run_io(f.close)
+        await run_io(os.replace, partial, filepath)
+    except BaseException:
+        await run_io(f.close)
+        await run_io(_remove_quietly, partial)
+        raise
+    return size
+
+def _remove_quietly(filepath):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
 
 @router.post("/screenshot")
-async def upload_screenshot(screenshot: ScreenshotUpload):
-    """Save a proctoring screenshot"""
+async def upload_screenshot(
+    screenshot: ScreenshotUpload,
+    exam_id: int = DEFAULT_EXAM_ID,
+    student: Optional[dict] = Depends(current_student)
+):
+    """Save a proctoring screenshot sent as a base64 data URL (legacy JSON path)"""
+    check_student(student, screenshot.student_id)
     try:
         # Decode base64 image
         image_data = screenshot.image_data
-        
+
         # Remove data URL prefix if present
         if "," in image_data:
             image_data = image_data.split(",")[1]
-        
+
         # Generate filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"{screenshot.student_id}_{timestamp}.png"
-        filepath = os.path.join(SCREENSHOTS_DIR, filename)
-        
+        filename = f"{_safe_name(screenshot.student_id)}_{timestamp}.png"
+        filepath = os.path.join(INCOMING_DIR, filename)
+
         # Save image
-        with open(filepath, "wb") as f:
-            f.write(base64.b64decode(image_data))
-        
-        # Save to database
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO screenshots (student_id, filename, timestamp)
-                VALUES (?, ?, ?)
-            ''', (screenshot.student_id, filename, datetime.now().isoformat()))
-            conn.commit()
-        
+        data = base64.b64decode(image_data)
+        await run_io(_write_file, filepath, data)
+
+        return await _store_frame(exam_id, screenshot.student_id, filepath, "png", len(data))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/screenshot/{student_id}")
+async def upload_screenshot_binary(
+    student_id: str,
+    request: Request,
+    exam_id: int = DEFAULT_EXAM_ID,
+    student: Optional[dict] = Depends(current_student)
+):
+    """Save a proctoring screenshot sent as binary
+
+    Accepts a raw image/png, image/jpeg or image/webp body, streamed to
+    disk in chunks without base64 or JSON decoding. Multipart is refused:
+    parsing a form buffers the whole upload before the size limit applies.
+    """
+    check_student(student, student_id)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_SCREENSHOT_BYTES:
+        raise HTTPException(status_code=413, detail="Screenshot too large")
+
+    try:
+        extension = IMAGE_EXTENSIONS.get(content_type)
+        if extension is None:
+            raise HTTPException(
+                status_code=415,
+                detail="Send the frame as a raw image/png, image/jpeg or image/webp body"
+            )
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        filename = f"{_safe_name(student_id)}_{timestamp}.{extension}"
+        filepath = os.path.join(INCOMING_DIR, filename)
+        size = await _stream_to_file(request.stream(), filepath)
+
+        return await _store_frame(exam_id, student_id, filepath, extension, size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+SCREENSHOT_PAGE_SIZE = 100
+MAX_SCREENSHOT_PAGE_SIZE = 1000
+# Stored frames never change under their key, so browsers may keep them
+FRAME_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def _parse_cursor(cursor):
+    """A cursor is "<timestamp>,<id>" of the last row of the previous page"""
+    timestamp, _, screenshot_id = (cursor or "").rpartition(",")
+    if not timestamp or not screenshot_id.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return timestamp, int(screenshot_id)
+
+def _fetch_screenshot_page(conn, exam_id, student_id, start, end, after, limit):
+    conditions = ["student_id = ?"]
+    params = [student_id]
+    if exam_id is not None:
+        conditions.append("exam_id = ?")
+        params.append(exam_id)
+    if start:
+        conditions.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        conditions.append("timestamp < ?")
+        params.append(end)
+    if after:
+        conditions.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+        params.extend([after[0], after[0], after[1]])
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT id, exam_id, filename, timestamp, format, size_bytes, thumbnail, duplicates
+        FROM screenshots
+        WHERE {" AND ".join(conditions)}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', params + [limit])
+    return [dict(s) for s in cursor.fetchall()]
+
+@router.get("/screenshots/{student_id}", dependencies=[Depends(current_admin)])
+async def get_student_screenshots(
+    student_id: str,
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    limit: int = Query(SCREENSHOT_PAGE_SIZE, ge=1, le=MAX_SCREENSHOT_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    exam_id: Optional[int] = None
+):
+    """Get a page of a student's screenshots, newest first
+
+    `from` (inclusive) and `to` (exclusive) bound the ISO timestamps and
+    `exam_id` narrows it to one exam; pass `next_cursor` back as `cursor`
+    for the following page.
+    """
+    try:
+        after = _parse_cursor(cursor) if cursor else None
+        # Fetch one extra row to know whether another page follows
+        screenshots = await run_db(_fetch_screenshot_page, exam_id, student_id, from_, to, after, limit + 1, readonly=True)
+
+        next_cursor = None
+        if len(screenshots) > limit:
+            screenshots = screenshots[:limit]
+            last = screenshots[-1]
+            next_cursor = f"{last['timestamp']},{last['id']}"
+
+        for screenshot in screenshots:
+            screenshot["url"] = f"/proctor/frame/{screenshot['id']}"
+            screenshot["thumbnail_url"] = screenshot["url"] + "?thumbnail=true" if screenshot["thumbnail"] else None
+
         return {
             "success": True,
-            "message": "Screenshot saved successfully",
-            "filename": filename
+            "screenshots": screenshots,
+            "next_cursor": next_cursor
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/screenshots/{student_id}")
-async def get_student_screenshots(student_id: str):
-    """Get all screenshots for a student"""
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp"
+}
+
+def _frame_row(conn, screenshot_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT filename, thumbnail, format FROM screenshots WHERE id = ?", (screenshot_id,))
+    return cursor.fetchone()
+
+def _frame_etag(key):
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+def _parse_range(header, size):
+    """(start, end) for a single "bytes=" range, None to send everything
+
+    Raises 416 for ranges that do not overlap the frame.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # Multipart ranges are not worth it for frames this small
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        else:
+            start = max(size - int(last), 0)
+            end = size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+@router.get("/frame/{screenshot_id}", dependencies=[Depends(current_admin)])
+async def get_frame(screenshot_id: int, request: Request, thumbnail: bool = False):
+    """Serve a stored frame (or its thumbnail) from whichever store holds it
+
+    Supports If-None-Match and single byte ranges. Frames still waiting in
+    the incoming directory are served uncached, since the row is repointed
+    once they are transcoded.
+    """
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT filename, timestamp
-                FROM screenshots
-                WHERE student_id = ?
-                ORDER BY timestamp DESC
-            ''', (student_id,))
-            
-            screenshots = cursor.fetchall()
-            
-            return {
-                "success": True,
-                "screenshots": [dict(s) for s in screenshots]
-            }
+        row = await run_db(_frame_row, screenshot_id, readonly=True)
+        key = row and (row['thumbnail'] if thumbnail else row['filename'])
+        if not key:
+            raise HTTPException(status_code=404, detail="Screenshot not found")
+
+        etag = _frame_etag(key)
+        headers = {
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "no-cache" if key.startswith("incoming/") else FRAME_CACHE_CONTROL
+        }
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        extension = key.rsplit(".", 1)[-1].lower()
+        media_type = CONTENT_TYPES.get(extension, "application/octet-stream")
+        size = await run_io(reader.size, key)
+
+        byte_range = None
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (not if_range or if_range == etag):
+            byte_range = _parse_range(range_header, size)
+
+        if byte_range is None:
+            data = await run_io(reader.read, key)
+            return Response(content=data, media_type=media_type, headers=headers)
+
+        start, end = byte_range
+        data = await run_io(reader.read, key, start, end)
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        return Response(content=data, status_code=206, media_type=media_type, headers=headers)
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Screenshot file missing")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
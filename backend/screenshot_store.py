@@ -0,0 +1,169 @@
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within one process
+    fcntl = None
+
+SCREENSHOTS_DIR = os.environ.get("EXAM_SCREENSHOTS_DIR", os.path.join(os.path.dirname(__file__), "screenshots"))
+# Uploads wait here until they are deduplicated/transcoded and handed to the store
+INCOMING_DIR = os.path.join(SCREENSHOTS_DIR, "incoming")
+# "files": sharded content-addressed files; "segments": per-session append-only packs
+STORE_BACKEND = os.environ.get("EXAM_SCREENSHOT_STORE", "files").lower()
+MMAP_CACHE_SIZE = 64
+
+SEGMENT_KEY = re.compile(r"^(?P<path>.+\.seg)@(?P<offset>\d+)\+(?P<length>\d+)(?:\.\w+)?$")
+
+os.makedirs(INCOMING_DIR, exist_ok=True)
+
+def _sha256_file(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _extension(filepath):
+    return os.path.splitext(filepath)[1].lstrip(".").lower()
+
+class ShardedFileStore:
+    """Content-addressed files under two levels of hash-prefix directories
+
+    Keys look like "3f/a2/3fa2....webp", so no directory grows beyond a few
+    thousand entries and identical frames are stored once. Keys are paths
+    relative to SCREENSHOTS_DIR; frames are served only through the
+    admin-only /proctor/frame/{id}, which reads them with ScreenshotReader.
+    """
+
+    name = "files"
+
+    def __init__(self, root=SCREENSHOTS_DIR):
+        self.root = root
+
+    def put(self, filepath, session=None):
+        """Move a finished file into the store and return its key"""
+        digest = _sha256_file(filepath)
+        key = f"{digest[:2]}/{digest[2:4]}/{digest}.{_extension(filepath)}"
+        target = os.path.join(self.root, key)
+        if os.path.exists(target):
+            os.remove(filepath)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(filepath, target)
+        return key
+
+class SegmentStore:
+    """Frames of one session appended to a single segment file
+
+    A key records the segment and the frame's byte range
+    ("segments/<session>.seg@<offset>+<length>.<ext>"), so the database row
+    is the offset index and reads are a slice of a memory-mapped segment.
+    """
+
+    name = "segments"
+
+    def __init__(self, root=SCREENSHOTS_DIR):
+        self.root = root
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, path):
+        with self._locks_guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def put(self, filepath, session=None):
+        """Append a finished file to its session segment and return its key"""
+        relative = f"segments/{session or 'default'}.seg"
+        path = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(filepath, "rb") as f:
+            data = f.read()
+
+        with self._lock(path):
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                offset = os.fstat(fd).st_size
+                written = 0
+                while written < len(data):
+                    written += os.write(fd, data[written:])
+            finally:
+                os.close(fd)
+
+        os.remove(filepath)
+        return f"{relative}@{offset}+{len(data)}.{_extension(filepath)}"
+
+class ScreenshotReader:
+    """Resolves any stored key: legacy flat names, shard paths or segment ranges"""
+
+    def __init__(self, root=SCREENSHOTS_DIR):
+        self.root = root
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, relative):
+        path = os.path.realpath(os.path.join(self.root, relative))
+        if not path.startswith(os.path.realpath(self.root) + os.sep):
+            raise FileNotFoundError(relative)
+        return path
+
+    def _segment_map(self, path, needed):
+        with self._lock:
+            cached = self._maps.get(path)
+            if cached is not None and len(cached) >= needed:
+                self._maps.move_to_end(path)
+                return cached
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Replaced or evicted maps are not closed here: another thread may
+            # still be slicing one in read(). Each is unmapped once the last
+            # reference to it goes away.
+            self._maps[path] = mapped
+            while len(self._maps) > MMAP_CACHE_SIZE:
+                self._maps.popitem(last=False)
+            return mapped
+
+    def size(self, key):
+        match = SEGMENT_KEY.match(key)
+        if match:
+            return int(match.group("length"))
+        return os.path.getsize(self._path(key))
+
+    def read(self, key, start=0, end=None):
+        """Bytes [start, end) of a stored frame"""
+        match = SEGMENT_KEY.match(key)
+        if match:
+            offset = int(match.group("offset"))
+            length = int(match.group("length"))
+            end = length if end is None else min(end, length)
+            mapped = self._segment_map(self._path(match.group("path")), offset + length)
+            return mapped[offset + start:offset + end]
+
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(max(0, end - start))
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+def incoming_key(filepath):
+    """Key of a frame that has not been handed to the store yet"""
+    return os.path.relpath(filepath, SCREENSHOTS_DIR).replace(os.sep, "/")
+
+def create_store(backend=STORE_BACKEND):
+    if backend == "segments":
+        return SegmentStore()
+    return ShardedFileStore()
+
+store = create_store()
+reader = ScreenshotReader()
@@ -0,0 +1,50 @@
+import hashlib
+import os
+import random
+
+# Per-student ordering of questions and of the A-E options within each question
+SHUFFLE_QUESTIONS = os.environ.get("EXAM_SHUFFLE_QUESTIONS", "1") != "0"
+SHUFFLE_OPTIONS = os.environ.get("EXAM_SHUFFLE_OPTIONS", "1") != "0"
+
+LETTERS = "ABCDE"
+
+def _rng(*parts):
+    seed = hashlib.sha256(":".join(str(part) for part in parts).encode()).digest()
+    return random.Random(seed)
+
+def seed_tag(exam_id, student_id):
+    """Short stable tag of a student's ordering (part of their ETag)"""
+    mode = f"{SHUFFLE_QUESTIONS:d}{SHUFFLE_OPTIONS:d}"
+    return hashlib.sha256(f"{exam_id}:{student_id}:{mode}".encode()).hexdigest()[:12]
+
+def question_order(exam_id, student_id, question_ids):
+    """The student's question order; nothing is stored, it is re-derived from the seed"""
+    order = list(question_ids)
+    if SHUFFLE_QUESTIONS:
+        _rng(exam_id, student_id).shuffle(order)
+    return order
+
+def option_order(exam_id, student_id, question_id):
+    """Stored option letters in display order: shown "A" is stored letter order[0]
+
+    Derived per question, so mapping one answer back costs one hash.
+    """
+    if not SHUFFLE_OPTIONS:
+        return LETTERS
+    order = list(LETTERS)
+    _rng(exam_id, student_id, question_id).shuffle(order)
+    return "".join(order)
+
+def to_stored(exam_id, student_id, question_id, shown):
+    """Map the letter a student clicked to the letter stored and graded"""
+    letter = shown.strip().upper()
+    if len(letter) != 1 or letter not in LETTERS:
+        return shown
+    return option_order(exam_id, student_id, question_id)[LETTERS.index(letter)]
+
+def to_shown(exam_id, student_id, question_id, stored):
+    """Map a stored answer letter back to what this student sees"""
+    letter = stored.strip().upper()
+    if len(letter) != 1 or letter not in LETTERS:
+        return stored
+    return LETTERS[option_order(exam_id, student_id, question_id).index(letter)]
@@ -0,0 +1,144 @@
+import codecs
+import csv
+import json
+import os
+from datetime import datetime
+
+# Rows per insert transaction
+IMPORT_CHUNK_ROWS = int(os.environ.get("EXAM_IMPORT_CHUNK_ROWS", "500"))
+# Per-row problems listed in the summary (the counts are always complete)
+MAX_REPORTED_ERRORS = 200
+FIELDS = ("student_id", "name", "password")
+
+class ImportFormatError(Exception):
+    """The upload as a whole cannot be imported (bad header, unknown format)"""
+
+async def iter_lines(chunks):
+    """Split a stream of byte chunks into decoded lines, keeping line endings"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        # The last piece may be an incomplete line
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+async def iter_csv_records(lines):
+    """Yield (line_number, fields) for each CSV record
+
+    A quoted field may span several lines, so lines are joined until the
+    quotes balance before being handed to the csv module.
+    """
+    record = ""
+    start = 0
+    number = 0
+    async for line in lines:
+        number += 1
+        if not record:
+            start = number
+        record += line
+        if record.count('"') % 2:
+            continue
+        if record.strip():
+            yield start, next(csv.reader([record]))
+        record = ""
+    if record.strip():
+        yield start, next(csv.reader([record]))
+
+async def parse_csv(lines):
+    """Yield (line_number, row dict or error string) from a CSV upload with a header"""
+    header = None
+    async for number, fields in iter_csv_records(lines):
+        if header is None:
+            header = [field.strip().lower() for field in fields]
+            missing = [field for field in FIELDS if field not in header]
+            if missing:
+                raise ImportFormatError(f"CSV header is missing: {', '.join(missing)}")
+            continue
+        if len(fields) != len(header):
+            yield number, f"Expected {len(header)} columns, got {len(fields)}"
+            continue
+        yield number, dict(zip(header, fields))
+
+async def parse_jsonl(lines):
+    """Yield (line_number, row dict or error string) from a JSON-lines upload"""
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield number, "Expected a JSON object"
+            continue
+        yield number, row
+
+def validate(row):
+    """Return (student_id, name, password) or raise ValueError"""
+    values = []
+    for field in FIELDS:
+        value = row.get(field)
+        value = "" if value is None else str(value).strip()
+        if not value:
+            raise ValueError(f"Missing {field}")
+        values.append(value)
+    return tuple(values)
+
+def insert_students(conn, rows, update_existing):
+    """Insert one chunk of validated rows in a single transaction
+
+    Returns (inserted_ids, existing_ids); existing students are updated
+    when `update_existing` is set and reported as conflicts otherwise.
+    """
+    cursor = conn.cursor()
+    ids = [row[0] for row in rows]
+    placeholders = ", ".join("?" * len(ids))
+    cursor.execute(f"SELECT student_id FROM students WHERE student_id IN ({placeholders})", ids)
+    existing = {row['student_id'] for row in cursor.fetchall()}
+
+    connected_at = datetime.now().isoformat()
+    cursor.executemany('''
+        INSERT INTO students (student_id, name, password, connected_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (student_id) DO NOTHING
+    ''', [row + (connected_at,) for row in rows if row[0] not in existing])
+    if update_existing and existing:
+        cursor.executemany(
+            "UPDATE students SET name = ?, password = ? WHERE student_id = ?",
+            [(name, password, student_id) for student_id, name, password in rows if student_id in existing]
+        )
+    conn.commit()
+    return [i for i in ids if i not in existing], [i for i in ids if i in existing]
+
+class ImportSummary:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.conflicts = 0
+        self.invalid = 0
+        self.errors = []
+
+    def error(self, line, student_id, message):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "student_id": student_id, "error": message})
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "conflicts": self.conflicts,
+            "invalid": self.invalid,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "errors_truncated": self.invalid + self.conflicts > len(self.errors)
+        }
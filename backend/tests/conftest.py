@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import uuid
+
+# The app reads its paths and settings at import time: point it at scratch
+# data before anything imports it, so exam.db is never touched
+_scratch = tempfile.mkdtemp(prefix="exam-tests-")
+os.environ["EXAM_DB_PATH"] = os.path.join(_scratch, "exam.db")
+os.environ["EXAM_SCREENSHOTS_DIR"] = os.path.join(_scratch, "screenshots")
+# Cheap password hashing; logins are not what these tests measure
+os.environ.setdefault("EXAM_KDF_N", "1024")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+LETTERS = "ABCDE"
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture(scope="session")
+def admin(client):
+    """Authorization header of a logged-in admin"""
+    response = client.post("/admin/login", json={"password": "admin123"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+@pytest.fixture
+def make_exam(client, admin):
+    """Create a running exam; every option text names its question and letter"""
+    def make(questions=3, duration_minutes=30, correct="A"):
+        exam_id = client.post("/admin/exams", json={"title": f"Test {uuid.uuid4().hex[:6]}"}, headers=admin).json()["exam_id"]
+        paper = [{
+            "question": f"Question {i}",
+            "options": {letter: f"q{i}-{letter}" for letter in LETTERS},
+            "correct": correct
+        } for i in range(questions)]
+        response = client.post(f"/admin/exams/{exam_id}/upload-questions", json={"questions": paper}, headers=admin)
+        assert response.status_code == 200, response.text
+        response = client.post(f"/admin/exams/{exam_id}/start-exam?duration_minutes={duration_minutes}", headers=admin)
+        assert response.status_code == 200, response.text
+        return exam_id
+    return make
+
+@pytest.fixture
+def make_student(client, admin):
+    """Add a student and log them in; returns (student_id, authorization header)"""
+    def make():
+        student_id = f"t-{uuid.uuid4().hex[:10]}"
+        response = client.post("/admin/add-student", json={"student_id": student_id, "name": "Test", "password": "pw"}, headers=admin)
+        assert response.status_code == 200, response.text
+        response = client.post("/exam/student-login", json={"student_id": student_id, "password": "pw"})
+        assert response.status_code == 200, response.text
+        return student_id, {"Authorization": f"Bearer {response.json()['token']}"}
+    return make
@@ -0,0 +1,109 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import answer_queue as queue_module
+from answer_queue import AnswerQueue
+from database import get_db
+
+@pytest.fixture(autouse=True)
+def database(client):
+    """The app fixture creates the schema"""
+
+def stored(student_id):
+    with get_db(readonly=True) as conn:
+        rows = conn.execute("SELECT question_id, selected_answer FROM answers WHERE student_id = ?", (student_id,)).fetchall()
+    return {row["question_id"]: row["selected_answer"] for row in rows}
+
+def refusing(student_id):
+    """_write_batch that violates a constraint whenever a row of student_id is in the batch"""
+    write = queue_module._write_batch
+    def write_batch(conn, rows):
+        if any(row[0] == student_id for row in rows):
+            raise sqlite3.IntegrityError("refused")
+        write(conn, rows)
+    return write_batch
+
+def failing(times):
+    """_write_batch that fails (not a constraint) the first `times` calls"""
+    write = queue_module._write_batch
+    calls = []
+    def write_batch(conn, rows):
+        calls.append(len(rows))
+        if len(calls) <= times:
+            raise sqlite3.OperationalError("database is locked")
+        write(conn, rows)
+    return write_batch
+
+def test_coalesced_answers_share_one_commit():
+    async def run():
+        queue = AnswerQueue()
+        first = queue.enqueue("q-coalesce", 1, "A", "t1")
+        second = queue.enqueue("q-coalesce", 1, "B", "t2")
+        assert first is second
+        await queue.flush()
+        return await first, queue.stats()
+
+    committed, stats = asyncio.run(run())
+    assert committed == 1
+    assert stats["coalesced"] == 1
+    assert stored("q-coalesce") == {1: "B"}
+
+def test_constraint_violation_fails_only_the_bad_rows(monkeypatch):
+    monkeypatch.setattr(queue_module, "_write_batch", refusing("q-bad"))
+
+    async def run():
+        queue = AnswerQueue()
+        good = queue.enqueue("q-good", 1, "A", "t")
+        bad = queue.enqueue("q-bad", 1, "A", "t")
+        await queue.flush()
+        return good, bad, queue.stats()
+
+    good, bad, stats = asyncio.run(run())
+    assert good.result() == 1
+    assert isinstance(bad.exception(), sqlite3.IntegrityError)
+    assert stats["refused"] == 1
+    assert stats["pending"] == 0
+    assert stored("q-good") == {1: "A"}
+    assert stored("q-bad") == {}
+
+def test_failed_batch_is_retried(monkeypatch):
+    monkeypatch.setattr(queue_module, "_write_batch", failing(1))
+
+    async def run():
+        queue = AnswerQueue(max_attempts=3)
+        first = queue.enqueue("q-retry", 1, "C", "t")
+        with pytest.raises(sqlite3.OperationalError):
+            await queue.flush()
+        assert queue.stats()["pending"] == 1
+        # A later click on the same question waits for the retry
+        retried = queue.enqueue("q-retry", 1, "D", "t")
+        await queue.flush()
+        return first, retried, queue.stats()
+
+    first, retried, stats = asyncio.run(run())
+    assert isinstance(first.exception(), sqlite3.OperationalError)
+    assert retried.result() == 1
+    assert stats["failed_batches"] == 1
+    assert stats["dropped"] == 0
+    assert stored("q-retry") == {1: "D"}
+
+def test_failing_batch_is_dropped_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(queue_module, "_write_batch", failing(100))
+
+    async def run():
+        queue = AnswerQueue(max_attempts=2)
+        queue.enqueue("q-dropped", 1, "A", "t")
+        for _ in range(2):
+            with pytest.raises(sqlite3.OperationalError):
+                await queue.flush()
+        # Nothing left to retry: the next flush is a no-op
+        await queue.flush()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["pending"] == 0
+    assert stats["dropped"] == 1
+    assert stats["failed_batches"] == 2
+    assert stored("q-dropped") == {}
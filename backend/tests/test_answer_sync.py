@@ -0,0 +1,78 @@
+import pytest
+
+@pytest.fixture
+def sitting(client, make_exam, make_student):
+    """A running exam and a student who opened it: (exam_id, student_id, headers, question_ids)"""
+    exam_id = make_exam(questions=4)
+    student_id, headers = make_student()
+    response = client.get(f"/exam/exams/{exam_id}/questions", headers=headers)
+    return exam_id, student_id, headers, [q["id"] for q in response.json()["questions"]]
+
+def sync(client, exam_id, student_id, headers, changes):
+    return client.post(f"/exam/exams/{exam_id}/answers/sync", headers=headers, json={
+        "student_id": student_id,
+        "changes": [
+            {"seq": seq, "question_id": question_id, "selected_answer": letter}
+            for seq, question_id, letter in changes
+        ]
+    })
+
+def my_answers(client, exam_id, student_id, headers):
+    answers = client.get(f"/exam/exams/{exam_id}/my-answers/{student_id}", headers=headers).json()["answers"]
+    return {int(question_id): letter for question_id, letter in answers.items()}
+
+def test_resent_batch_is_applied_once(client, sitting):
+    exam_id, student_id, headers, (q1, q2, *_) = sitting
+    changes = [(1, q1, "A"), (2, q2, "B")]
+
+    first = sync(client, exam_id, student_id, headers, changes).json()
+    assert (first["last_seq"], first["applied"], first["duplicates"]) == (2, 2, 0)
+
+    # The response got lost and the client sends the same batch again
+    again = sync(client, exam_id, student_id, headers, changes).json()
+    assert (again["last_seq"], again["applied"], again["duplicates"]) == (2, 0, 2)
+    assert my_answers(client, exam_id, student_id, headers) == {q1: "A", q2: "B"}
+
+def test_latest_change_per_question_wins(client, sitting):
+    exam_id, student_id, headers, (q1, *_) = sitting
+    # Sent out of order: sequence decides, not position
+    response = sync(client, exam_id, student_id, headers, [(3, q1, "C"), (1, q1, "A"), (2, q1, "B")]).json()
+    assert response["last_seq"] == 3
+    assert my_answers(client, exam_id, student_id, headers) == {q1: "C"}
+
+def test_stale_change_does_not_overwrite(client, sitting):
+    exam_id, student_id, headers, (q1, *_) = sitting
+    sync(client, exam_id, student_id, headers, [(5, q1, "E")])
+
+    # Another tab numbered its changes from 1: skipped, and reported as duplicates
+    stale = sync(client, exam_id, student_id, headers, [(1, q1, "A")]).json()
+    assert (stale["last_seq"], stale["applied"], stale["duplicates"]) == (5, 0, 1)
+    assert my_answers(client, exam_id, student_id, headers) == {q1: "E"}
+
+    # Rebased above last_seq, as the web client does, the change goes through
+    rebased = sync(client, exam_id, student_id, headers, [(6, q1, "A")]).json()
+    assert (rebased["last_seq"], rebased["applied"], rebased["duplicates"]) == (6, 1, 0)
+    assert my_answers(client, exam_id, student_id, headers) == {q1: "A"}
+
+def test_empty_batch_reports_last_seq(client, sitting):
+    exam_id, student_id, headers, (q1, *_) = sitting
+    assert sync(client, exam_id, student_id, headers, []).json()["last_seq"] == 0
+    sync(client, exam_id, student_id, headers, [(4, q1, "D")])
+    assert sync(client, exam_id, student_id, headers, []).json()["last_seq"] == 4
+
+def test_unknown_question_is_acknowledged_not_stored(client, sitting):
+    exam_id, student_id, headers, (q1, *_) = sitting
+    response = sync(client, exam_id, student_id, headers, [(1, q1, "A"), (2, 10 ** 9, "B")]).json()
+    assert response["rejected"] == [2]
+    assert response["last_seq"] == 2
+    assert my_answers(client, exam_id, student_id, headers) == {q1: "A"}
+
+def test_sync_is_refused_for_another_student_and_after_submitting(client, make_student, sitting):
+    exam_id, student_id, headers, (q1, *_) = sitting
+    other_id, _ = make_student()
+    assert sync(client, exam_id, other_id, headers, [(1, q1, "A")]).status_code == 403
+
+    client.post(f"/exam/exams/{exam_id}/submit?student_id={student_id}", headers=headers)
+    response = sync(client, exam_id, student_id, headers, [(1, q1, "A")])
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Exam already submitted"
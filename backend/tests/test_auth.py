@@ -0,0 +1,83 @@
+import auth
+
+def answer(student_id, question_id=None):
+    return {"student_id": student_id, "question_id": question_id or 1, "selected_answer": "A"}
+
+def first_question(client, exam_id, headers):
+    response = client.get(f"/exam/exams/{exam_id}/questions", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["questions"][0]["id"]
+
+def test_student_endpoints_need_a_token(client, make_exam, make_student):
+    exam_id = make_exam()
+    student_id, _ = make_student()
+    assert client.get(f"/exam/exams/{exam_id}/questions?student_id={student_id}").status_code == 401
+    assert client.post(f"/exam/exams/{exam_id}/answer", json=answer(student_id)).status_code == 401
+
+def test_tampered_token_is_rejected(client, make_exam, make_student):
+    exam_id = make_exam()
+    _, headers = make_student()
+    version, payload, signature = headers["Authorization"][len("Bearer "):].split(".")
+    forged = {"Authorization": f"Bearer {version}.{payload}.{signature[::-1]}"}
+    response = client.get(f"/exam/exams/{exam_id}/questions", headers=forged)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Bad token signature"
+
+def test_non_ascii_signature_is_rejected(client, make_exam, make_student):
+    exam_id = make_exam()
+    _, headers = make_student()
+    version, payload, _ = headers["Authorization"][len("Bearer "):].split(".")
+    response = client.get(f"/exam/exams/{exam_id}/questions", params={"token": f"{version}.{payload}.sïgnature"})
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Bad token signature"
+
+def test_token_of_another_student_is_refused(client, make_exam, make_student):
+    exam_id = make_exam()
+    student_id, headers = make_student()
+    other_id, _ = make_student()
+    question_id = first_question(client, exam_id, headers)
+
+    response = client.post(f"/exam/exams/{exam_id}/answer", json=answer(other_id, question_id), headers=headers)
+    assert response.status_code == 403
+    assert client.get(f"/exam/exams/{exam_id}/questions?student_id={other_id}", headers=headers).status_code == 403
+    assert client.get(f"/exam/exams/{exam_id}/my-answers/{other_id}", headers=headers).status_code == 403
+    assert client.post(f"/exam/exams/{exam_id}/answer", json=answer(student_id, question_id), headers=headers).status_code == 200
+
+def test_admin_token_is_not_a_student_token(client, admin, make_exam):
+    exam_id = make_exam()
+    assert client.get(f"/exam/exams/{exam_id}/questions?student_id=anyone", headers=admin).status_code == 403
+
+def test_logout_revokes_the_token(client, make_exam, make_student):
+    exam_id = make_exam()
+    _, headers = make_student()
+    assert client.post("/exam/logout", headers=headers).status_code == 200
+    response = client.get(f"/exam/exams/{exam_id}/questions", headers=headers)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token revoked"
+
+def test_token_wins_when_auth_is_optional(client, monkeypatch, make_exam, make_student):
+    monkeypatch.setattr(auth, "AUTH_REQUIRED", False)
+    exam_id = make_exam()
+    student_id, headers = make_student()
+    other_id, _ = make_student()
+    question_id = first_question(client, exam_id, headers)
+
+    # A present token still decides who the student is
+    assert client.post(f"/exam/exams/{exam_id}/answer", json=answer(other_id, question_id), headers=headers).status_code == 403
+    # Without one the paper needs a student to order it for
+    assert client.get(f"/exam/exams/{exam_id}/questions").status_code == 400
+    assert client.get(f"/exam/exams/{exam_id}/questions?student_id={student_id}").status_code == 200
+
+def test_stored_frames_are_not_served_statically(client):
+    assert client.get("/screenshots/incoming/anything.png").status_code == 404
+
+def test_token_from_password_change_is_accepted(client, admin):
+    # Revocation and the new token fall in the same millisecond more often than not
+    for old, new in [("admin123", "changed-pw"), ("changed-pw", "admin123")] * 5:
+        response = client.post("/admin/change-password", params={"old_password": old, "new_password": new}, headers=admin)
+        assert response.status_code == 200, response.text
+        previous = dict(admin)
+        # Every earlier admin session is signed out; carry on with the new token
+        admin["Authorization"] = f"Bearer {response.json()['token']}"
+        assert client.get("/admin/exams", headers=admin).status_code == 200
+        assert client.get("/admin/exams", headers=previous).status_code == 401
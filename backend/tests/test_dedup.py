@@ -0,0 +1,36 @@
+import io
+
+import pytest
+
+from dedup import deduplicator
+
+Image = pytest.importorskip("PIL.Image")
+
+def frame():
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize((64, 48)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def upload(client, exam_id, student_id, headers, data):
+    response = client.post(
+        f"/proctor/screenshot/{student_id}?exam_id={exam_id}",
+        content=data,
+        headers={**headers, "Content-Type": "image/png"}
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_same_frame_in_another_exam_is_kept(client, make_exam, make_student):
+    if not deduplicator.enabled:
+        pytest.skip("frame deduplication is disabled")
+    first_exam, second_exam = make_exam(), make_exam()
+    student_id, headers = make_student()
+    data = frame()
+
+    kept = upload(client, first_exam, student_id, headers, data)
+    assert kept["filename"] is not None
+    assert upload(client, first_exam, student_id, headers, data)["filename"] is None
+
+    # A new exam starts with no previous frame to compare against
+    assert upload(client, second_exam, student_id, headers, data)["filename"] is not None
+    assert upload(client, second_exam, student_id, headers, data)["filename"] is None
@@ -0,0 +1,35 @@
+from events import EventHub, SUBSCRIBER_QUEUE_SIZE
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+def test_busy_exam_does_not_evict_another_exams_events():
+    hub = EventHub()
+    following = hub.subscribe(exam_id=1, events={"status"})
+    hub.publish("status", {"version": 1}, exam_id=1)
+    for version in range(SUBSCRIBER_QUEUE_SIZE * 2):
+        hub.publish("status", {"version": version}, exam_id=2)
+    hub.publish("students", {"changed": "s1"})
+
+    assert drain(following) == [("status", 1, {"version": 1})]
+    assert hub.stats()["dropped"] == 0
+
+def test_unfiltered_subscriber_gets_every_exam():
+    hub = EventHub()
+    everything = hub.subscribe()
+    hub.publish("status", {"version": 1}, exam_id=1)
+    hub.publish("status", {"version": 1}, exam_id=2)
+    hub.publish("students", {"changed": "s1"})
+    assert [exam_id for _, exam_id, _ in drain(everything)] == [1, 2, None]
+
+def test_late_joiner_gets_only_what_it_follows():
+    # Exams this process has never loaded, so the stored payloads are replayed as they are
+    first, second = 10 ** 6, 10 ** 6 + 1
+    hub = EventHub()
+    hub.publish("status", {"version": 3}, exam_id=first)
+    hub.publish("status", {"version": 4}, exam_id=second)
+    hub.publish("students", {"changed": "s1"})
+    assert drain(hub.subscribe(exam_id=second, events={"status"})) == [("status", second, {"version": 4})]
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import exam_timer as timer
+from database import get_db
+from exam_state import exam_state
+from exam_timer import exam_timer
+
+@pytest.fixture(autouse=True)
+def no_grace(monkeypatch):
+    monkeypatch.setattr(timer, "GRACE_SECONDS", 0)
+
+def shift(exam_id, seconds):
+    """Move a running exam's start back, as if that much time had passed"""
+    with get_db() as conn:
+        start = conn.execute("SELECT start_time FROM exams WHERE id = ?", (exam_id,)).fetchone()["start_time"]
+        moved = (datetime.fromisoformat(start) - timedelta(seconds=seconds)).isoformat()
+        conn.execute("UPDATE exams SET start_time = ? WHERE id = ?", (moved, exam_id))
+        conn.execute("UPDATE attempts SET started_at = ? WHERE exam_id = ?", (moved, exam_id))
+        exam_state.bump(conn, exam_id)
+        conn.commit()
+    exam_state.invalidate(exam_id)
+
+def attempts(client, admin, exam_id):
+    response = client.get(f"/admin/exams/{exam_id}/attempts", headers=admin)
+    return {attempt["student_id"]: attempt for attempt in response.json()["attempts"]}
+
+def answer(client, exam_id, student_id, headers, question_id):
+    return client.post(f"/exam/exams/{exam_id}/answer", headers=headers, json={
+        "student_id": student_id,
+        "question_id": question_id,
+        "selected_answer": "A"
+    })
+
+def open_paper(client, exam_id, headers):
+    return [q["id"] for q in client.get(f"/exam/exams/{exam_id}/questions", headers=headers).json()["questions"]]
+
+def test_paper_starts_the_clock_and_answers_do_not(client, admin, make_exam, make_student):
+    exam_id = make_exam()
+    reader, reader_headers = make_student()
+    clicker, clicker_headers = make_student()
+    question_ids = open_paper(client, exam_id, reader_headers)
+
+    assert answer(client, exam_id, clicker, clicker_headers, question_ids[0]).status_code == 200
+    started = attempts(client, admin, exam_id)
+    assert started[reader]["started_at"] is not None
+    assert clicker not in started
+
+def test_answers_after_the_deadline_are_refused(client, make_exam, make_student):
+    exam_id = make_exam(duration_minutes=1)
+    student_id, headers = make_student()
+    question_ids = open_paper(client, exam_id, headers)
+    assert answer(client, exam_id, student_id, headers, question_ids[0]).status_code == 200
+
+    shift(exam_id, 61)
+    response = answer(client, exam_id, student_id, headers, question_ids[1])
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Time is up"
+
+def test_expired_attempts_are_finalized_and_the_exam_stopped(client, admin, make_exam, make_student):
+    exam_id = make_exam(duration_minutes=1)
+    late, late_headers = make_student()
+    extended, extended_headers = make_student()
+    open_paper(client, exam_id, late_headers)
+    open_paper(client, exam_id, extended_headers)
+    client.post(f"/admin/exams/{exam_id}/extend-time?minutes=5&student_id={extended}", headers=admin)
+
+    shift(exam_id, 61)
+    client.portal.call(exam_timer.tick)
+    closed = attempts(client, admin, exam_id)
+    assert closed[late]["submitted_by"] == "timer"
+    assert closed[extended]["submitted_by"] is None
+
+    # Past the longest extension the exam stops and every attempt is closed
+    shift(exam_id, 5 * 60)
+    client.portal.call(exam_timer.tick)
+    assert client.get(f"/exam/exams/{exam_id}/status").json()["is_active"] is False
+    assert attempts(client, admin, exam_id)[extended]["submitted_by"] == "timer"
+
+def test_submission_made_elsewhere_is_seen(client, monkeypatch, make_exam, make_student):
+    exam_id = make_exam()
+    student_id, headers = make_student()
+    question_ids = open_paper(client, exam_id, headers)
+    assert answer(client, exam_id, student_id, headers, question_ids[0]).status_code == 200
+
+    # As another worker would: straight to the database, not through this worker's copy
+    with get_db() as conn:
+        timer._submit(conn, exam_id, student_id)
+    monkeypatch.setattr(timer, "REVALIDATE_SECONDS", 0)
+
+    response = answer(client, exam_id, student_id, headers, question_ids[1])
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Exam already submitted"
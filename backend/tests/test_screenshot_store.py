@@ -0,0 +1,20 @@
+from screenshot_store import ScreenshotReader, SegmentStore
+
+def put(store, tmp_path, name, data):
+    incoming = tmp_path / name
+    incoming.write_bytes(data)
+    return store.put(str(incoming), session="s")
+
+def test_remapped_segment_leaves_earlier_map_readable(tmp_path):
+    root = tmp_path / "store"
+    store, reader = SegmentStore(str(root)), ScreenshotReader(str(root))
+    first = put(store, tmp_path, "a.png", b"first frame")
+    assert reader.read(first) == b"first frame"
+    # A read in progress on another thread still holds the current map
+    in_use = reader._segment_map(str(root / "segments" / "s.seg"), 1)
+
+    # The segment grows, so the next read remaps it
+    second = put(store, tmp_path, "b.png", b"second frame")
+    assert reader.read(second) == b"second frame"
+    assert in_use[:5] == b"first"
+    reader.close()
@@ -0,0 +1,65 @@
+import shuffle
+
+def paper(client, exam_id, headers):
+    response = client.get(f"/exam/exams/{exam_id}/questions", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["questions"]
+
+def result(client, admin, exam_id, student_id):
+    response = client.get(f"/admin/exams/{exam_id}/results/{student_id}", headers=admin)
+    assert response.status_code == 200, response.text
+    return response.json()["result"]
+
+def shown_letter(question, text_suffix):
+    """The letter under which this student sees the option whose text ends with text_suffix"""
+    return next(letter for letter, text in question["options"].items() if text.endswith(text_suffix))
+
+def test_correct_option_as_shown_is_graded_correct(client, admin, make_exam, make_student):
+    exam_id = make_exam(questions=8, correct="C")
+    student_id, headers = make_student()
+    questions = paper(client, exam_id, headers)
+
+    sent = {}
+    for question in questions:
+        sent[question["id"]] = shown_letter(question, "-C")
+        response = client.post(f"/exam/exams/{exam_id}/answer", headers=headers, json={
+            "student_id": student_id,
+            "question_id": question["id"],
+            "selected_answer": sent[question["id"]]
+        })
+        assert response.status_code == 200, response.text
+
+    graded = result(client, admin, exam_id, student_id)
+    assert graded["correct"] == graded["total_questions"] == 8
+    # The student gets their answers back in their own letters
+    answers = client.get(f"/exam/exams/{exam_id}/my-answers/{student_id}", headers=headers).json()["answers"]
+    assert {int(question_id): letter for question_id, letter in answers.items()} == sent
+
+def test_same_letter_is_graded_through_each_students_order(client, admin, make_exam, make_student):
+    exam_id = make_exam(questions=8, correct="A")
+    student_id, headers = make_student()
+    questions = paper(client, exam_id, headers)
+
+    for question in questions:
+        client.post(f"/exam/exams/{exam_id}/answer", headers=headers, json={
+            "student_id": student_id,
+            "question_id": question["id"],
+            "selected_answer": "A"
+        })
+
+    # Shown "A" is right only where it is the stored "A"
+    expected = sum(question["options"]["A"].endswith("-A") for question in questions)
+    assert result(client, admin, exam_id, student_id)["correct"] == expected
+
+def test_students_get_their_own_order(client, make_exam, make_student):
+    exam_id = make_exam(questions=8)
+    first = paper(client, exam_id, make_student()[1])
+    second = paper(client, exam_id, make_student()[1])
+
+    assert sorted(q["id"] for q in first) == sorted(q["id"] for q in second)
+    if shuffle.SHUFFLE_QUESTIONS or shuffle.SHUFFLE_OPTIONS:
+        assert first != second
+    # Every option is still there, only under another letter
+    for question in first:
+        index = question["question"].split()[-1]
+        assert sorted(question["options"].values()) == [f"q{index}-{letter}" for letter in "ABCDE"]
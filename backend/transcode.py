@@ -0,0 +1,166 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow missing: frames are stored as uploaded
+    Image = None
+
+from database import run_db, run_io
+from screenshot_store import store
+
+# Storage format for proctoring frames: "webp", "jpeg" or "original" (no transcoding)
+SCREENSHOT_FORMAT = os.environ.get("EXAM_SCREENSHOT_FORMAT", "webp").lower()
+SCREENSHOT_QUALITY = int(os.environ.get("EXAM_SCREENSHOT_QUALITY", "70"))
+# Frames wider than this are downscaled (0 keeps the original resolution)
+SCREENSHOT_MAX_WIDTH = int(os.environ.get("EXAM_SCREENSHOT_MAX_WIDTH", "640"))
+THUMBNAIL_SIZE = int(os.environ.get("EXAM_THUMBNAIL_SIZE", "160"))
+TRANSCODE_WORKERS = int(os.environ.get("EXAM_TRANSCODE_WORKERS", "2"))
+# Beyond this many queued frames new ones are kept as uploaded instead
+MAX_PENDING = int(os.environ.get("EXAM_TRANSCODE_MAX_PENDING", "200"))
+
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+PIL_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+def transcode_image(src_path, fmt, quality, max_width, thumbnail_size):
+    """Re-encode one frame and write its thumbnail (runs in a worker process)
+
+    Returns (path, format, size_bytes, width, height, thumbnail_path).
+    """
+    directory, name = os.path.split(src_path)
+    stem = os.path.splitext(name)[0]
+    extension = EXTENSIONS[fmt]
+
+    with Image.open(src_path) as image:
+        image = image.convert("RGB")
+        if max_width and image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            image = image.resize((max_width, height), Image.LANCZOS)
+
+        dest_path = os.path.join(directory, f"{stem}.{extension}")
+        image.save(dest_path + ".part", PIL_FORMATS[fmt], quality=quality)
+        os.replace(dest_path + ".part", dest_path)
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+        thumbnail_path = os.path.join(directory, f"{stem}_thumb.{extension}")
+        thumbnail.save(thumbnail_path, PIL_FORMATS[fmt], quality=quality)
+        width, height = image.size
+
+    if dest_path != src_path:
+        os.remove(src_path)
+    return dest_path, fmt, os.path.getsize(dest_path), width, height, thumbnail_path
+
+def _update_screenshot(conn, screenshot_id, filename, fmt, size_bytes, width, height, thumbnail):
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE screenshots
+        SET filename = ?, format = ?, size_bytes = ?, width = ?, height = ?, thumbnail = ?
+        WHERE id = ?
+    ''', (filename, fmt, size_bytes, width, height, thumbnail, screenshot_id))
+    conn.commit()
+
+def _set_filename(conn, screenshot_id, filename):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE screenshots SET filename = ? WHERE id = ?", (filename, screenshot_id))
+    conn.commit()
+
+class Transcoder:
+    """Background re-encoding of uploaded frames in a process pool
+
+    Uploads return as soon as the original is in the incoming directory; the
+    compressed frame and thumbnail are then handed to the screenshot store
+    and the screenshots row is pointed at them.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._tasks = set()
+        self.transcoded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def enabled(self):
+        return Image is not None and SCREENSHOT_FORMAT in EXTENSIONS
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS)
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Run a CPU-bound image function in the worker processes"""
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+
+    @property
+    def accepting(self):
+        """Whether a new frame should wait for transcoding before being stored"""
+        if not self.enabled:
+            return False
+        if len(self._tasks) >= MAX_PENDING:
+            self.skipped += 1
+            return False
+        return True
+
+    def schedule(self, screenshot_id, filepath, size_bytes, session):
+        """Transcode an incoming frame and hand it to the store, without waiting"""
+        task = asyncio.ensure_future(self._transcode(screenshot_id, filepath, size_bytes, session))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _transcode(self, screenshot_id, filepath, size_bytes, session):
+        try:
+            path, fmt, new_size, width, height, thumbnail_path = await self.run(
+                transcode_image,
+                filepath,
+                SCREENSHOT_FORMAT,
+                SCREENSHOT_QUALITY,
+                SCREENSHOT_MAX_WIDTH,
+                THUMBNAIL_SIZE
+            )
+            key = await run_io(store.put, path, session)
+            thumbnail_key = await run_io(store.put, thumbnail_path, session)
+            await run_db(_update_screenshot, screenshot_id, key, fmt, new_size, width, height, thumbnail_key)
+        except Exception:
+            # Keep the frame as uploaded
+            self.failed += 1
+            try:
+                if os.path.exists(filepath):
+                    key = await run_io(store.put, filepath, session)
+                    await run_db(_set_filename, screenshot_id, key)
+            except Exception:
+                pass
+            return
+        self.transcoded += 1
+        self.bytes_in += size_bytes
+        self.bytes_out += new_size
+
+    async def drain(self):
+        """Wait for queued transcodes (used on shutdown)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "format": SCREENSHOT_FORMAT,
+            "quality": SCREENSHOT_QUALITY,
+            "max_width": SCREENSHOT_MAX_WIDTH,
+            "pending": len(self._tasks),
+            "transcoded": self.transcoded,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out
+        }
+
+transcoder = Transcoder()
@@ -51,6 +51,7 @@ function App() {
   };
 
   const handleLogout = () => {
+    api.logout(role).catch(() => {});
     setRole(null);
     setIsAuthenticated(false);
     setStudentId('');
@@ -0,0 +1,115 @@
+import { api } from './api';
+
+// Answers clicked but not yet acknowledged by the server, kept in localStorage
+// so they survive dropped requests and page reloads. One journal per student
+// and exam, so leftovers of one exam are never replayed into another.
+
+const storageKey = (studentId, examId) => `answerJournal:${examId}:${studentId}`;
+
+const load = (studentId, examId) => {
+  try {
+    const journal = JSON.parse(localStorage.getItem(storageKey(studentId, examId)));
+    if (journal && Array.isArray(journal.changes)) {
+      return journal;
+    }
+  } catch (error) {
+    console.error('Unreadable answer journal, starting over:', error);
+  }
+  return { lastSeq: 0, based: false, changes: [] };
+};
+
+const save = (studentId, examId, journal) => {
+  localStorage.setItem(storageKey(studentId, examId), JSON.stringify(journal));
+};
+
+const nextSeq = (journal) =>
+  Math.max(journal.lastSeq, ...journal.changes.map((change) => change.seq)) + 1;
+
+// Renumber the queued changes above the server's last sequence
+// (another tab or device may have synced with higher numbers)
+const rebase = (journal, serverSeq) => {
+  journal.lastSeq = Math.max(journal.lastSeq, serverSeq);
+  journal.based = true;
+  journal.changes = journal.changes.map((change, index) => ({
+    ...change,
+    seq: journal.lastSeq + index + 1,
+  }));
+  return journal;
+};
+
+// 4xx answers (exam stopped, time is up, not allowed...) will not change on a
+// retry; network errors, timeouts and 5xx are worth trying again
+const isPermanent = (status) => status >= 400 && status < 500 && status !== 408 && status !== 429;
+
+const failure = (response) => ({
+  synced: false,
+  permanent: isPermanent(response.status),
+  detail: response.detail,
+});
+
+// A second tab that moved the server's sequence on could make us collide
+// again; a couple of rounds is plenty
+const MAX_ROUNDS = 3;
+
+export const answerJournal = {
+  record: (studentId, examId, questionId, selectedAnswer) => {
+    const journal = load(studentId, examId);
+    // Only the latest choice per question needs to reach the server
+    journal.changes = journal.changes.filter((change) => change.question_id !== questionId);
+    journal.changes.push({
+      seq: nextSeq(journal),
+      question_id: questionId,
+      selected_answer: selectedAnswer,
+    });
+    save(studentId, examId, journal);
+  },
+
+  // Unacknowledged answers by question, to lay over what the server returns
+  pending: (studentId, examId) =>
+    Object.fromEntries(load(studentId, examId).changes.map((change) => [change.question_id, change.selected_answer])),
+
+  // Sends the journal; resolves to { synced, permanent, detail }. synced is
+  // true once every change is acknowledged; permanent tells a failure that a
+  // retry cannot fix (the server's reason is in detail). Network errors throw.
+  sync: async (studentId, examId) => {
+    let journal = load(studentId, examId);
+    if (!journal.based) {
+      const response = await api.syncAnswers(studentId, examId, []);
+      if (!response.success) {
+        return failure(response);
+      }
+      journal = rebase(load(studentId, examId), response.last_seq);
+      save(studentId, examId, journal);
+    }
+
+    for (let round = 0; round < MAX_ROUNDS && journal.changes.length > 0; round += 1) {
+      const sent = new Set(journal.changes.map((change) => change.seq));
+      const response = await api.syncAnswers(studentId, examId, journal.changes);
+      if (!response.success) {
+        return failure(response);
+      }
+
+      journal = load(studentId, examId);
+      if (response.duplicates > 0) {
+        // Some of our sequence numbers were already used, so the server skipped
+        // those changes. Renumber everything still queued (changes superseded
+        // meanwhile are already gone) and send it again; re-applying an answer
+        // the server did take is harmless.
+        rebase(journal, response.last_seq);
+      } else {
+        // Changes recorded while the request was in flight stay queued
+        journal.lastSeq = Math.max(journal.lastSeq, response.last_seq);
+        journal.changes = journal.changes.filter((change) => !sent.has(change.seq));
+      }
+      save(studentId, examId, journal);
+      if (!(response.duplicates > 0)) {
+        break;
+      }
+    }
+    return { synced: journal.changes.length === 0, permanent: false, detail: null };
+  },
+
+  clear: (studentId, examId) => {
+    localStorage.removeItem(storageKey(studentId, examId));
+  },
+};
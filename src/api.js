@@ -1,5 +1,24 @@
 const API_BASE_URL = 'http://localhost:8000';
 
+// Session token from the last login, kept for the lifetime of the tab
+let authToken = sessionStorage.getItem('examToken');
+
+const setAuthToken = (token) => {
+  authToken = token || null;
+  if (authToken) {
+    sessionStorage.setItem('examToken', authToken);
+  } else {
+    sessionStorage.removeItem('examToken');
+  }
+};
+
+const authHeaders = (headers = {}) =>
+  authToken ? { ...headers, Authorization: `Bearer ${authToken}` } : headers;
+
+// EventSource and <img> cannot send headers, so they pass the token in the URL
+const withToken = (url) =>
+  authToken ? `${url}${url.includes('?') ? '&' : '?'}token=${encodeURIComponent(authToken)}` : url;
+
 export const api = {
   // Admin endpoints
   adminLogin: async (password) => {
@@ -10,30 +29,66 @@ export const api = {
       },
       body: JSON.stringify({ password }),
     });
-    return response.json();
+    const data = await response.json();
+    if (data.success) {
+      setAuthToken(data.token);
+    }
+    return data;
+  },
+
+  // Revokes the session token on the server and forgets it locally
+  logout: async (role) => {
+    const path = role === 'admin' ? 'admin/logout' : 'exam/logout';
+    try {
+      await fetch(`${API_BASE_URL}/${path}`, {
+        method: 'POST',
+        headers: authHeaders(),
+      });
+    } finally {
+      setAuthToken(null);
+    }
   },
 
   changeAdminPassword: async (oldPassword, newPassword) => {
     const response = await fetch(`${API_BASE_URL}/admin/change-password?old_password=${oldPassword}&new_password=${newPassword}`, {
       method: 'POST',
+      headers: authHeaders(),
     });
-    return response.json();
+    const data = await response.json();
+    if (data.success) {
+      setAuthToken(data.token);
+    }
+    return data;
   },
 
   addStudent: async (studentId, name, password) => {
     const response = await fetch(`${API_BASE_URL}/admin/add-student`, {
       method: 'POST',
-      headers: {
+      headers: authHeaders({
         'Content-Type': 'application/json',
-      },
+      }),
       body: JSON.stringify({ student_id: studentId, name, password }),
     });
     return response.json();
   },
 
+  // Bulk import: a CSV (student_id,name,password header) or JSON-lines file
+  importStudents: async (file, onConflict = 'skip') => {
+    const format = file.name.endsWith('.jsonl') ? 'jsonl' : 'csv';
+    const response = await fetch(`${API_BASE_URL}/admin/import-students?format=${format}&on_conflict=${onConflict}`, {
+      method: 'POST',
+      headers: authHeaders({
+        'Content-Type': format === 'jsonl' ? 'application/x-ndjson' : 'text/csv',
+      }),
+      body: file,
+    });
+    return response.json();
+  },
+
   deleteStudent: async (studentId) => {
     const response = await fetch(`${API_BASE_URL}/admin/delete-student/${studentId}`, {
       method: 'DELETE',
+      headers: authHeaders(),
     });
     return response.json();
   },
@@ -41,9 +96,9 @@ export const api = {
   uploadQuestions: async (questions) => {
     const response = await fetch(`${API_BASE_URL}/admin/upload-questions`, {
       method: 'POST',
-      headers: {
+      headers: authHeaders({
         'Content-Type': 'application/json',
-      },
+      }),
       body: JSON.stringify({ questions }),
     });
     return response.json();
@@ -52,6 +107,7 @@ export const api = {
   startExam: async (durationMinutes = 60) => {
     const response = await fetch(`${API_BASE_URL}/admin/start-exam?duration_minutes=${durationMinutes}`, {
       method: 'POST',
+      headers: authHeaders(),
     });
     return response.json();
   },
@@ -59,22 +115,68 @@ export const api = {
   stopExam: async () => {
     const response = await fetch(`${API_BASE_URL}/admin/stop-exam`, {
       method: 'POST',
+      headers: authHeaders(),
+    });
+    return response.json();
+  },
+
+  // Extra minutes for one student, or for everybody when studentId is omitted
+  extendTime: async (minutes, studentId) => {
+    const student = studentId ? `&student_id=${encodeURIComponent(studentId)}` : '';
+    const response = await fetch(`${API_BASE_URL}/admin/extend-time?minutes=${minutes}${student}`, {
+      method: 'POST',
+      headers: authHeaders(),
+    });
+    return response.json();
+  },
+
+  getAttempts: async () => {
+    const response = await fetch(`${API_BASE_URL}/admin/attempts`, { headers: authHeaders() });
+    return response.json();
+  },
+
+  // Exams: every exam route also exists under /admin/exams/{examId}/...
+  getExams: async () => {
+    const response = await fetch(`${API_BASE_URL}/admin/exams`, { headers: authHeaders() });
+    return response.json();
+  },
+
+  createExam: async (title, durationMinutes = 60) => {
+    const response = await fetch(`${API_BASE_URL}/admin/exams`, {
+      method: 'POST',
+      headers: authHeaders({
+        'Content-Type': 'application/json',
+      }),
+      body: JSON.stringify({ title, duration_minutes: durationMinutes }),
     });
     return response.json();
   },
 
   getStudents: async () => {
-    const response = await fetch(`${API_BASE_URL}/admin/students`);
+    const response = await fetch(`${API_BASE_URL}/admin/students`, { headers: authHeaders() });
     return response.json();
   },
 
   getAdminExamStatus: async () => {
-    const response = await fetch(`${API_BASE_URL}/admin/exam-status`);
+    const response = await fetch(`${API_BASE_URL}/admin/exam-status`, { headers: authHeaders() });
+    return response.json();
+  },
+
+  subscribeAdminEvents: (onStatus, onStudents) => {
+    const source = new EventSource(withToken(`${API_BASE_URL}/admin/events`));
+    source.addEventListener('status', (event) => onStatus(JSON.parse(event.data)));
+    source.addEventListener('students', (event) => onStudents(JSON.parse(event.data)));
+    return source;
+  },
+
+  // Live per-student progress; pass the last returned version to get only changes
+  getProgress: async (since = 0) => {
+    const response = await fetch(`${API_BASE_URL}/admin/progress?since=${since}`, { headers: authHeaders() });
     return response.json();
   },
 
   getSubmissions: async () => {
-    const response = await fetch(`${API_BASE_URL}/admin/submissions`);
+    const response = await fetch(`${API_BASE_URL}/admin/submissions`, { headers: authHeaders() });
     return response.json();
   },
 
@@ -87,30 +189,44 @@ export const api = {
       },
       body: JSON.stringify({ student_id: studentId, password }),
     });
-    return response.json();
+    const data = await response.json();
+    if (data.success) {
+      setAuthToken(data.token);
+    }
+    return data;
+  },
+
+  // Server-Sent Events: calls onStatus with each exam status change
+  subscribeExamEvents: (onStatus) => {
+    const source = new EventSource(`${API_BASE_URL}/exam/events`);
+    source.addEventListener('status', (event) => onStatus(JSON.parse(event.data)));
+    return source;
   },
 
   getExamStatus: async () => {
-    const response = await fetch(`${API_BASE_URL}/exam/status`);
+    const response = await fetch(`${API_BASE_URL}/exam/status`, { headers: authHeaders() });
     return response.json();
   },
 
-  getAllQuestions: async () => {
-    const response = await fetch(`${API_BASE_URL}/exam/questions`);
+  // Questions and options come back in this student's own shuffled order
+  getAllQuestions: async (studentId) => {
+    const query = studentId ? `?student_id=${encodeURIComponent(studentId)}` : '';
+    const response = await fetch(`${API_BASE_URL}/exam/questions${query}`, { headers: authHeaders() });
     return response.json();
   },
 
-  getQuestion: async (questionId) => {
-    const response = await fetch(`${API_BASE_URL}/exam/question/${questionId}`);
+  getQuestion: async (questionId, studentId) => {
+    const query = studentId ? `?student_id=${encodeURIComponent(studentId)}` : '';
+    const response = await fetch(`${API_BASE_URL}/exam/question/${questionId}${query}`, { headers: authHeaders() });
     return response.json();
   },
 
   submitAnswer: async (studentId, questionId, selectedAnswer) => {
     const response = await fetch(`${API_BASE_URL}/exam/answer`, {
       method: 'POST',
-      headers: {
+      headers: authHeaders({
         'Content-Type': 'application/json',
-      },
+      }),
       body: JSON.stringify({
         student_id: studentId,
         question_id: questionId,
@@ -120,15 +236,49 @@ export const api = {
     return response.json();
   },
 
+  // Batch of journaled answer changes ({ seq, question_id, selected_answer });
+  // resending is harmless, the server skips sequences it already applied.
+  // The HTTP status is passed along so callers can tell lasting errors apart.
+  syncAnswers: async (studentId, examId, changes) => {
+    const response = await fetch(`${API_BASE_URL}/exam/exams/${examId}/answers/sync`, {
+      method: 'POST',
+      headers: authHeaders({
+        'Content-Type': 'application/json',
+      }),
+      body: JSON.stringify({
+        student_id: studentId,
+        changes,
+      }),
+    });
+    const data = await response.json().catch(() => ({}));
+    return { ...data, status: response.status };
+  },
+
   submitExam: async (studentId) => {
     const response = await fetch(`${API_BASE_URL}/exam/submit?student_id=${studentId}`, {
       method: 'POST',
+      headers: authHeaders(),
     });
     return response.json();
   },
 
   getMyAnswers: async (studentId) => {
-    const response = await fetch(`${API_BASE_URL}/exam/my-answers/${studentId}`);
+    const response = await fetch(`${API_BASE_URL}/exam/my-answers/${studentId}`, { headers: authHeaders() });
+    return response.json();
+  },
+
+  // Keeps the student shown as online on the admin dashboard
+  sendHeartbeat: async (studentId) => {
+    const response = await fetch(`${API_BASE_URL}/exam/heartbeat?student_id=${encodeURIComponent(studentId)}`, {
+      method: 'POST',
+      headers: authHeaders(),
+    });
+    return response.json();
+  },
+
+  // The student's own deadline and remaining time, as kept by the server
+  getMyTime: async (studentId) => {
+    const response = await fetch(`${API_BASE_URL}/exam/my-time/${studentId}`, { headers: authHeaders() });
     return response.json();
   },
 
@@ -136,9 +286,9 @@ export const api = {
   uploadScreenshot: async (studentId, imageData) => {
     const response = await fetch(`${API_BASE_URL}/proctor/screenshot`, {
       method: 'POST',
-      headers: {
+      headers: authHeaders({
         'Content-Type': 'application/json',
-      },
+      }),
       body: JSON.stringify({
         student_id: studentId,
         image_data: imageData,
@@ -147,8 +297,30 @@ export const api = {
     return response.json();
   },
 
-  getStudentScreenshots: async (studentId) => {
-    const response = await fetch(`${API_BASE_URL}/proctor/screenshots/${studentId}`);
+  // Binary upload: the frame is sent as raw image bytes instead of a base64 data URL
+  uploadScreenshotBlob: async (studentId, blob) => {
+    const response = await fetch(`${API_BASE_URL}/proctor/screenshot/${encodeURIComponent(studentId)}`, {
+      method: 'POST',
+      headers: authHeaders({
+        'Content-Type': blob.type,
+      }),
+      body: blob,
+    });
     return response.json();
   },
+
+  // Paged, newest first: pass { from, to, limit, cursor } and follow next_cursor
+  getStudentScreenshots: async (studentId, { from, to, limit, cursor } = {}) => {
+    const params = new URLSearchParams();
+    if (from) params.set('from', from);
+    if (to) params.set('to', to);
+    if (limit) params.set('limit', limit);
+    if (cursor) params.set('cursor', cursor);
+    const query = params.toString() ? `?${params}` : '';
+    const response = await fetch(`${API_BASE_URL}/proctor/screenshots/${encodeURIComponent(studentId)}${query}`, { headers: authHeaders() });
+    return response.json();
+  },
+
+  frameUrl: (screenshot, thumbnail = false) =>
+    withToken(`${API_BASE_URL}/proctor/frame/${screenshot.id}${thumbnail ? '?thumbnail=true' : ''}`),
 };
@@ -1,7 +1,10 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { api } from '../api';
 import '../styles/admin.css';
 
+// The progress board is refreshed this often; each refresh only carries changes
+const PROGRESS_REFRESH_MS = 5000;
+
 const AdminDashboard = () => {
   const [examStatus, setExamStatus] = useState({
     is_active: false,
@@ -11,6 +14,8 @@ const AdminDashboard = () => {
   });
   const [students, setStudents] = useState([]);
   const [submissions, setSubmissions] = useState([]);
+  const [progress, setProgress] = useState({});
+  const progressVersionRef = useRef(0);
   const [activeTab, setActiveTab] = useState('overview');
   const [questionsJson, setQuestionsJson] = useState('');
   const [duration, setDuration] = useState(60);
@@ -24,13 +29,36 @@ const AdminDashboard = () => {
   useEffect(() => {
     loadExamStatus();
     loadStudents();
-    const interval = setInterval(() => {
-      loadExamStatus();
-      loadStudents();
-    }, 5000);
+    // Refresh only when the server reports a change
+    const source = api.subscribeAdminEvents(
+      () => loadExamStatus(),
+      () => {
+        loadStudents();
+        loadExamStatus();
+      },
+    );
+    return () => source.close();
+  }, []);
+
+  useEffect(() => {
+    loadProgress();
+    const interval = setInterval(loadProgress, PROGRESS_REFRESH_MS);
     return () => clearInterval(interval);
   }, []);
 
+  const loadProgress = async () => {
+    try {
+      const response = await api.getProgress(progressVersionRef.current);
+      if (response.success) {
+        const changed = Object.fromEntries(response.students.map((row) => [row.student_id, row]));
+        setProgress((previous) => (response.reset ? changed : { ...previous, ...changed }));
+        progressVersionRef.current = response.version;
+      }
+    } catch (error) {
+      console.error('Error loading progress:', error);
+    }
+  };
+
   const loadExamStatus = async () => {
     try {
       const response = await api.getAdminExamStatus();
@@ -81,6 +109,31 @@ const AdminDashboard = () => {
     setTimeout(() => setMessage({ text: '', type: '' }), 3000);
   };
 
+  const handleImportStudents = async (e) => {
+    const file = e.target.files[0];
+    e.target.value = '';
+    if (!file) return;
+    try {
+      const response = await api.importStudents(file);
+      if (response.success) {
+        const skipped = response.conflicts + response.invalid;
+        setMessage({
+          text: `${response.message}${skipped ? `, ${skipped} rows skipped` : ''}`,
+          type: skipped ? 'error' : 'success',
+        });
+        if (response.errors.length) {
+          console.warn('Student import problems:', response.errors);
+        }
+        loadStudents();
+      } else {
+        setMessage({ text: response.detail || 'Import failed', type: 'error' });
+      }
+    } catch (error) {
+      setMessage({ text: 'Failed to import students', type: 'error' });
+    }
+    setTimeout(() => setMessage({ text: '', type: '' }), 5000);
+  };
+
   const handleDeleteStudent = async (studentId) => {
     if (window.confirm(`Delete student ${studentId}?`)) {
       try {
@@ -231,6 +284,15 @@ const AdminDashboard = () => {
                   <div className="stat-label">Registered Students</div>
                 </div>
               </div>
+              <div className="stat-card">
+                <div className="stat-icon">🟢</div>
+                <div className="stat-content">
+                  <div className="stat-value">
+                    {students.filter((student) => progress[student.student_id]?.online).length}
+                  </div>
+                  <div className="stat-label">Online Now</div>
+                </div>
+              </div>
               <div className="stat-card">
                 <div className="stat-icon">⏱️</div>
                 <div className="stat-content">
@@ -303,6 +365,10 @@ const AdminDashboard = () => {
                 />
                 <button type="submit" className="btn btn-primary">Add Student</button>
               </form>
+              <p className="help-text">
+                Or import a cohort from a CSV file with a student_id,name,password header (or a .jsonl file):
+              </p>
+              <input type="file" accept=".csv,.jsonl,text/csv" onChange={handleImportStudents} />
             </div>
 
             <div className="students-card">
@@ -381,17 +447,28 @@ const AdminDashboard = () => {
                     <tr>
                       <th>Student ID</th>
                       <th>Name</th>
+                      <th>Status</th>
+                      <th>Answered</th>
+                      <th>Last Answer</th>
+                      <th>Last Screenshot</th>
                       <th>Last Connected</th>
                     </tr>
                   </thead>
                   <tbody>
-                    {students.map((student) => (
-                      <tr key={student.student_id}>
-                        <td>{student.student_id}</td>
-                        <td>{student.name}</td>
-                        <td>{new Date(student.connected_at).toLocaleString()}</td>
-                      </tr>
-                    ))}
+                    {students.map((student) => {
+                      const row = progress[student.student_id] || {};
+                      return (
+                        <tr key={student.student_id}>
+                          <td>{student.student_id}</td>
+                          <td>{student.name}</td>
+                          <td>{row.online ? '🟢 Online' : '⚪ Offline'}</td>
+                          <td>{row.answered || 0} / {examStatus.total_questions}</td>
+                          <td>{row.last_answer_at ? new Date(row.last_answer_at).toLocaleTimeString() : '-'}</td>
+                          <td>{row.last_screenshot_at ? new Date(row.last_screenshot_at).toLocaleTimeString() : '-'}</td>
+                          <td>{new Date(student.connected_at).toLocaleString()}</td>
+                        </tr>
+                      );
+                    })}
                   </tbody>
                 </table>
               )}
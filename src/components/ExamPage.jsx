@@ -1,7 +1,13 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { api } from '../api';
+import { answerJournal } from '../answerJournal';
 import '../styles/exam.css';
 
+// Journaled answers are sent this often (well within the server's grace period)
+const ANSWER_SYNC_MS = 3000;
+// Well under the server's offline threshold (45 seconds by default)
+const HEARTBEAT_MS = 15000;
+
 const ExamPage = ({ studentId, studentName }) => {
   const [examStatus, setExamStatus] = useState({ is_active: false, total_questions: 0 });
   const [questions, setQuestions] = useState([]);
@@ -17,11 +23,18 @@ const ExamPage = ({ studentId, studentName }) => {
   const canvasRef = useRef(null);
   const streamRef = useRef(null);
   const screenshotIntervalRef = useRef(null);
+  const examActiveRef = useRef(false);
+  const questionsLoadedRef = useRef(false);
+  const answerSyncIntervalRef = useRef(null);
+  const answerSyncRef = useRef(null);
+  const examIdRef = useRef(null);
+  const heartbeatIntervalRef = useRef(null);
 
   useEffect(() => {
+    // Initial state, then the server pushes every change (no polling)
     checkExamStatus();
-    const interval = setInterval(checkExamStatus, 3000);
-    return () => clearInterval(interval);
+    const source = api.subscribeExamEvents(applyExamStatus);
+    return () => source.close();
   }, []);
 
   useEffect(() => {
@@ -29,35 +42,68 @@ const ExamPage = ({ studentId, studentName }) => {
       loadPreviousAnswers();
       startCamera();
       startTimer();
+      startAnswerSync();
     }
     return () => {
       stopCamera();
       stopTimer();
+      stopAnswerSync();
     };
   }, [examStatus.is_active, questions.length]);
 
+  const applyExamStatus = (status) => {
+    setExamStatus(status);
+    if (status.exam_id != null) {
+      examIdRef.current = status.exam_id;
+    }
+
+    if (status.is_active && !questionsLoadedRef.current) {
+      questionsLoadedRef.current = true;
+      loadQuestions();
+      registerStudent();
+    }
+
+    if (!status.is_active && examActiveRef.current) {
+      handleExamEnd();
+    }
+    examActiveRef.current = status.is_active;
+
+    if (status.is_active && status.remaining_seconds != null) {
+      // Pushed events carry the server's countdown, avoiding client clock skew
+      setTimeRemaining(status.remaining_seconds);
+    } else if (status.is_active && status.start_time) {
+      const startTime = new Date(status.start_time).getTime();
+      const now = Date.now();
+      const elapsed = Math.floor((now - startTime) / 1000);
+      const remaining = (status.duration_minutes * 60) - elapsed;
+      setTimeRemaining(Math.max(0, remaining));
+    }
+
+    if (status.is_active) {
+      // The server keeps each student's deadline (extra time included)
+      syncTime();
+    }
+  };
+
+  const syncTime = async () => {
+    try {
+      const response = await api.getMyTime(studentId);
+      if (response.success && response.is_active) {
+        setTimeRemaining(response.remaining_seconds);
+        if (response.submitted) {
+          setExamSubmitted(true);
+        }
+      }
+    } catch (error) {
+      console.error('Error syncing exam time:', error);
+    }
+  };
+
   const checkExamStatus = async () => {
     try {
       const response = await api.getExamStatus();
       if (response.success) {
-        setExamStatus(response);
-        
-        if (response.is_active && questions.length === 0) {
-          loadQuestions();
-          registerStudent();
-        }
-        
-        if (!response.is_active && examStatus.is_active) {
-          handleExamEnd();
-        }
-        
-        if (response.is_active && response.start_time) {
-          const startTime = new Date(response.start_time).getTime();
-          const now = Date.now();
-          const elapsed = Math.floor((now - startTime) / 1000);
-          const remaining = (response.duration_minutes * 60) - elapsed;
-          setTimeRemaining(Math.max(0, remaining));
-        }
+        applyExamStatus(response);
       }
     } catch (error) {
       console.error('Error checking exam status:', error);
@@ -74,11 +120,14 @@ const ExamPage = ({ studentId, studentName }) => {
 
   const loadQuestions = async () => {
     try {
-      const response = await api.getAllQuestions();
+      const response = await api.getAllQuestions(studentId);
       if (response.success) {
         setQuestions(response.questions);
+      } else {
+        questionsLoadedRef.current = false;
       }
     } catch (error) {
+      questionsLoadedRef.current = false;
       console.error('Error loading questions:', error);
     }
   };
@@ -87,7 +136,8 @@ const ExamPage = ({ studentId, studentName }) => {
     try {
       const response = await api.getMyAnswers(studentId);
       if (response.success) {
-        setSelectedAnswers(response.answers);
+        // Clicks the server has not acknowledged yet win over its copy
+        setSelectedAnswers({ ...response.answers, ...answerJournal.pending(studentId, examIdRef.current) });
       }
     } catch (error) {
       console.error('Error loading previous answers:', error);
@@ -112,6 +162,48 @@ const ExamPage = ({ studentId, studentName }) => {
     setTimeRemaining(0);
   };
 
+  // One sync at a time; callers share the request already in flight
+  const syncAnswers = () => {
+    if (!answerSyncRef.current) {
+      answerSyncRef.current = answerJournal.sync(studentId, examIdRef.current)
+        .catch((error) => {
+          // Network errors are transient, the journal keeps the changes
+          console.error('Error syncing answers:', error);
+          return { synced: false, permanent: false };
+        })
+        .finally(() => {
+          answerSyncRef.current = null;
+        });
+    }
+    return answerSyncRef.current;
+  };
+
+  const startAnswerSync = () => {
+    syncAnswers();
+    answerSyncIntervalRef.current = setInterval(syncAnswers, ANSWER_SYNC_MS);
+    sendHeartbeat();
+    heartbeatIntervalRef.current = setInterval(sendHeartbeat, HEARTBEAT_MS);
+  };
+
+  const stopAnswerSync = () => {
+    if (answerSyncIntervalRef.current) {
+      clearInterval(answerSyncIntervalRef.current);
+      answerSyncIntervalRef.current = null;
+    }
+    if (heartbeatIntervalRef.current) {
+      clearInterval(heartbeatIntervalRef.current);
+      heartbeatIntervalRef.current = null;
+    }
+  };
+
+  const sendHeartbeat = async () => {
+    try {
+      await api.sendHeartbeat(studentId);
+    } catch (error) {
+      console.error('Error sending heartbeat:', error);
+    }
+  };
+
   const startCamera = async () => {
     try {
       const stream = await navigator.mediaDevices.getUserMedia({ 
@@ -158,27 +250,25 @@ const ExamPage = ({ studentId, studentName }) => {
     canvas.height = video.videoHeight;
     context.drawImage(video, 0, 0, canvas.width, canvas.height);
 
-    const imageData = canvas.toDataURL('image/png');
-
-    try {
-      await api.uploadScreenshot(studentId, imageData);
-    } catch (error) {
-      console.error('Error uploading screenshot:', error);
-    }
+    canvas.toBlob(async (blob) => {
+      if (!blob) return;
+      try {
+        await api.uploadScreenshotBlob(studentId, blob);
+      } catch (error) {
+        console.error('Error uploading screenshot:', error);
+      }
+    }, 'image/png');
   };
 
-  const handleAnswerSelect = async (answer) => {
+  const handleAnswerSelect = (answer) => {
     const currentQuestion = questions[currentQuestionIndex];
     setSelectedAnswers({
       ...selectedAnswers,
       [currentQuestion.id]: answer,
     });
 
-    try {
-      await api.submitAnswer(studentId, currentQuestion.id, answer);
-    } catch (error) {
-      console.error('Error submitting answer:', error);
-    }
+    // Sent with the next sync; kept locally until the server acknowledges it
+    answerJournal.record(studentId, examIdRef.current, currentQuestion.id, answer);
   };
 
   const handlePrevious = () => {
@@ -211,11 +301,24 @@ const ExamPage = ({ studentId, studentName }) => {
   const handleSubmitExam = async () => {
     if (window.confirm('Are you sure you want to submit your exam? This action cannot be undone.')) {
       try {
+        const sync = await syncAnswers();
+        if (!sync.synced && !sync.permanent) {
+          alert('Some answers could not be saved yet. Please check your connection and try again.');
+          return;
+        }
+        // A rejected sync will never succeed on retry; submit what the server has
+        if (sync.permanent) {
+          console.error('Answer sync rejected:', sync.detail);
+        }
         const response = await api.submitExam(studentId);
         if (response.success) {
+          answerJournal.clear(studentId, examIdRef.current);
           setExamSubmitted(true);
+          stopAnswerSync();
           stopCamera();
           alert('Exam submitted successfully!');
+        } else {
+          alert(`Failed to submit exam: ${response.detail || 'unknown error'}`);
         }
       } catch (error) {
         console.error('Error submitting exam:', error);
@@ -225,17 +328,19 @@ const ExamPage = ({ studentId, studentName }) => {
   };
 
   const handleAutoSubmit = async () => {
-    try {
-      await api.submitExam(studentId);
-      setExamSubmitted(true);
-      stopCamera();
-      alert('Time is up! Your exam has been automatically submitted.');
-    } catch (error) {
-      console.error('Error auto-submitting exam:', error);
+    // The server closes the attempt at the deadline; last answers still fit in its grace period
+    stopAnswerSync();
+    const sync = await syncAnswers();
+    if (sync.synced || sync.permanent) {
+      answerJournal.clear(studentId, examIdRef.current);
     }
+    setExamSubmitted(true);
+    stopCamera();
+    alert('Time is up! Your exam has been automatically submitted.');
   };
 
   const handleExamEnd = () => {
+    stopAnswerSync();
     stopCamera();
     setExamSubmitted(true);
   };